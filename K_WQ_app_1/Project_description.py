@@ -1,5 +1,5 @@
 import streamlit as st
-import geemap.foliumap as geemap
+import startup
 
 st.set_page_config(layout="wide", page_title="Projet_description | Kraków water quality monitoring 🛰️")
 
@@ -8,11 +8,9 @@ try:
 except ImportError:
     from io import StringIO
 
-@st.cache_data
-def ee_authenticate(token_name="EARTHENGINE_TOKEN"):
-    geemap.ee_initialize(token_name=token_name)
-
-ee_authenticate(token_name="EARTHENGINE_TOKEN")
+# Earth Engine is initialized and the map libraries are imported in the
+# background, once per process, while this page is read
+startup.warm_up()
 
 
 st.title("Kraków water quality monitoring🛰️")
@@ -1,6 +1,21 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import ee
+import folium
 import streamlit as st
 import geemap.foliumap as geemap
+from geemap.ee_tile_layers import EEFoliumTileLayer
+
+import startup
+
+# The EE objects below need an initialized client, whichever page loads first
+startup.initialize_ee()
 
 # Area of interest
 #aoi = ee.FeatureCollection("projects/jakub-hempel/assets/powiaty")
@@ -16,6 +31,26 @@ aoi_turb = "/home/eouser/Desktop/K_WQ/tiff_to_bands/Turb.tif"
 # Base asset path
 asset_path = 'projects/jakub-hempel/assets/'
 
+# Seconds an Earth Engine tile URL is reused before a new map ID is requested
+# (map IDs expire after a few hours)
+TILE_URL_TTL = 3 * 3600
+
+# Map IDs requested in parallel when a map needs several new layers
+TILE_URL_WORKERS = 8
+
+# Tile URLs kept per process
+TILE_URL_MAX_ENTRIES = 1024
+
+# Flooded area of the water masks: pixel scale (m), results kept on disk per
+# asset version and checked for new versions at most once per TTL. 30 m keeps
+# the sums of the 10 m masks within interactive request limits
+FLOOD_AREA_SCALE = 30
+FLOOD_AREA_CACHE = os.environ.get('FLOOD_AREA_CACHE', os.path.expanduser('~/.cache/k_wq/flood_area.json'))
+FLOOD_AREA_TTL = 3600
+
+# Dates of the water masks, for assets without system:time_start
+flood_mask_dates = {'before': '2024-08-10', 'after': '2024-09-17', 'after_month': '2024-10-16'}
+
 # Band renaming helper
 def rename_bands(name, image):
     if name.startswith('S1'):
@@ -40,57 +75,207 @@ def extract_key(name, prefix):
     return key.strip('_').lower()
 
 
+# Asset registry: every layer under asset_path, by group
+asset_groups = {
+    'S1': ['S1_before_Clip', 'S1_after_Clip', 'S1_after_month_Clip'],
+    'S2_bands': ['S2_before_bands_Clip', 'S2_after_bands_Clip', 'S2_after_month_bands_Clip'],
+    'S2_indices': ['S2_before_indices_Clip', 'S2_after_indices_Clip', 'S2_after_month_indices_Clip'],
+    'water_mask': [
+        'Water_Wetness_Before_Flood_Clip',
+        'Water_Wetness_After_Flood_Clip',
+        'Water_Wetness_After_Month_Flood_Clip'
+    ],
+    'static': ['WaterWetness_Layer', 'WWPI_Layer'],
+}
+asset_names = [name for names in asset_groups.values() for name in names]
+
+
+# All assets as renamed ee.Image proxies, built once per process
+@st.cache_resource
+def get_assets():
+    return {name: rename_bands(name, ee.Image(asset_path + name)) for name in asset_names}
+
+
+def asset_group(group, prefix):
+    assets = get_assets()
+    return {extract_key(name, prefix): assets[name] for name in asset_groups[group]}
+
+
 # Sentinel-1 images
 @st.cache_resource
 def get_flood_S1_imagery():
-    names = ['S1_before_Clip', 'S1_after_Clip', 'S1_after_month_Clip']
-    return {
-        extract_key(name, 'S1_'): rename_bands(name, ee.Image(asset_path + name))
-        for name in names
-    }
+    return asset_group('S1', 'S1_')
 
 
 # Sentinel-2 RGB
 @st.cache_resource
 def get_flood_S2_imagery():
-    names = ['S2_before_bands_Clip', 'S2_after_bands_Clip', 'S2_after_month_bands_Clip']
-    return {
-        extract_key(name, 'S2_'): rename_bands(name, ee.Image(asset_path + name))
-        for name in names
-    }
+    return asset_group('S2_bands', 'S2_')
 
 
 # Sentinel-2 Indices
 @st.cache_resource
 def get_flood_S2_indices_imagery():
-    names = ['S2_before_indices_Clip', 'S2_after_indices_Clip', 'S2_after_month_indices_Clip']
-    return {
-        extract_key(name, 'S2_'): rename_bands(name, ee.Image(asset_path + name))
-        for name in names
-    }
+    return asset_group('S2_indices', 'S2_')
 
 
 # Water/wetness classification masks
 @st.cache_resource
 def get_flood_water_mask():
-    names = [
-        'Water_Wetness_Before_Flood_Clip',
-        'Water_Wetness_After_Flood_Clip',
-        'Water_Wetness_After_Month_Flood_Clip'
-    ]
-    return {
-        extract_key(name, 'Water_Wetness_'): rename_bands(name, ee.Image(asset_path + name))
-        for name in names
-    }
+    return asset_group('water_mask', 'Water_Wetness_')
 
 
 # Static layers
 @st.cache_resource
 def get_water_wetness_layer():
-    return rename_bands('WaterWetness_Layer', ee.Image(asset_path + 'WaterWetness_Layer'))
+    return get_assets()['WaterWetness_Layer']
 
 
 @st.cache_resource
 def get_wwpi_layer():
-    return rename_bands('WWPI_Layer', ee.Image(asset_path + 'WWPI_Layer'))
+    return get_assets()['WWPI_Layer']
+
+
+# Tile URL registry: one getMapId request per (EE expression, vis_params)
+# and TTL, shared by all sessions of the process. A plain dict instead of
+# st.cache_resource, which needs the script thread's context and URLs are
+# requested from the pool threads
+_tile_urls = collections.OrderedDict()
+_tile_urls_lock = threading.Lock()
+
+# Requests Earth Engine map IDs for all sessions of the process
+executor = ThreadPoolExecutor(max_workers=TILE_URL_WORKERS, thread_name_prefix='gee_data')
+
+
+def fetch_tile_url(expression, vis_key, ee_object, vis_params):
+    key = (expression, vis_key)
+    with _tile_urls_lock:
+        cached = _tile_urls.get(key)
+    if cached and time.monotonic() - cached[1] < TILE_URL_TTL:
+        return cached[0]
+    url = EEFoliumTileLayer(ee_object, vis_params).url_format
+    with _tile_urls_lock:
+        _tile_urls[key] = (url, time.monotonic())
+        _tile_urls.move_to_end(key)
+        while len(_tile_urls) > TILE_URL_MAX_ENTRIES:
+            _tile_urls.popitem(last=False)
+    return url
+
+
+def tile_url(ee_object, vis_params=None):
+    """XYZ URL template of an EE object, requested from Earth Engine once per TTL
+
+    Keyed by the serialized expression, so the same asset with the same
+    select/mask/style and vis_params hits the cache on every rerun.
+    """
+    vis_params = vis_params or {}
+    vis_key = json.dumps(vis_params, sort_keys=True, default=str)
+    return fetch_tile_url(ee_object.serialize(), vis_key, ee_object, vis_params)
+
+
+def add_ee_layers(map_object, layers):
+    """Add (ee_object, vis_params, name) layers to a folium map from cached tile URLs
+
+    URLs missing from the cache are requested in parallel.
+    """
+    layers = list(layers)
+    with startup.timed('ee_layers') as record:
+        if len(layers) > 1:
+            urls = list(executor.map(lambda layer: tile_url(layer[0], layer[1]), layers))
+        else:
+            urls = [tile_url(ee_object, vis_params) for ee_object, vis_params, name in layers]
+        if record is not None:
+            record['layers'] = record.get('layers', 0) + len(layers)
+    for (ee_object, vis_params, name), url in zip(layers, urls):
+        folium.raster_layers.TileLayer(
+            tiles=url,
+            attr="Google Earth Engine",
+            name=name,
+            overlay=True,
+            control=True,
+            max_zoom=24,
+        ).add_to(map_object)
+
+
+def add_ee_layer(map_object, ee_object, vis_params=None, name="Layer untitled"):
+    """Map.addLayer from the tile URL registry"""
+    add_ee_layers(map_object, [(ee_object, vis_params, name)])
+
+
+def read_flood_area_cache():
+    if not os.path.exists(FLOOD_AREA_CACHE):
+        return {}
+    with open(FLOOD_AREA_CACHE) as f:
+        return json.load(f)
+
+
+def write_flood_area_cache(cache):
+    os.makedirs(os.path.dirname(FLOOD_AREA_CACHE), exist_ok=True)
+    with open(FLOOD_AREA_CACHE + '.part', 'w') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(FLOOD_AREA_CACHE + '.part', FLOOD_AREA_CACHE)
+
+
+def flood_mask_versions(masks):
+    """Asset version and acquisition date (when set) of every water mask, in one request"""
+    return ee.Dictionary({
+        key: {
+            'version': image.get('system:version'),
+            'date': ee.Algorithms.If(image.propertyNames().contains('system:time_start'),
+                                     image.date().format('YYYY-MM-dd'), None),
+        }
+        for key, image in masks.items()
+    }).getInfo()
+
+
+def compute_flood_areas(masks):
+    """Flooded area (m²) of every water mask and the AOI area, in one request
+
+    Each mask is summed as pixel area over its own footprint (the clipped
+    flood extent), not over the whole AOI.
+    """
+    area = ee.Image.pixelArea()
+    flooded = {
+        key: area.updateMask(image.select(0).neq(0)).reduceRegion(
+            reducer=ee.Reducer.sum(), geometry=image.geometry(), scale=FLOOD_AREA_SCALE,
+            maxPixels=1e10, tileScale=4).get('area')
+        for key, image in masks.items()
+    }
+    return ee.Dictionary({
+        'flooded': ee.Dictionary(flooded),
+        'aoi': aoi_flood.geometry().area(1),
+    }).getInfo()
+
+
+# Flood summary table of the water masks, computed server-side only for
+# asset versions not in the disk cache
+@st.cache_data(ttl=FLOOD_AREA_TTL, show_spinner=False)
+def get_flood_areas():
+    import pandas as pd
+
+    masks = get_flood_water_mask()
+    versions = flood_mask_versions(masks)
+    aoi_key = hashlib.sha1(aoi_flood.serialize().encode()).hexdigest()[:12]
+    keys = {key: f"{asset_path}{name}@{versions[key]['version']}/{aoi_key}/{FLOOD_AREA_SCALE}"
+            for key, name in zip(masks, asset_groups['water_mask'])}
+
+    cache = read_flood_area_cache()
+    missing = {key: image for key, image in masks.items() if keys[key] not in cache}
+    if missing:
+        result = compute_flood_areas(missing)
+        for key in missing:
+            cache[keys[key]] = {'flooded': result['flooded'][key], 'aoi': result['aoi']}
+        write_flood_area_cache(cache)
 
+    rows = []
+    for key in masks:
+        flooded, aoi_area = cache[keys[key]]['flooded'], cache[keys[key]]['aoi']
+        rows.append({
+            'Image': f"{versions[key]['date'] or flood_mask_dates.get(key, key)}_S1",
+            'Flooded Area (m²)': flooded,
+            'Flooded Area (ha)': flooded / 1e4,
+            'AOI Area (m²)': aoi_area,
+            'AOI Area (ha)': aoi_area / 1e4,
+            'Flood % of AOI': flooded / aoi_area * 100,
+        })
+    return pd.DataFrame(rows)
@@ -3,47 +3,11 @@ st.set_page_config(layout="wide", page_title="💧🛰️ Water quality by Senti
 
 import geemap.foliumap as geemap
 import gee_data as gd
+import startup
 from folium import plugins
-import pandas as pd
 
 
-import rasterio
-import numpy as np
-import matplotlib.pyplot as plt
-import tempfile
 import os
-from PIL import Image
-
-def add_local_geotiff(map_object, tiff_path, layer_name, colormap='viridis', vmin=None, vmax=None):
-    """Add a local GeoTIFF as an RGB overlay on a geemap folium-based map"""
-    with rasterio.open(tiff_path) as src:
-        array = src.read(1).astype(float)
-        bounds = src.bounds
-
-        # Normalize
-        if vmin is None:
-            vmin = np.nanmin(array)
-        if vmax is None:
-            vmax = np.nanmax(array)
-        array = np.clip((array - vmin) / (vmax - vmin), 0, 1)
-
-        # Apply colormap
-        cmap = plt.get_cmap(colormap)
-        rgba = cmap(array)
-        rgb = (rgba[:, :, :3] * 255).astype(np.uint8)
-
-        # Save image temporarily
-        tmpfile = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        Image.fromarray(rgb).save(tmpfile.name)
-
-        # Add to map
-        map_object.add_image(
-            image=tmpfile.name,
-            bounds=[[bounds.bottom, bounds.left], [bounds.top, bounds.right]],
-            layer_name=layer_name
-        )
-
-        os.unlink(tmpfile.name)  # Clean up
 
 st.markdown("""
 <style>
@@ -66,34 +30,23 @@ li {
 
 st.subheader("💧🛰️ Water quality by Sentinel-2")
 
-tab1, tab2, tab3, tab4 = st.tabs(["CDOM", "DOM", "Chla", "Turbidity"])
-
-# Cache the result of the image loading function
-@st.cache_data
-def load_s1_images():
-    return gd.get_flood_S1_imagery()
-s1_images = load_s1_images()
-
-
-@st.cache_data
-def load_s2_images():
-    return gd.get_flood_S2_imagery()
-s2_images = load_s2_images()
+# Lazy tabs: only the selected tab's map is built and serialized on a rerun,
+# and every tab is a fragment, so its own selectors rerun only that tab
+tab_labels = ["CDOM", "DOM", "Chla", "Turbidity"]
+active_tab = st.segmented_control("Tab", tab_labels, default=tab_labels[0], key="active_tab",
+                                  label_visibility="collapsed") or tab_labels[0]
 
+# EE image proxies are built once per process by gee_data (cache_resource, no
+# pickling)
+s1_images = gd.get_flood_S1_imagery()
+s2_images = gd.get_flood_S2_imagery()
+s2_indices_images = gd.get_flood_S2_indices_imagery()
+water_masks = gd.get_flood_water_mask()
 
-@st.cache_data
-def load_s2_indices_images():
-    return gd.get_flood_S2_indices_imagery()
-s2_indices_images = load_s2_indices_images()
 
-
-@st.cache_data
-def load_flood_water_mask():
-    return gd.get_flood_water_mask()
-water_masks = load_flood_water_mask()
-
-
-with tab1:
+@st.fragment
+@startup.timed_rerun("Sentinel-2")
+def sentinel1_tab():
     # Define display names and matching keys
     # Layer options
     #st.info("Use the selector below to switch between different **Sentinel-1 flood observations**.")
@@ -111,26 +64,27 @@ with tab1:
         key="S1"
     )
 
-    with st.spinner("Wait for the map ..."):
+    with st.spinner("Wait for the map ..."), startup.timed('map_build'):
         # --- Map Setup ---
-        with st.spinner("Adding local turbidity layer..."):
-            #turb_path = "/home/eouser/Desktop/K_WQ/tiff_to_bands/Turb.tif"  # update as needed
-            Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10)
-            Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
-    
-        #add_local_geotiff(Map, turb_path, "Turbidity (Local TIFF)", colormap="nipy_spectral", vmin=0, vmax=30)
-        Map.to_streamlit(height=700)
+        #turb_path = "/home/eouser/Desktop/K_WQ/tiff_to_bands/Turb.tif"  # update as needed
+        Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10)
 
         # Add AOI boundary
-        Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
-        #Map.addLayer(gd.aoi_turb)
+        gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+
+        # Local rasters are served as tiles, only the ones in view are rendered
+        if os.path.exists(gd.aoi_turb):
+            import tiles
+            tiles.add_local_cog(Map, gd.aoi_turb, "Turbidity (Local TIFF)", colormap="nipy_spectral", vmin=0, vmax=30)
+
         # Visualization parameters for Sentinel-1 VV band
         vis_params_s1 = {"min": -25, "max": 0}
 
         # Add selected layers
-        for label_s1 in selected_layers_s1:
-            key = layer_options_s1[label_s1]
-            Map.addLayer(s1_images[key], vis_params_s1, f"S1: {label_s1}")
+        gd.add_ee_layers(Map, [
+            (s1_images[layer_options_s1[label_s1]], vis_params_s1, f"S1: {label_s1}")
+            for label_s1 in selected_layers_s1
+        ])
 
         st.markdown(
             "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -140,9 +94,12 @@ with tab1:
         )
 
         # Display map
-        Map.to_streamlit(height=700)
+        with startup.timed('to_streamlit'):
+            Map.to_streamlit(height=700)
 
-with tab2:
+@st.fragment
+@startup.timed_rerun("Sentinel-2")
+def sentinel2_tab():
     st.info("Use the selector below to switch between different **Sentinel-2 flood observations**.")
 
     layer_options_s2 = {
@@ -158,23 +115,25 @@ with tab2:
         key="S2"
     )
 
-    with st.spinner("Wait for the map ..."):
+    with st.spinner("Wait for the map ..."), startup.timed('map_build'):
         # --- Map Setup ---
         Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10, control_scale=True)
         minimap = plugins.MiniMap()
         Map.add_child(minimap)
 
         # Add AOI boundary
-        Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+        gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
 
         # Visualization parameters for Sentinel-1 VV band
         vis_params_rgb = {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3, 'gamma': 1.3}
         vis_params_water = {'bands': ['B11', 'B8', 'B4'], 'min': 0, 'max': 0.3}
 
+        layers = []
         for label_s2 in selected_layers_s2:
             key_s2 = layer_options_s2[label_s2]
-            Map.addLayer(s2_images[key_s2], vis_params_rgb, f"S2: {label_s2} - RGB")
-            Map.addLayer(s2_images[key_s2], vis_params_water, f"S2: {label_s2} - False Color")
+            layers.append((s2_images[key_s2], vis_params_rgb, f"S2: {label_s2} - RGB"))
+            layers.append((s2_images[key_s2], vis_params_water, f"S2: {label_s2} - False Color"))
+        gd.add_ee_layers(Map, layers)
 
         st.markdown(
             "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -184,9 +143,12 @@ with tab2:
         )
 
         # Display map
-        Map.to_streamlit(height=700)
+        with startup.timed('to_streamlit'):
+            Map.to_streamlit(height=700)
 
-with tab3:
+@st.fragment
+@startup.timed_rerun("Sentinel-2")
+def indices_tab():
     st.info("Use the selector below to switch between different **Spectral Indices**.")
 
     layer_options_s2_indices = {
@@ -255,14 +217,14 @@ with tab3:
         st.markdown(indices[selected_index]["ref"], unsafe_allow_html=True)
 
     with col3:
-        with st.spinner("Wait for the map ..."):
+        with st.spinner("Wait for the map ..."), startup.timed('map_build'):
             # --- Map Setup ---
             Map = geemap.Map(layer_ctrl=True, center=[50.46, 17.19], zoom=12, control_scale=True)
             minimap = plugins.MiniMap()
             Map.add_child(minimap)
 
             # Add AOI boundary
-            Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+            gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
 
             colorScaleHex = [
                 '#496FF2',
@@ -281,9 +243,11 @@ with tab3:
                 'DOC': {'min': 10, 'max': 70, 'palette': colorScaleHex},
             }
 
-            for label_s2_indices in selected_layers_s2_indices:
-                key_s2 = layer_options_s2_indices[label_s2_indices]
-                Map.addLayer(s2_indices_images[key_s2].select(selected_index), vis_params_indices[selected_index], f"S2: {label_s2_indices}")
+            gd.add_ee_layers(Map, [
+                (s2_indices_images[layer_options_s2_indices[label_s2_indices]].select(selected_index),
+                 vis_params_indices[selected_index], f"S2: {label_s2_indices}")
+                for label_s2_indices in selected_layers_s2_indices
+            ])
 
             st.markdown(
                 "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -299,21 +263,16 @@ with tab3:
                              label=selected_index, label_size=8, bg_color='white',
                              orientation='horizontal', position=(48, 4))
             # Display map
-            Map.to_streamlit(height=750)
-
+            with startup.timed('to_streamlit'):
+                Map.to_streamlit(height=750)
 
-with tab4:
-    data = {
-        'Image': ['2024-08-10_S1', '2024-09-17_S1', '2024-10-16_S1'],
-        'Flooded Area (m²)': [6.263716e+07, 9.072615e+07, 6.489486e+07],
-        'Flooded Area (ha)': [6268.716207, 9072.614900, 6489.485646],
-        'AOI Area (m²)': [2.528720e+09, 2.528720e+09, 2.528720e+09],
-        'AOI Area (ha)': [252872.015348, 252872.015348, 252872.015348],
-        'Flood % of AOI': [2.479007, 3.587829, 2.566312]
-    }
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+@st.fragment
+@startup.timed_rerun("Sentinel-2")
+def water_mask_tab():
+    # Flooded areas of all dates, from one Earth Engine request per new asset version
+    with st.spinner("Computing flooded areas ..."):
+        df = gd.get_flood_areas()
 
     st.info("Use the selector below to switch between different **Water Masks**.")
 
@@ -333,22 +292,23 @@ with tab4:
     col1, col2 = st.columns([1.75, 1.25])
 
     with col1:
-        with st.spinner("Wait for the map ..."):
+        with st.spinner("Wait for the map ..."), startup.timed('map_build'):
             # --- Map Setup ---
             Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10, control_scale=True)
             minimap = plugins.MiniMap()
             Map.add_child(minimap)
 
             # Add AOI boundary
-            Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+            gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
 
             # Visualization parameters for Sentinel-1 VV band
             vis_params_water = {'palette': '#08519C'}
 
             # Add selected layers
-            for label_water in selected_layers_water:
-                key = layer_options_water[label_water]
-                Map.addLayer(water_masks[key].selfMask(), vis_params_water, f"Water Mask: {label_water}")
+            gd.add_ee_layers(Map, [
+                (water_masks[layer_options_water[label_water]].selfMask(), vis_params_water, f"Water Mask: {label_water}")
+                for label_water in selected_layers_water
+            ])
 
             st.markdown(
                 "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -358,7 +318,8 @@ with tab4:
             )
 
             # Display map
-            Map.to_streamlit(height=700)
+            with startup.timed('to_streamlit'):
+                Map.to_streamlit(height=700)
 
     with col2:
         st.markdown("### 📊 Flood Summary")
@@ -370,3 +331,7 @@ with tab4:
             "AOI Area (ha)": "{:,.2f}",
             "Flood % of AOI": "{:.2f}%"
         }))
+
+
+tabs = dict(zip(tab_labels, [sentinel1_tab, sentinel2_tab, indices_tab, water_mask_tab]))
+tabs[active_tab]()
@@ -3,8 +3,8 @@ st.set_page_config(layout="wide", page_title="💧🛰️ Water qualityby Sentin
 
 import geemap.foliumap as geemap
 import gee_data as gd
+import startup
 from folium import plugins
-import pandas as pd
 
 st.markdown("""
 <style>
@@ -27,34 +27,23 @@ li {
 
 st.subheader("💧🛰️ Water quality and Super Image Resolution")
 
-tab1, tab2, tab3, tab4 = st.tabs(["CDOM", "DOM", "Chla", "Turbidity"])
+# Lazy tabs: only the selected tab's map is built and serialized on a rerun,
+# and every tab is a fragment, so its own selectors rerun only that tab
+tab_labels = ["CDOM", "DOM", "Chla", "Turbidity"]
+active_tab = st.segmented_control("Tab", tab_labels, default=tab_labels[0], key="active_tab",
+                                  label_visibility="collapsed") or tab_labels[0]
 
-# Cache the result of the image loading function
-@st.cache_data
-def load_s1_images():
-    return gd.get_flood_S1_imagery()
-s1_images = load_s1_images()
+# EE image proxies are built once per process by gee_data (cache_resource, no
+# pickling)
+s1_images = gd.get_flood_S1_imagery()
+s2_images = gd.get_flood_S2_imagery()
+s2_indices_images = gd.get_flood_S2_indices_imagery()
+water_masks = gd.get_flood_water_mask()
 
 
-@st.cache_data
-def load_s2_images():
-    return gd.get_flood_S2_imagery()
-s2_images = load_s2_images()
-
-
-@st.cache_data
-def load_s2_indices_images():
-    return gd.get_flood_S2_indices_imagery()
-s2_indices_images = load_s2_indices_images()
-
-
-@st.cache_data
-def load_flood_water_mask():
-    return gd.get_flood_water_mask()
-water_masks = load_flood_water_mask()
-
-
-with tab1:
+@st.fragment
+@startup.timed_rerun("Super Image Resolution")
+def sentinel1_tab():
     # Define display names and matching keys
     # Layer options
     #st.info("Use the selector below to switch between different **Sentinel-1 flood observations**.")
@@ -72,7 +61,7 @@ with tab1:
         key="S1"
     )
 
-    with st.spinner("Wait for the map ..."):
+    with st.spinner("Wait for the map ..."), startup.timed('map_build'):
         # --- Map Setup ---
         Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10, control_scale=True)
         minimap = plugins.MiniMap()
@@ -80,15 +69,16 @@ with tab1:
 
         # Add AOI boundary
         #Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
-        Map.addLayer(gd.aoi_flood)
+        gd.add_ee_layer(Map, gd.aoi_flood)
 
         # Visualization parameters for Sentinel-1 VV band
         vis_params_s1 = {"min": -25, "max": 0}
 
         # Add selected layers
-        for label_s1 in selected_layers_s1:
-            key = layer_options_s1[label_s1]
-            Map.addLayer(s1_images[key], vis_params_s1, f"S1: {label_s1}")
+        gd.add_ee_layers(Map, [
+            (s1_images[layer_options_s1[label_s1]], vis_params_s1, f"S1: {label_s1}")
+            for label_s1 in selected_layers_s1
+        ])
 
         st.markdown(
             "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -98,9 +88,12 @@ with tab1:
         )
 
         # Display map
-        Map.to_streamlit(height=700)
+        with startup.timed('to_streamlit'):
+            Map.to_streamlit(height=700)
 
-with tab2:
+@st.fragment
+@startup.timed_rerun("Super Image Resolution")
+def sentinel2_tab():
     st.info("Use the selector below to switch between different **Sentinel-2 flood observations**.")
 
     layer_options_s2 = {
@@ -116,23 +109,25 @@ with tab2:
         key="S2"
     )
 
-    with st.spinner("Wait for the map ..."):
+    with st.spinner("Wait for the map ..."), startup.timed('map_build'):
         # --- Map Setup ---
         Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10, control_scale=True)
         minimap = plugins.MiniMap()
         Map.add_child(minimap)
 
         # Add AOI boundary
-        Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+        gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
 
         # Visualization parameters for Sentinel-1 VV band
         vis_params_rgb = {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3, 'gamma': 1.3}
         vis_params_water = {'bands': ['B11', 'B8', 'B4'], 'min': 0, 'max': 0.3}
 
+        layers = []
         for label_s2 in selected_layers_s2:
             key_s2 = layer_options_s2[label_s2]
-            Map.addLayer(s2_images[key_s2], vis_params_rgb, f"S2: {label_s2} - RGB")
-            Map.addLayer(s2_images[key_s2], vis_params_water, f"S2: {label_s2} - False Color")
+            layers.append((s2_images[key_s2], vis_params_rgb, f"S2: {label_s2} - RGB"))
+            layers.append((s2_images[key_s2], vis_params_water, f"S2: {label_s2} - False Color"))
+        gd.add_ee_layers(Map, layers)
 
         st.markdown(
             "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -142,9 +137,12 @@ with tab2:
         )
 
         # Display map
-        Map.to_streamlit(height=700)
+        with startup.timed('to_streamlit'):
+            Map.to_streamlit(height=700)
 
-with tab3:
+@st.fragment
+@startup.timed_rerun("Super Image Resolution")
+def indices_tab():
     st.info("Use the selector below to switch between different **Spectral Indices**.")
 
     layer_options_s2_indices = {
@@ -213,14 +211,14 @@ with tab3:
         st.markdown(indices[selected_index]["ref"], unsafe_allow_html=True)
 
     with col3:
-        with st.spinner("Wait for the map ..."):
+        with st.spinner("Wait for the map ..."), startup.timed('map_build'):
             # --- Map Setup ---
             Map = geemap.Map(layer_ctrl=True, center=[50.46, 17.19], zoom=12, control_scale=True)
             minimap = plugins.MiniMap()
             Map.add_child(minimap)
 
             # Add AOI boundary
-            Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+            gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
 
             colorScaleHex = [
                 '#496FF2',
@@ -239,9 +237,11 @@ with tab3:
                 'DOC': {'min': 10, 'max': 70, 'palette': colorScaleHex},
             }
 
-            for label_s2_indices in selected_layers_s2_indices:
-                key_s2 = layer_options_s2_indices[label_s2_indices]
-                Map.addLayer(s2_indices_images[key_s2].select(selected_index), vis_params_indices[selected_index], f"S2: {label_s2_indices}")
+            gd.add_ee_layers(Map, [
+                (s2_indices_images[layer_options_s2_indices[label_s2_indices]].select(selected_index),
+                 vis_params_indices[selected_index], f"S2: {label_s2_indices}")
+                for label_s2_indices in selected_layers_s2_indices
+            ])
 
             st.markdown(
                 "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -257,21 +257,16 @@ with tab3:
                              label=selected_index, label_size=8, bg_color='white',
                              orientation='horizontal', position=(48, 4))
             # Display map
-            Map.to_streamlit(height=750)
-
+            with startup.timed('to_streamlit'):
+                Map.to_streamlit(height=750)
 
-with tab4:
-    data = {
-        'Image': ['2024-08-10_S1', '2024-09-17_S1', '2024-10-16_S1'],
-        'Flooded Area (m²)': [6.263716e+07, 9.072615e+07, 6.489486e+07],
-        'Flooded Area (ha)': [6268.716207, 9072.614900, 6489.485646],
-        'AOI Area (m²)': [2.528720e+09, 2.528720e+09, 2.528720e+09],
-        'AOI Area (ha)': [252872.015348, 252872.015348, 252872.015348],
-        'Flood % of AOI': [2.479007, 3.587829, 2.566312]
-    }
 
-    # Create DataFrame
-    df = pd.DataFrame(data)
+@st.fragment
+@startup.timed_rerun("Super Image Resolution")
+def water_mask_tab():
+    # Flooded areas of all dates, from one Earth Engine request per new asset version
+    with st.spinner("Computing flooded areas ..."):
+        df = gd.get_flood_areas()
 
     st.info("Use the selector below to switch between different **Water Masks**.")
 
@@ -291,22 +286,23 @@ with tab4:
     col1, col2 = st.columns([1.75, 1.25])
 
     with col1:
-        with st.spinner("Wait for the map ..."):
+        with st.spinner("Wait for the map ..."), startup.timed('map_build'):
             # --- Map Setup ---
             Map = geemap.Map(layer_ctrl=True, center=[50.39, 17.05], zoom=10, control_scale=True)
             minimap = plugins.MiniMap()
             Map.add_child(minimap)
 
             # Add AOI boundary
-            Map.addLayer(gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
+            gd.add_ee_layer(Map, gd.aoi_flood.style(color='red', fillColor='00000000', width=2), {}, 'Flood AOI')
 
             # Visualization parameters for Sentinel-1 VV band
             vis_params_water = {'palette': '#08519C'}
 
             # Add selected layers
-            for label_water in selected_layers_water:
-                key = layer_options_water[label_water]
-                Map.addLayer(water_masks[key].selfMask(), vis_params_water, f"Water Mask: {label_water}")
+            gd.add_ee_layers(Map, [
+                (water_masks[layer_options_water[label_water]].selfMask(), vis_params_water, f"Water Mask: {label_water}")
+                for label_water in selected_layers_water
+            ])
 
             st.markdown(
                 "<div style='text-align: right; font-size: 0.90em; color: gray;'>"
@@ -316,7 +312,8 @@ with tab4:
             )
 
             # Display map
-            Map.to_streamlit(height=700)
+            with startup.timed('to_streamlit'):
+                Map.to_streamlit(height=700)
 
     with col2:
         st.markdown("### 📊 Flood Summary")
@@ -328,3 +325,7 @@ with tab4:
             "AOI Area (ha)": "{:,.2f}",
             "Flood % of AOI": "{:.2f}%"
         }))
+
+
+tabs = dict(zip(tab_labels, [sentinel1_tab, sentinel2_tab, indices_tab, water_mask_tab]))
+tabs[active_tab]()
@@ -3,15 +3,10 @@ st.set_page_config(layout="wide", page_title="💦 Water and Wetness Layer | Hyd
 
 import geemap.foliumap as geemap
 import gee_data as gd
+import startup
 from folium import plugins
 
 
-# Load the water & wetness layer
-@st.cache_data
-def load_wetness_layer():
-    return gd.get_water_wetness_layer()
-
-
 # Page title
 st.subheader("💦 Water & Wetness Layer")
 
@@ -23,8 +18,8 @@ vis_params = {
     'palette': palette
 }
 
-# Load layer
-wetness_layer = load_wetness_layer()
+# Load layer (built once per process by gee_data)
+wetness_layer = gd.get_water_wetness_layer()
 
 legend_dict = {
     "Permanent Water": "#1d3f94",
@@ -55,12 +50,12 @@ with col1:
     - :gray-background[**Temporary Wet**]: Areas that are occasionally wet, typically during wetter seasons or extreme events.
     """)
 
-with col3:
+with col3, startup.rerun_timings("Water & Wetness"):
     # Map setup
-    with st.spinner("Wait for the map ..."):
+    with st.spinner("Wait for the map ..."), startup.timed('map_build'):
         Map = geemap.Map(center=[50.10, 19.95], zoom=10, control_scale=True, layer_ctrl=True)
-        Map.addLayer(gd.aoi.style(color='red', fillColor='00000000', width=2), {},"AOI Boundary")
-        Map.addLayer(wetness_layer.updateMask(wetness_layer.neq(0)), vis_params, "Water & Wetness Layer")
+        gd.add_ee_layer(Map, gd.aoi.style(color='red', fillColor='00000000', width=2), {},"AOI Boundary")
+        gd.add_ee_layer(Map, wetness_layer.updateMask(wetness_layer.neq(0)), vis_params, "Water & Wetness Layer")
 
         # Tip
         st.markdown(
@@ -70,4 +65,5 @@ with col3:
         )
 
         Map.add_legend(title="Water & Wetness Layer", legend_dict=legend_dict)
-        Map.to_streamlit(height=700)
+        with startup.timed('to_streamlit'):
+            Map.to_streamlit(height=700)
@@ -0,0 +1,172 @@
+"""Cold start of the app: Earth Engine initialization, warm-up and import profiler.
+
+Earth Engine is initialized once per process (not once per session), before
+gee_data builds its EE objects. The landing page starts a background warm-up
+that initializes EE and imports the map libraries while the user reads it,
+so the first map page does not pay for them.
+
+    import startup
+    startup.initialize_ee()   # once per process, any page
+    startup.warm_up()         # landing page, returns immediately
+
+Import time per module, slowest first (each in a fresh interpreter):
+
+    python startup.py
+    python startup.py geemap.foliumap rasterio
+
+With K_WQ_PROFILE_IMPORTS=1 the running app also logs how long the first
+import of every top-level package took in the process.
+
+With K_WQ_METRICS=app_metrics.jsonl every rerun of a map tab appends its
+stage timings (pipeline/metrics.py records) to that file:
+
+    @st.fragment
+    @startup.timed_rerun("Sentinel-2")
+    def indices_tab():
+        with st.spinner("Wait for the map ..."), startup.timed('map_build'):
+            ...
+
+    python ../pipeline/metrics.py app_metrics.jsonl --by page tab stage
+"""
+import builtins
+import contextlib
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import streamlit as st
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline'))
+import metrics  # noqa: E402
+
+# Modules imported by the pages, profiled by default
+APP_MODULES = ['streamlit', 'ee', 'geemap.foliumap', 'folium', 'pandas', 'numpy',
+               'rasterio', 'PIL.Image', 'matplotlib.pyplot', 'tiles']
+
+# Modules imported in the background by warm_up
+WARM_UP_MODULES = ['geemap.foliumap', 'folium.plugins', 'pandas']
+
+# First-import time (s) of every top-level package, when profiling
+import_times = {}
+_import = builtins.__import__
+_depth = threading.local()
+
+# Recorder of the rerun running in this script thread, when recording
+_rerun = threading.local()
+
+# Earth Engine initialized in this process, by a page or by the warm-up thread
+_ee_lock = threading.Lock()
+_ee_initialized = False
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    package = name.split('.')[0]
+    if level or package in sys.modules or getattr(_depth, 'value', 0):
+        return _import(name, globals, locals, fromlist, level)
+    _depth.value = 1
+    start = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        _depth.value = 0
+        import_times[package] = time.perf_counter() - start
+        print(f"[startup] import {package}: {import_times[package]:.3f} s", file=sys.stderr)
+
+
+def profile_imports():
+    """Time the first import of every top-level package from now on"""
+    builtins.__import__ = _timed_import
+
+
+def _initialize_ee(token_name="EARTHENGINE_TOKEN"):
+    # Plain function: safe outside a script run, e.g. in the warm-up thread
+    global _ee_initialized
+    with _ee_lock:
+        if not _ee_initialized:
+            import geemap.foliumap as geemap
+
+            geemap.ee_initialize(token_name=token_name)
+            _ee_initialized = True
+
+
+@st.cache_resource(show_spinner=False)
+def initialize_ee(token_name="EARTHENGINE_TOKEN"):
+    _initialize_ee(token_name)
+    return True
+
+
+def _warm_up():
+    # No st.* calls here: the thread has no script run context
+    _initialize_ee()
+    for module in WARM_UP_MODULES:
+        __import__(module)
+
+
+@st.cache_resource(show_spinner=False)
+def warm_up():
+    """Initialize EE and import the map libraries in a background thread, once per process"""
+    thread = threading.Thread(target=_warm_up, daemon=True)
+    thread.start()
+    return thread
+
+
+def import_report(modules=APP_MODULES):
+    """Cumulative import time (s) of each module in a fresh interpreter, slowest first"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    code = 'import sys, time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)'
+    times = {}
+    for module in modules:
+        result = subprocess.run([sys.executable, '-c', code.format(module)],
+                                capture_output=True, text=True, cwd=app_dir)
+        times[module] = float(result.stdout.split()[-1]) if result.returncode == 0 else None
+    return dict(sorted(times.items(), key=lambda item: -(item[1] or 0)))
+
+
+@contextlib.contextmanager
+def rerun_timings(page, tab=None):
+    """Record the stages of one rerun of a page (or of one of its tabs)"""
+    if not metrics.enabled():
+        yield
+        return
+    rerun = st.session_state.get('_metrics_rerun', 0) + 1
+    st.session_state['_metrics_rerun'] = rerun
+    recorder = metrics.Recorder(source='app', page=page, tab=tab, rerun=rerun)
+    _rerun.recorder = recorder
+    try:
+        with recorder.stage('rerun'):
+            yield
+    finally:
+        _rerun.recorder = None
+        recorder.flush()
+
+
+def timed_rerun(page):
+    """Decorator recording every run of a tab fragment, labelled with its function name"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with rerun_timings(page, function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed(name):
+    """Stage of the current rerun, yields its record (None when not recording)"""
+    recorder = getattr(_rerun, 'recorder', None)
+    return recorder.stage(name) if recorder is not None else contextlib.nullcontext()
+
+
+if os.environ.get('K_WQ_PROFILE_IMPORTS'):
+    profile_imports()
+
+if os.environ.get('K_WQ_METRICS'):
+    metrics.configure(os.environ['K_WQ_METRICS'])
+
+
+if __name__ == '__main__':
+    for module, seconds in import_report(sys.argv[1:] or APP_MODULES).items():
+        print(f"{module:20s} {'failed' if seconds is None else f'{seconds:7.3f} s'}")
@@ -0,0 +1,320 @@
+"""XYZ tile server for local GeoTIFFs/COGs shown on the folium maps.
+
+Started once per Streamlit process in a background thread. Only tiles in view
+are rendered, each from the overview level matching its zoom, and kept in a
+bounded LRU cache (in memory, optionally also on disk) keyed by file, mtime,
+colormap and value range, so panning back or rerunning the page is free.
+
+    import tiles
+    tiles.add_local_cog(Map, "Turb.tif", "Turbidity", colormap="nipy_spectral", vmin=0, vmax=30)
+
+A whole raster as a single image (folium ImageOverlay) comes from overlay(),
+an overview-sized PNG cached the same way.
+
+The browser must reach the server: TILE_SERVER_URL sets the public URL when
+the app runs behind a proxy (default http://localhost:TILE_SERVER_PORT, or
+the free port taken instead when another process already uses it).
+"""
+import base64
+import collections
+import functools
+import hashlib
+import io
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+# uint8 LUT colorization shared with the processing pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline'))
+import colorize as palettes  # noqa: E402
+
+TILE_SIZE = 256
+
+# Half the width of the Web Mercator world in metres
+ORIGIN = 20037508.342789244
+
+HOST = os.environ.get('TILE_SERVER_HOST', '127.0.0.1')
+PORT = int(os.environ.get('TILE_SERVER_PORT', 8765))
+PUBLIC_URL = os.environ.get('TILE_SERVER_URL')
+
+# Rendered tiles kept in memory (a tile is a few kB to tens of kB)
+MEMORY_TILES = 4096
+
+# Optional on-disk tile cache and its size limit
+DISK_CACHE_DIR = os.environ.get('TILE_CACHE_DIR')
+DISK_CACHE_BYTES = 512 * 1024 ** 2
+
+WEB_MERCATOR = CRS.from_epsg(3857)
+
+# Files that may be served, by token
+_files = {}
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+_server = None
+_disk_writes = 0
+
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (left, bottom, right, top) of an XYZ tile"""
+    size = 2 * ORIGIN / 2 ** z
+    left = -ORIGIN + x * size
+    top = ORIGIN - y * size
+    return left, top - size, left + size, top
+
+
+def overview_level(src, resolution):
+    """Index of the coarsest overview not coarser than resolution, None for full resolution"""
+    factors = src.overviews(1)
+    level = None
+    for i, factor in enumerate(factors):
+        if abs(src.res[0]) * factor <= resolution:
+            level = i
+    return level
+
+
+@functools.lru_cache(maxsize=256)
+def raster_info(path, mtime):
+    """Web Mercator bounds and embedded palette of a file"""
+    with rasterio.open(path) as src:
+        bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+        try:
+            colormap = src.colormap(1) if src.dtypes[0] == 'uint8' else None
+        except ValueError:
+            colormap = None
+    return bounds, colormap
+
+
+def read_tile(path, z, x, y):
+    """Band 1 of a tile (masked array) from the overview matching the zoom, None outside the file"""
+    left, bottom, right, top = tile_bounds(z, x, y)
+    (file_left, file_bottom, file_right, file_top), colormap = raster_info(path, os.path.getmtime(path))
+    if left >= file_right or right <= file_left or bottom >= file_top or top <= file_bottom:
+        return None, colormap
+
+    with rasterio.open(path) as src:
+        # Tile resolution in source units, for picking the overview
+        src_left, _, src_right, _ = transform_bounds(
+            WEB_MERCATOR, src.crs, max(left, file_left), max(bottom, file_bottom),
+            min(right, file_right), min(top, file_top))
+        level = overview_level(src, (src_right - src_left) / TILE_SIZE * (right - left) / (min(right, file_right) - max(left, file_left)))
+
+    try:
+        with rasterio.open(path, overview_level=level) if level is not None else rasterio.open(path) as src:
+            with WarpedVRT(src, crs=WEB_MERCATOR, transform=from_bounds(left, bottom, right, top, TILE_SIZE, TILE_SIZE),
+                           width=TILE_SIZE, height=TILE_SIZE, resampling=Resampling.nearest) as vrt:
+                return vrt.read(1, masked=True), colormap
+    except rasterio.errors.RasterioIOError:
+        return None, colormap
+
+
+def colorize(data, colormap, vmin, vmax, embedded=None):
+    """RGBA image of a masked band: embedded palette for paletted uint8, LUT otherwise"""
+    if embedded and colormap is None:
+        palette = np.zeros((256, 4), np.uint8)
+        for value, color in embedded.items():
+            palette[value] = color
+        rgba = palette[data.filled(0)]
+        rgba[np.ma.getmaskarray(data), 3] = 0
+        return rgba
+    return palettes.colorize(data, colormap or 'viridis', vmin, vmax)
+
+
+def render(path, z, x, y, colormap, vmin, vmax):
+    data, embedded = read_tile(path, z, x, y)
+    if data is None or np.ma.getmaskarray(data).all():
+        rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8)
+    else:
+        rgba = colorize(data, colormap, vmin, vmax, embedded)
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+def disk_path(key):
+    return os.path.join(DISK_CACHE_DIR, hashlib.sha1(repr(key).encode()).hexdigest() + '.png')
+
+
+def prune_disk_cache():
+    # Least recently written tiles go first
+    files = [os.path.join(DISK_CACHE_DIR, file) for file in os.listdir(DISK_CACHE_DIR)]
+    files = sorted(((os.stat(file), file) for file in files), key=lambda item: item[0].st_mtime)
+    total = sum(stat.st_size for stat, file in files)
+    for stat, file in files:
+        if total <= DISK_CACHE_BYTES * 0.8:
+            break
+        os.remove(file)
+        total -= stat.st_size
+
+
+def cached_tile(path, z, x, y, colormap=None, vmin=0.0, vmax=1.0):
+    """PNG bytes of a tile, from the LRU cache when possible"""
+    key = (path, os.path.getmtime(path), colormap, vmin, vmax, z, x, y)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    png = None
+    if DISK_CACHE_DIR and os.path.exists(disk_path(key)):
+        with open(disk_path(key), 'rb') as f:
+            png = f.read()
+    if png is None:
+        png = render(path, z, x, y, colormap, vmin, vmax)
+        if DISK_CACHE_DIR:
+            os.makedirs(DISK_CACHE_DIR, exist_ok=True)
+            with open(disk_path(key) + '.tmp', 'wb') as f:
+                f.write(png)
+            os.replace(disk_path(key) + '.tmp', disk_path(key))
+            global _disk_writes
+            _disk_writes += 1
+            if _disk_writes % 256 == 0:
+                prune_disk_cache()
+
+    with _lock:
+        _cache[key] = png
+        while len(_cache) > MEMORY_TILES:
+            _cache.popitem(last=False)
+    return png
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    # /tiles/{token}/{z}/{x}/{y}.png?colormap=...&vmin=...&vmax=...
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 5 or parts[0] != 'tiles' or parts[1] not in _files or not parts[4].endswith('.png'):
+            self.send_error(404)
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            z, x, y = int(parts[2]), int(parts[3]), int(parts[4][:-len('.png')])
+            png = cached_tile(_files[parts[1]], z, x, y, query.get('colormap'),
+                              float(query.get('vmin', 0)), float(query.get('vmax', 1)))
+        except (ValueError, OSError) as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(png)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(png)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def band_statistics(src):
+    """Approximate band 1 statistics (from overviews, kept in the .aux.xml by GDAL)"""
+    if hasattr(src, 'stats'):
+        return src.stats(indexes=1, approx=True)[0]
+    return src.statistics(1, approx=True)
+
+
+@functools.lru_cache(maxsize=256)
+def value_range(path, mtime):
+    """(min, max) of band 1 of a file from its approximate statistics, once per file version"""
+    with rasterio.open(path) as src:
+        stats = band_statistics(src)
+    return stats.min, stats.max
+
+
+def render_overlay(path, colormap='viridis', vmin=None, vmax=None, size=1024):
+    """PNG data URL and lat/lon bounds of a raster, read at most size px wide (for folium ImageOverlay)"""
+    if vmin is None or vmax is None:
+        # Stored (or overview-based) statistics instead of a full scan
+        low, high = value_range(path, os.path.getmtime(path))
+        vmin = low if vmin is None else vmin
+        vmax = high if vmax is None else vmax
+
+    with rasterio.open(path) as src:
+        # Warped to Web Mercator, the projection Leaflet stretches overlays in;
+        # the decimated read comes from the matching overview
+        with WarpedVRT(src, crs=WEB_MERCATOR) as vrt:
+            scale = max(vrt.width, vrt.height) / size
+            shape = (max(1, round(vrt.height / max(scale, 1))), max(1, round(vrt.width / max(scale, 1))))
+            array = vrt.read(1, out_shape=shape, masked=True)
+            bounds = transform_bounds(vrt.crs, 'EPSG:4326', *vrt.bounds)
+
+    rgba = colorize(array, colormap, vmin, vmax)
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode(), bounds
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_overlay(path, mtime, colormap, vmin, vmax, size):
+    return render_overlay(path, colormap, vmin, vmax, size)
+
+
+def overlay(path, colormap='viridis', vmin=None, vmax=None, size=1024):
+    """render_overlay cached by (path, mtime, colormap, vmin, vmax, size): a rerun that
+    changes nothing about the raster costs no raster I/O"""
+    return _cached_overlay(path, os.path.getmtime(path), colormap, vmin, vmax, size)
+
+
+def start():
+    """Start the tile server once per process"""
+    global _server
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((HOST, PORT), TileHandler)
+            except OSError:
+                # Taken, e.g. by a second app process: any free port will do
+                _server = ThreadingHTTPServer((HOST, 0), TileHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def register(path):
+    """Allow a file to be served, returns its token"""
+    path = os.path.abspath(path)
+    token = hashlib.sha1(path.encode()).hexdigest()[:16]
+    _files[token] = path
+    return token
+
+
+def tile_url(path, colormap=None, vmin=0.0, vmax=1.0):
+    """XYZ URL template of a local raster
+
+    The file's mtime is part of the URL, so browsers cache tiles of a file
+    only until it is rewritten.
+    """
+    server = start()
+    public_url = PUBLIC_URL or f'http://localhost:{server.server_port}'
+    query = f'vmin={vmin}&vmax={vmax}&mtime={os.path.getmtime(path)}'
+    if colormap:
+        query += f'&colormap={colormap}'
+    return f'{public_url}/tiles/{register(path)}/{{z}}/{{x}}/{{y}}.png?{query}'
+
+
+def add_local_cog(map_object, tiff_path, layer_name, colormap=None, vmin=None, vmax=None, opacity=1.0):
+    """Add a local GeoTIFF/COG to a geemap folium map as an XYZ tile layer
+
+    Without a colormap, paletted uint8 files (e.g. the Se2WaQ COGs) use their
+    own palette; vmin/vmax default to the file's approximate statistics.
+    """
+    if vmin is None or vmax is None:
+        low, high = value_range(tiff_path, os.path.getmtime(tiff_path))
+        vmin = low if vmin is None else vmin
+        vmax = high if vmax is None else vmax
+    map_object.add_tile_layer(
+        url=tile_url(tiff_path, colormap, vmin, vmax),
+        name=layer_name,
+        attribution=os.path.basename(tiff_path),
+        opacity=opacity,
+    )
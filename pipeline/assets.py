@@ -0,0 +1,139 @@
+"""Band asset resolver for SAFE products on S3.
+
+Replaces the per-product `s5cmd ls` subprocess: many products are listed
+concurrently with one asyncio S3 client (one connection pool), each listing is
+parsed into a {band: href} mapping by band name, and the mapping is cached on
+disk, since SAFE contents never change.
+
+The endpoint comes from S3_ENDPOINT_URL (e.g. http://localhost:9000 for a
+local MinIO or moto server) or https://$AWS_S3_ENDPOINT; credentials from the
+usual AWS_* variables.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+
+# Band name of a 20 m JP2, e.g. T34UDA_20240501T100021_B03_20m.jp2 -> B03
+BAND_PATTERN = re.compile(r'_(B\d\d|B8A|SCL|AOT|WVP|TCI)_20m\.jp2$')
+
+# Concurrent listings (and pooled connections) per resolve() call
+CONCURRENCY = 32
+
+CACHE_DIR = os.environ.get('SE2WAQ_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'se2waq', 'listings'))
+
+
+class ListingError(ConnectionError):
+    """A product could not be listed (network, throttling): worth retrying"""
+
+
+def endpoint_url():
+    if os.environ.get('S3_ENDPOINT_URL'):
+        return os.environ['S3_ENDPOINT_URL']
+    return 'https://' + os.environ.get('AWS_S3_ENDPOINT', 'eodata.cloudferro.com')
+
+
+def split_product_path(product_path):
+    # /eodata/Sentinel-2/.../X.SAFE -> ('eodata', 'Sentinel-2/.../X.SAFE/GRANULE/')
+    bucket, _, key = product_path.strip('/').partition('/')
+    return bucket, key + '/GRANULE/'
+
+
+def parse_listing(bucket, keys):
+    """{band: href} for the R20m JP2 keys of one product"""
+    bands = {}
+    for key in keys:
+        if '/IMG_DATA/R20m/' not in key:
+            continue
+        match = BAND_PATTERN.search(key)
+        if match:
+            bands[match.group(1)] = f's3://{bucket}/{key}'
+    return bands
+
+
+def cache_path(product_path, cache_dir=CACHE_DIR):
+    digest = hashlib.sha1(product_path.encode()).hexdigest()
+    return os.path.join(cache_dir, f'{digest}.json')
+
+
+def read_cache(product_path, cache_dir=CACHE_DIR):
+    try:
+        with open(cache_path(product_path, cache_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(product_path, bands, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(product_path, cache_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(bands, f)
+    os.replace(path + '.tmp', path)
+
+
+async def list_product(client, product_path):
+    bucket, prefix = split_product_path(product_path)
+    keys = []
+    paginator = client.get_paginator('list_objects_v2')
+    async for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(item['Key'] for item in page.get('Contents', []))
+    return parse_listing(bucket, keys)
+
+
+async def resolve_async(product_paths, concurrency=CONCURRENCY):
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+
+    results = {}
+    config = AioConfig(max_pool_connections=concurrency, s3={'addressing_style': 'path'},
+                       retries={'max_attempts': 5, 'mode': 'adaptive'})
+    semaphore = asyncio.Semaphore(concurrency)
+    async with get_session().create_client('s3', endpoint_url=endpoint_url(), config=config) as client:
+        async def resolve_one(product_path):
+            async with semaphore:
+                try:
+                    results[product_path] = await list_product(client, product_path)
+                except Exception as e:
+                    print(f"Error listing {product_path}: {e}")
+                    results[product_path] = None
+
+        await asyncio.gather(*(resolve_one(path) for path in product_paths))
+    return results
+
+
+def resolve(product_paths, concurrency=CONCURRENCY, cache_dir=CACHE_DIR):
+    """{product path: {band: href}} for many products, None where listing failed
+
+    Cached listings are used as-is, the rest are listed concurrently and cached.
+    """
+    results = {}
+    missing = []
+    for product_path in product_paths:
+        cached = read_cache(product_path, cache_dir) if cache_dir else None
+        if cached:
+            results[product_path] = cached
+        else:
+            missing.append(product_path)
+
+    if missing:
+        listed = asyncio.run(resolve_async(missing, concurrency))
+        for product_path, bands in listed.items():
+            # An empty listing may be a not-yet-published product, so only
+            # complete ones are cached
+            if bands and cache_dir:
+                write_cache(product_path, bands, cache_dir)
+        results.update(listed)
+    return results
+
+
+def band_hrefs(product_path, bands, cache_dir=CACHE_DIR):
+    """{band: href} of the requested bands of one product"""
+    available = resolve([product_path], cache_dir=cache_dir)[product_path]
+    if available is None:
+        raise ListingError(f"Could not list {product_path}")
+    missing = [band for band in bands if band not in available]
+    if missing:
+        raise FileNotFoundError(f"{', '.join(missing)} not found in {product_path}")
+    return {band: available[band] for band in bands}
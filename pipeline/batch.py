@@ -0,0 +1,188 @@
+"""Parallel batch runner for the Se2WaQ engine.
+
+Scenes are fanned out to a process pool. Concurrent scenes per S3 endpoint
+are capped, transient read and listing failures are retried, and one bad
+product never stops the run. A worker crash (GDAL segfault, OOM) breaks the
+pool, so the products it left unfinished are rerun one per process: only the
+product that crashes again is charged with it. The run ends with a per-scene CSV report.
+
+    python batch.py --geojson s2_polska_2023_2024_wkt.geojson --workers 16 \\
+        --max-per-endpoint 8 --report backfill_report.csv
+"""
+import csv
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from rasterio.errors import RasterioIOError
+
+import assets
+import metrics
+import se2waq
+
+# Scenes read at the same time from one S3 endpoint
+MAX_PER_ENDPOINT = 4
+
+# Extra attempts for a scene after a transient failure or a worker crash
+RETRIES = 2
+
+# Seconds before the first retry, doubled for every further one
+RETRY_DELAY = 10
+
+TRANSIENT_ERRORS = (RasterioIOError, assets.ListingError, ConnectionError, TimeoutError)
+
+REPORT_FIELDS = ['product', 'status', 'attempts', 'seconds', 'outputs', 'error']
+
+# Endpoint semaphores, set in every worker by init_worker
+_endpoint_slots = {}
+
+
+def endpoint_of(directory_path):
+    """S3 endpoint a product is read from, None for local products"""
+    if directory_path.startswith('/eodata/'):
+        return os.environ.get('AWS_S3_ENDPOINT', se2waq.S3_ENDPOINT)
+    return None
+
+
+def init_worker(endpoint_slots):
+    global _endpoint_slots
+    _endpoint_slots = endpoint_slots
+
+
+def run_scene(directory_path, output_base_path, indices, tile_size=None, retries=RETRIES,
+              manifest_path=None, force=False, water_bodies=None, stats_dir=None, histogram_dir=None,
+              scales_path=None, cube_store=None, regions=None):
+    """Process one product in a worker, never raises: returns a report row"""
+    start = time.time()
+    row = {'product': directory_path, 'attempts': 0, 'outputs': '', 'error': ''}
+    slot = _endpoint_slots.get(endpoint_of(directory_path))
+
+    while True:
+        row['attempts'] += 1
+        try:
+            options = dict(indices=indices, tile_size=tile_size, manifest_path=manifest_path, force=force,
+                           water_bodies=water_bodies, stats_dir=stats_dir, histogram_dir=histogram_dir,
+                           scales_path=scales_path, cube_store=cube_store, regions=regions)
+            if slot is not None:
+                with slot:
+                    outputs = se2waq.process_scene(directory_path, output_base_path, **options)
+            else:
+                outputs = se2waq.process_scene(directory_path, output_base_path, **options)
+            row['status'] = 'ok' if outputs else 'skipped'
+            row['outputs'] = ';'.join(outputs)
+            row['error'] = ''
+            break
+        except TRANSIENT_ERRORS as e:
+            row['status'] = 'failed'
+            row['error'] = f"{type(e).__name__}: {e}"
+            if row['attempts'] > retries:
+                break
+            print(f"Retrying {directory_path} after {row['error']}")
+            time.sleep(RETRY_DELAY * 2 ** (row['attempts'] - 1))
+        except Exception as e:
+            row['status'] = 'failed'
+            row['error'] = f"{type(e).__name__}: {e}"
+            break
+
+    row['seconds'] = round(time.time() - start, 1)
+    return row
+
+
+def run_isolated(path, endpoint_slots, retries, scene_options):
+    """Process one product in a pool of its own, so a worker crash is its own: returns a report row"""
+    crashes = 0
+    while True:
+        with ProcessPoolExecutor(1, initializer=init_worker, initargs=(endpoint_slots,)) as executor:
+            try:
+                return executor.submit(run_scene, path, **scene_options).result()
+            except BrokenProcessPool as e:
+                crashes += 1
+                if crashes > retries:
+                    return {'product': path, 'status': 'failed', 'attempts': crashes,
+                            'seconds': '', 'outputs': '', 'error': f"worker crashed: {e}"}
+                print(f"Retrying {path} after a worker crash")
+
+
+def run_batch(path_list, output_base_path, indices, tile_size=None, workers=None,
+              max_per_endpoint=MAX_PER_ENDPOINT, retries=RETRIES, manifest_path=None, force=False,
+              water_bodies=None, stats_dir=None, histogram_dir=None, scales_path=None,
+              cube_store=None, regions=None):
+    """Process all products in a process pool, returns report rows in input order"""
+    endpoints = {endpoint_of(path) for path in path_list} - {None}
+    endpoint_slots = {endpoint: multiprocessing.BoundedSemaphore(max_per_endpoint) for endpoint in endpoints}
+    # run_scene keyword arguments shared by all products
+    scene_options = dict(output_base_path=output_base_path, indices=indices, tile_size=tile_size,
+                         retries=retries, manifest_path=manifest_path, force=force,
+                         water_bodies=water_bodies, stats_dir=stats_dir, histogram_dir=histogram_dir,
+                         scales_path=scales_path, cube_store=cube_store, regions=regions)
+
+    report = {}
+    # A worker killed by GDAL (segfault, OOM) breaks the whole pool and fails
+    # every unfinished scene, with no telling which one crashed
+    suspects = []
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(endpoint_slots,)) as executor:
+        futures = {executor.submit(run_scene, path, **scene_options): path for path in path_list}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                report[path] = future.result()
+            except BrokenProcessPool:
+                suspects.append(path)
+                continue
+            print(f"{report[path]['status']}: {path}")
+
+    if suspects:
+        print(f"A worker crashed, rerunning {len(suspects)} unfinished products one per process")
+        with ThreadPoolExecutor(workers or os.cpu_count()) as threads:
+            futures = {threads.submit(run_isolated, path, endpoint_slots, retries, scene_options): path
+                       for path in suspects}
+            for future in as_completed(futures):
+                path = futures[future]
+                report[path] = future.result()
+                print(f"{report[path]['status']}: {path}")
+
+    return [report[path] for path in path_list]
+
+
+def write_report(rows, report_path):
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = se2waq.build_parser("Compute Se2WaQ/NDCI indices for many products in parallel")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="size of the process pool")
+    parser.add_argument('--max-per-endpoint', type=int, default=MAX_PER_ENDPOINT,
+                        help="scenes read at the same time from one S3 endpoint")
+    parser.add_argument('--retries', type=int, default=RETRIES, help="retries after a transient failure")
+    parser.add_argument('--report', default='se2waq_report.csv', help="per-scene CSV report")
+    args = parser.parse_args(argv)
+
+    se2waq.configure_s3()
+    path_list = se2waq.path_list_from_args(args)
+    if args.metrics:
+        metrics.configure(args.metrics)
+    # List all products concurrently up front, the workers then read the cache
+    with metrics.stage('listing', source='pipeline', scene='*'):
+        listings = assets.resolve([path for path in path_list if endpoint_of(path)])
+    print(f"Listed {sum(1 for bands in listings.values() if bands)} of {len(listings)} products")
+    rows = run_batch(path_list, args.output, args.indices, tile_size=args.tile_size,
+                     workers=args.workers, max_per_endpoint=args.max_per_endpoint, retries=args.retries,
+                     manifest_path=se2waq.manifest_from_args(args), force=args.force,
+                     water_bodies=args.water_bodies, stats_dir=se2waq.stats_dir_from_args(args),
+                     histogram_dir=args.histogram_dir, scales_path=args.scales,
+                     cube_store=args.cube_store, regions=args.regions)
+    write_report(rows, args.report)
+
+    counts = {}
+    for row in rows:
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+    print(f"Processed {len(rows)} products: {counts}, report saved to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
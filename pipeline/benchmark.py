@@ -0,0 +1,444 @@
+"""Offline benchmarks of the processing and map rendering hot paths on synthetic scenes.
+
+Generates a SAFE-like Sentinel-2 L2A product (20 m JP2s of B01-B05 and SCL,
+B08 at 10 m, with lakes, clouds and cloud shadows) and a multi-band SR
+GeoTIFF (the superres.py input) of configurable size. Each case is timed a
+few times against them, and the results are written as JSON. Given a
+baseline (an earlier results file), any case whose throughput dropped by
+more than --max-slowdown fails the run. Regressions then show up before a
+nightly run overruns. Nothing uses the network. The database case runs
+only with --dsn and should point to a scratch PostGIS database; its rows
+are deleted afterwards.
+
+    python benchmark.py --size 2048 --output bench.json
+    python benchmark.py --size 2048 --baseline bench.json --max-slowdown 1.3 --max-slowdown reproject=1.5
+    python benchmark.py --cases indices water_mask cog_write --repeat 10 --workdir /tmp/bench
+    python benchmark.py --cases db_insert --dsn "dbname=bench"
+
+    import benchmark
+    band_paths = benchmark.make_scene('/tmp/bench', size=1024)
+
+Cases:
+
+    indices            Se2WaQ formulas (all indices) on the water pixels
+    water_mask         se2waq.compute_values: SCL water mask, band gather, scatter
+    reproject          warp.open_stack + warp.read of the band set to EPSG:3857
+    cog_write          se2waq.write_cog (MemoryFile + cog_translate) of one index
+    superres           superres.compute_indices of the SR GeoTIFF
+    render_overlay     tiles.render_overlay: overview read + colorize + PNG data URL (uncached)
+    db_insert          ingest.load of one row per output (COPY + INSERT ... SELECT)
+
+Throughput is in megapixels (database case: thousands of rows) per second,
+so results of different --size runs can be compared.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import se2waq
+import superres
+import warp
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'K_WQ_app_1')
+
+# Edge of the synthetic scene in 20 m pixels (a full tile is 5490)
+SIZE = 2048
+
+REPEAT = 5
+
+# Allowed time ratio to the baseline before a case counts as a regression
+MAX_SLOWDOWN = 1.25
+
+DB_ROWS = 10000
+
+TILE_ID = 'T34UDA'
+SENSING = '20240501T100021'
+ORIGIN = (399960, 5600040)
+CRS = 'EPSG:32634'
+
+# Mean digital numbers of land, water and cloud per band
+REFLECTANCE = {
+    'B01': (1200, 1100, 5200),
+    'B02': (900, 700, 5400),
+    'B03': (1000, 600, 5300),
+    'B04': (900, 350, 5300),
+    'B05': (1400, 300, 5200),
+    'B08': (3000, 150, 5600),
+}
+
+# Lossless 1024 px tiles, as in the L2A products (CODEC: the .part name
+# would otherwise give a bare codestream without georeferencing)
+JP2_OPTIONS = {'CODEC': 'JP2', 'QUALITY': '100', 'REVERSIBLE': 'YES', 'BLOCKXSIZE': '1024', 'BLOCKYSIZE': '1024'}
+
+
+def smooth_noise(rng, shape, scale):
+    """Random field in [0, 1) varying over about scale pixels"""
+    coarse = rng.random((shape[0] // scale + 2, shape[1] // scale + 2))
+    rows = np.arange(shape[0]) / scale
+    cols = np.arange(shape[1]) / scale
+    along = np.array([np.interp(cols, np.arange(coarse.shape[1]), line) for line in coarse])
+    return np.array([np.interp(rows, np.arange(coarse.shape[0]), column) for column in along.T]).T
+
+
+def blobs(rng, shape, scale, fraction):
+    """Boolean mask of smooth blobs covering about fraction of the area"""
+    field = smooth_noise(rng, shape, scale)
+    return field > np.quantile(field, 1 - fraction)
+
+
+def scene_classes(rng, shape, water=0.3, cloud=0.15):
+    """SCL-like classes: vegetation (4), water (6), cloud (8, 9) and cloud shadow (3)"""
+    scl = np.full(shape, 4, dtype='uint8')
+    scl[blobs(rng, shape, 64, water)] = se2waq.SCL_WATER
+    clouds = blobs(rng, shape, 32, cloud)
+    shift = max(1, shape[0] // 100)
+    shadows = np.zeros(shape, dtype=bool)
+    shadows[shift:, shift:] = clouds[:-shift, :-shift]
+    scl[shadows & ~clouds] = 3
+    scl[clouds] = 8
+    scl[clouds & (rng.random(shape) < 0.5)] = 9
+    return scl
+
+
+def reflectance(rng, scl, band):
+    """uint16 digital numbers of a band over the classes of scl"""
+    land, water, cloud = REFLECTANCE[band]
+    values = np.full(scl.shape, land, dtype='float32')
+    values[scl == se2waq.SCL_WATER] = water
+    values[np.isin(scl, [8, 9])] = cloud
+    values[scl == 3] *= 0.4
+    values *= rng.normal(1, 0.08, scl.shape).astype('float32')
+    return np.clip(values, 1, 65535).astype('uint16')
+
+
+def write_band(path, array, resolution, driver):
+    profile = {
+        'driver': driver,
+        'width': array.shape[1],
+        'height': array.shape[0],
+        'count': 1,
+        'dtype': array.dtype,
+        'crs': CRS,
+        'transform': from_origin(*ORIGIN, resolution, resolution),
+    }
+    if driver == 'JP2OpenJPEG':
+        profile.update(JP2_OPTIONS)
+    else:
+        profile.update(tiled=True, blockxsize=1024, blockysize=1024, compress='deflate')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with rasterio.open(path + '.part', 'w', **profile) as dst:
+        dst.write(array, 1)
+    os.replace(path + '.part', path)
+
+
+def make_scene(directory, size=SIZE, seed=0, driver='JP2OpenJPEG'):
+    """Write a synthetic SAFE-like L2A product under directory, returns its 20 m {band: path}
+
+    Existing files are reused, so repeated runs only generate once.
+    """
+    product = f'S2A_MSIL2A_{SENSING}_N0510_R122_{TILE_ID}_{SENSING[:8]}T120000.SAFE'
+    granule = os.path.join(directory, product, 'GRANULE', f'L2A_{TILE_ID}_A000000_{SENSING}', 'IMG_DATA')
+    paths = {band: os.path.join(granule, f'R{resolution}m', f'{TILE_ID}_{SENSING}_{band}_{resolution}m.jp2')
+             for band, resolution in [('B01', 20), ('B02', 20), ('B03', 20), ('B04', 20), ('B05', 20),
+                                      ('SCL', 20), ('B08', 10)]}
+    if all(os.path.exists(path) for path in paths.values()):
+        return {band: path for band, path in paths.items() if band != 'B08'}
+
+    rng = np.random.default_rng(seed)
+    scl = scene_classes(rng, (size, size))
+    write_band(paths['SCL'], scl, 20, driver)
+    for band in ['B01', 'B02', 'B03', 'B04', 'B05']:
+        write_band(paths[band], reflectance(rng, scl, band), 20, driver)
+    write_band(paths['B08'], reflectance(rng, scl.repeat(2, axis=0).repeat(2, axis=1), 'B08'), 10, driver)
+    return {band: path for band, path in paths.items() if band != 'B08'}
+
+
+def make_sr(path, size=SIZE, seed=0):
+    """Write a synthetic multi-band SR GeoTIFF (superres.BAND_ORDER, 2.5 m), returns path"""
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    scl = scene_classes(rng, (size, size), cloud=0)
+    profile = {
+        'driver': 'GTiff',
+        'width': size,
+        'height': size,
+        'count': len(superres.BAND_ORDER),
+        'dtype': 'uint16',
+        'crs': CRS,
+        'transform': from_origin(*ORIGIN, 2.5, 2.5),
+        'tiled': True,
+        'blockxsize': 256,
+        'blockysize': 256,
+        'compress': 'deflate',
+    }
+    with rasterio.open(path + '.part', 'w', **profile) as dst:
+        for i, band in enumerate(superres.BAND_ORDER, 1):
+            dst.write(reflectance(rng, scl, band if band in REFLECTANCE else 'B05'), i)
+            dst.set_band_description(i, band)
+    os.replace(path + '.part', path)
+    return path
+
+
+class Skip(Exception):
+    """A case that cannot run in this environment"""
+
+
+def case_indices(workload):
+    water = workload['water']
+    formulas = [spec['formula'] for spec in se2waq.INDICES.values()]
+
+    def run():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for formula in formulas:
+                formula(water)
+    return run, next(iter(water.values())).size * len(formulas)
+
+
+def case_water_mask(workload):
+    bands = workload['bands']
+    return lambda: se2waq.compute_values(bands, ['turb']), bands['SCL'].size
+
+
+def case_reproject(workload):
+    band_paths = workload['band_paths']
+
+    def run():
+        with warp.open_stack(band_paths) as stack:
+            warp.read(stack)
+    return run, workload['bands']['SCL'].size * len(band_paths)
+
+
+def case_cog_write(workload):
+    path = os.path.join(workload['workdir'], 'cog_write.tif')
+    image, profile = workload['image'], workload['profile']
+    return lambda: se2waq.write_cog(image, profile, 'turb', path), image.size
+
+
+def case_superres(workload):
+    path = os.path.join(workload['workdir'], 'superres.tif')
+    with rasterio.open(workload['sr_path']) as src:
+        pixels = src.width * src.height
+    return lambda: superres.compute_indices(workload['sr_path'], path, ['turb', 'chla']), pixels * 2
+
+
+def case_render_overlay(workload):
+    if APP_DIR not in sys.path:
+        sys.path.append(APP_DIR)
+    import tiles
+
+    path = workload['cog_path']
+    with rasterio.open(path) as src:
+        return lambda: tiles.render_overlay(path, 'viridis', None, None, 1024), src.width * src.height
+
+
+def case_db_insert(workload):
+    if not workload.get('dsn'):
+        raise Skip("needs --dsn (a scratch PostGIS database)")
+    import pandas as pd
+    import psycopg2
+
+    import ingest
+
+    rows = workload['db_rows']
+    names = list(se2waq.INDICES)
+    frame = pd.DataFrame({
+        'index_name': [names[i % len(names)] for i in range(rows)],
+        'product_id': [f'BENCHMARK_{i // len(names)}' for i in range(rows)],
+        'date': datetime.date(2024, 5, 1),
+        'cloud_cover': 12.5,
+        'wkt': 'POLYGON((2200000 6400000, 2300000 6400000, 2300000 6500000, 2200000 6500000, 2200000 6400000))',
+    })
+    conn = psycopg2.connect(workload['dsn'])
+    workload['cleanup'].append(lambda: delete_benchmark_rows(conn, names))
+    calls = iter(range(sys.maxsize))
+
+    def run():
+        # New file paths on every call, so no row is skipped as already loaded
+        call = next(calls)
+        batch = frame.assign(file_path=[f'benchmark/{call}/{i}.tif' for i in range(rows)])
+        ingest.load(conn, batch[['index_name', 'product_id', 'date', 'cloud_cover', 'file_path', 'wkt']])
+    return run, rows * 1000
+
+
+def delete_benchmark_rows(conn, names):
+    from psycopg2 import sql
+
+    with conn:
+        with conn.cursor() as cursor:
+            for name in names:
+                cursor.execute(sql.SQL("DELETE FROM {} WHERE file_path LIKE 'benchmark/%'").format(
+                    sql.Identifier(se2waq.INDICES[name]['table'])))
+    conn.close()
+
+
+CASES = {
+    'indices': case_indices,
+    'water_mask': case_water_mask,
+    'reproject': case_reproject,
+    'cog_write': case_cog_write,
+    'superres': case_superres,
+    'render_overlay': case_render_overlay,
+    'db_insert': case_db_insert,
+}
+
+
+def prepare(workdir, size=SIZE, seed=0, driver='JP2OpenJPEG'):
+    """Synthetic inputs and the intermediate arrays the cases start from"""
+    band_paths = make_scene(os.path.join(workdir, 'scene'), size, seed, driver)
+    with warp.open_stack(band_paths) as stack:
+        bands = warp.read(stack)
+        profile = stack['profile']
+    values = se2waq.compute_values(bands, ['turb'])['turb']
+    image = se2waq.normalize('turb', values, se2waq.value_range(values))
+    cog_path = os.path.join(workdir, 'turb_cog.tif')
+    se2waq.write_cog(image, profile, 'turb', cog_path)
+    water_mask = bands['SCL'] == se2waq.SCL_WATER
+    return {
+        'workdir': workdir,
+        'band_paths': band_paths,
+        'bands': bands,
+        'water': {band: array[water_mask] for band, array in bands.items() if band != 'SCL'},
+        'profile': profile,
+        'image': image,
+        'cog_path': cog_path,
+        'sr_path': make_sr(os.path.join(workdir, 'super_res_output.tif'), size * 2, seed),
+        'cleanup': [],
+    }
+
+
+def time_case(run, repeat=REPEAT):
+    """Wall times (s) of repeat calls, after one untimed warm-up call"""
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_cases(workload, cases=tuple(CASES), repeat=REPEAT):
+    """{case: result} with min/median seconds, runs and throughput; skipped cases have a reason"""
+    results = {}
+    try:
+        for name in cases:
+            try:
+                run, pixels = CASES[name](workload)
+            except Skip as e:
+                results[name] = {'skipped': str(e)}
+                print(f"{name:18s} skipped: {e}")
+                continue
+            times = time_case(run, repeat)
+            best = min(times)
+            results[name] = {
+                'min': best,
+                'median': statistics.median(times),
+                'runs': times,
+                'pixels': pixels,
+                'mpixels_per_s': pixels / best / 1e6,
+            }
+            print(f"{name:18s} {best:8.4f} s  {pixels / best / 1e6:9.1f} Mpx/s")
+    finally:
+        for cleanup in workload['cleanup']:
+            cleanup()
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'rasterio': rasterio.__version__,
+        'gdal': rasterio.__gdal_version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def slowdown_limits(values):
+    """--max-slowdown values: FACTOR for all cases, CASE=FACTOR for one"""
+    limits = {None: MAX_SLOWDOWN}
+    for value in values or []:
+        name, _, factor = value.rpartition('=')
+        limits[name or None] = float(factor)
+    return limits
+
+
+def regressions(results, baseline, limits):
+    """{case: (slowdown, limit)} of the cases slower than allowed, by throughput"""
+    slower = {}
+    for name, result in results.items():
+        before = baseline.get('cases', {}).get(name, {})
+        if 'mpixels_per_s' not in result or 'mpixels_per_s' not in before:
+            continue
+        slowdown = before['mpixels_per_s'] / result['mpixels_per_s']
+        limit = limits.get(name, limits[None])
+        if slowdown > limit:
+            slower[name] = (slowdown, limit)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline hot paths on synthetic Sentinel-2 scenes")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--size', type=int, default=SIZE, help="scene edge in 20 m pixels (SR product: twice that)")
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--driver', choices=['JP2OpenJPEG', 'GTiff'], default='JP2OpenJPEG',
+                        help="format of the synthetic band files")
+    parser.add_argument('--workdir', help="keep (and reuse) the synthetic inputs here instead of a temp directory")
+    parser.add_argument('--dsn', help="libpq connection string of a scratch PostGIS database for db_insert")
+    parser.add_argument('--db-rows', type=int, default=DB_ROWS)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--max-slowdown', action='append', metavar='[CASE=]FACTOR',
+                        help=f"allowed slowdown to the baseline (default {MAX_SLOWDOWN}), repeatable")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='se2waq_benchmark_')
+    try:
+        workload = prepare(workdir, args.size, args.seed, args.driver)
+        workload.update(dsn=args.dsn, db_rows=args.db_rows)
+        results = run_cases(workload, args.cases, args.repeat)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'environment': environment(),
+        'config': {'size': args.size, 'repeat': args.repeat, 'seed': args.seed, 'driver': args.driver},
+        'cases': results,
+    }
+    slower = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), slowdown_limits(args.max_slowdown))
+        report['regressions'] = {name: {'slowdown': slowdown, 'limit': limit}
+                                 for name, (slowdown, limit) in slower.items()}
+    if args.output:
+        with open(args.output + '.part', 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(args.output + '.part', args.output)
+        print(f"Saved results to {args.output}")
+
+    for name, (slowdown, limit) in slower.items():
+        print(f"Regression: {name} is {slowdown:.2f}x slower than the baseline (limit {limit:.2f}x)")
+    if slower:
+        parser.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Local Sentinel-2 product catalog backed by cached STAC searches.
+
+Search results are stored as GeoParquet (bbox covering column, queried through
+the geopandas spatial index), one file per query: collection, geometry and
+filters, without the date range. The date range a file covers is kept next to
+it, so a repeated search only fetches the days it does not cover yet. A search
+whose area and dates fall inside an already cached one with the same filters
+(e.g. the Krakow bbox inside the Poland-wide 2023-2024 catalog) is answered
+locally without any request.
+
+    import catalog
+    items = catalog.search({
+        "collections": "sentinel-2-l2a",
+        "datetime": "2025-05-01/2025-05-08",
+        "intersects": geom,
+        "query": {"eo:cloud_cover": {"lte": 80}},
+    })
+    stack = stackstac.stack(catalog.item_dicts(items), ...)
+
+    python catalog.py --bbox 14.07 49.00 24.15 54.84 --datetime 2023-02-01/2024-12-31 \\
+        --max-cloud 30 --path-list paths.txt
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import box, mapping, shape
+
+STAC_URL = "https://stac.dataspace.copernicus.eu/v1"
+
+CACHE_DIR = os.environ.get('SE2WAQ_CATALOG', os.path.join(os.path.expanduser('~'), '.cache', 'se2waq', 'catalog'))
+
+# Products are sometimes published days after sensing, so the last days
+# covered by a cache are fetched again when a search reaches into them, until
+# they were fetched at least this long after the cached end date
+REFRESH_DAYS = 3
+
+# Search parameters that only shape the result list, not which items match
+RESULT_PARAMS = ('datetime', 'max_items', 'limit', 'sortby', 'fields')
+
+COLUMNS = ['id', 'datetime', 'product_identifier', 'cc', 'item', 'geometry']
+
+
+def query_geometry(params):
+    """Search area of STAC search parameters as a shapely geometry (None for global)"""
+    if params.get('intersects'):
+        return shape(params['intersects'])
+    if params.get('bbox'):
+        return box(*params['bbox'])
+    return None
+
+
+def query_filters(params):
+    """Parameters defining which items match, apart from dates and area"""
+    filters = {key: value for key, value in params.items()
+               if key not in RESULT_PARAMS + ('intersects', 'bbox')}
+    if isinstance(filters.get('collections'), str):
+        filters['collections'] = [filters['collections']]
+    return filters
+
+
+def query_key(filters, geometry):
+    text = json.dumps({'filters': filters, 'geometry': geometry.wkt if geometry else None}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def parse_interval(value):
+    """'YYYY-MM-DD[Thh:mm:ssZ]/...' -> (start date, end date), open ends as None"""
+    start, _, end = value.partition('/')
+    end = end or start
+
+    def to_date(part):
+        if part in ('', '..'):
+            return None
+        return datetime.date.fromisoformat(part[:10])
+
+    return to_date(start), to_date(end)
+
+
+def stac_interval(start, end):
+    return f"{start.isoformat()}T00:00:00Z/{end.isoformat()}T23:59:59Z"
+
+
+def safe_path(item):
+    """/eodata/.../X.SAFE path of a STAC item, as used by se2waq.py"""
+    for asset in item.get('assets', {}).values():
+        href = asset.get('href', '')
+        if href.startswith('s3://eodata/') and '.SAFE' in href:
+            full_path = href.replace('s3://', '/')
+            return full_path[:full_path.find('.SAFE') + len('.SAFE')]
+    return None
+
+
+def item_geometry(item):
+    # Searches with fields={"exclude": ["geometry"]} only keep the bbox
+    if item.get('geometry'):
+        return shape(item['geometry'])
+    if item.get('bbox'):
+        return box(*item['bbox'])
+    return None
+
+
+def items_frame(items):
+    """GeoDataFrame of STAC item dicts, the full item kept as JSON"""
+    records = [
+        (item['id'], item['properties'].get('datetime'), safe_path(item),
+         item['properties'].get('eo:cloud_cover'), json.dumps(item), item_geometry(item))
+        for item in items
+    ]
+    frame = pd.DataFrame(records, columns=COLUMNS)
+    frame['datetime'] = pd.to_datetime(frame['datetime'], utc=True, format='ISO8601')
+    return gpd.GeoDataFrame(frame, geometry='geometry', crs='EPSG:4326')
+
+
+def fetch(filters, geometry, start, end, url=STAC_URL):
+    """All items of a search between two dates (inclusive), paged from the API"""
+    import pystac_client
+
+    client = pystac_client.Client.open(url)
+    client.add_conforms_to("ITEM_SEARCH")
+    params = dict(filters, datetime=stac_interval(start, end))
+    if geometry is not None:
+        params['intersects'] = mapping(geometry)
+    items = list(client.search(**params).items_as_dicts())
+    print(f"Fetched {len(items)} items for {start}/{end}")
+    return items_frame(items)
+
+
+def read_meta(key, cache_dir=CACHE_DIR):
+    try:
+        with open(os.path.join(cache_dir, f'{key}.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_catalog(frame, meta, cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{meta['key']}.parquet")
+    frame.to_parquet(path + '.tmp', index=False, write_covering_bbox=True)
+    os.replace(path + '.tmp', path)
+    # Metadata last: a catalog is only used once its dates are recorded
+    with open(os.path.join(cache_dir, f"{meta['key']}.json"), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_catalog(key, geometry=None, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, f'{key}.parquet')
+    if geometry is None:
+        return gpd.read_parquet(path)
+    # Row groups are skipped by their bbox, rows then by the spatial index
+    frame = gpd.read_parquet(path, bbox=geometry.bounds)
+    return frame.iloc[frame.sindex.query(geometry, predicate='intersects')].sort_index()
+
+
+def stale_since(meta, today=None):
+    """First cached date that may still miss late-published products, None once settled"""
+    today = today or datetime.date.today()
+    cached_end = datetime.date.fromisoformat(meta['end'])
+    # Catalogs written before the fetch date was recorded were fetched up to their end
+    fetched = datetime.date.fromisoformat(meta.get('fetched', meta['end']))
+    if fetched >= min(today, cached_end + datetime.timedelta(days=REFRESH_DAYS)):
+        return None
+    return max(datetime.date.fromisoformat(meta['start']), cached_end - datetime.timedelta(days=REFRESH_DAYS))
+
+
+def covers(meta, filters, geometry, start, end, today=None):
+    """Whether a cached catalog holds every item of a search"""
+    if meta['filters'] != filters or start is None or end is None:
+        return False
+    if not (meta['start'] <= start.isoformat() and end.isoformat() <= meta['end']):
+        return False
+    stale = stale_since(meta, today)
+    if stale is not None and end >= stale:
+        return False
+    if meta['geometry'] is None:
+        return True
+    return geometry is not None and shape(meta['geometry']).covers(geometry)
+
+
+def find_covering(filters, geometry, start, end, cache_dir=CACHE_DIR):
+    if not os.path.isdir(cache_dir):
+        return None
+    for file in sorted(os.listdir(cache_dir)):
+        if file.endswith('.json'):
+            meta = read_meta(file[:-len('.json')], cache_dir)
+            if meta and covers(meta, filters, geometry, start, end):
+                return meta
+    return None
+
+
+def update(params, url=STAC_URL, cache_dir=CACHE_DIR):
+    """Extend the cached catalog of a search to its date range, returns its metadata
+
+    Only the days before and after the cached range are fetched, plus the
+    last cached days (see stale_since) when the search reaches into them.
+    """
+    filters = query_filters(params)
+    geometry = query_geometry(params)
+    start, end = parse_interval(params['datetime'])
+    today = datetime.date.today()
+    end = min(end or today, today)
+    if start is None:
+        raise ValueError("Cached searches need a start date")
+
+    key = query_key(filters, geometry)
+    meta = read_meta(key, cache_dir)
+    if meta is None:
+        frame = fetch(filters, geometry, start, end, url)
+        meta = {'key': key, 'filters': filters,
+                'geometry': mapping(geometry) if geometry else None,
+                'start': start.isoformat(), 'end': end.isoformat(), 'fetched': today.isoformat()}
+        write_catalog(frame, meta, cache_dir)
+        return meta
+
+    cached_start = datetime.date.fromisoformat(meta['start'])
+    cached_end = datetime.date.fromisoformat(meta['end'])
+    parts = []
+    if start < cached_start:
+        parts.append(fetch(filters, geometry, start, cached_start - datetime.timedelta(days=1), url))
+    stale = stale_since(meta, today)
+    if end > cached_end or (stale is not None and end >= stale):
+        refresh_start = stale or cached_end + datetime.timedelta(days=1)
+        parts.append(fetch(filters, geometry, refresh_start, max(end, cached_end), url))
+        meta['fetched'] = today.isoformat()
+    if parts:
+        frame = pd.concat([read_catalog(key, cache_dir=cache_dir)] + parts, ignore_index=True)
+        frame = frame.drop_duplicates('id', keep='last').sort_values('datetime', ignore_index=True)
+        meta.update(start=min(start, cached_start).isoformat(), end=max(end, cached_end).isoformat())
+        write_catalog(gpd.GeoDataFrame(frame, geometry='geometry', crs='EPSG:4326'), meta, cache_dir)
+    return meta
+
+
+def search(params, url=STAC_URL, cache_dir=CACHE_DIR):
+    """Items of a STAC search (pystac_client parameters) as a GeoDataFrame
+
+    Answered from a cached catalog when one covers the search, otherwise the
+    catalog of this search is fetched or extended first. max_items and
+    sortby are applied locally.
+    """
+    filters = query_filters(params)
+    geometry = query_geometry(params)
+    start, end = parse_interval(params['datetime'])
+    end = min(end or datetime.date.today(), datetime.date.today())
+
+    meta = find_covering(filters, geometry, start, end, cache_dir)
+    if meta is None:
+        meta = update(params, url, cache_dir)
+
+    frame = read_catalog(meta['key'], geometry, cache_dir)
+    dates = frame['datetime'].dt.date
+    frame = frame[(dates >= start) & (dates <= end)]
+
+    sortby = params.get('sortby')
+    if sortby:
+        field = sortby.lstrip('+-').removeprefix('properties.')
+        frame = frame.iloc[pd.Series([json.loads(item)['properties'].get(field) for item in frame['item']])
+                           .argsort(kind='stable').values]
+        if sortby.startswith('-'):
+            frame = frame.iloc[::-1]
+    if params.get('max_items'):
+        frame = frame.head(params['max_items'])
+    return frame.reset_index(drop=True)
+
+
+def item_dicts(frame):
+    """STAC item dicts of a catalog frame, e.g. for stackstac.stack"""
+    return [json.loads(item) for item in frame['item']]
+
+
+def from_geojson(geojson):
+    """GeoDataFrame of a create_geojson() product GeoJSON, in one vectorized pass"""
+    return gpd.GeoDataFrame.from_features(geojson['features'], crs='EPSG:4326')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search Sentinel-2 products through the local catalog cache")
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument('--bbox', type=float, nargs=4, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    area.add_argument('--aoi', help="GeoJSON file with the search area")
+    parser.add_argument('--datetime', required=True, help="START/END dates, e.g. 2023-02-01/2024-12-31")
+    parser.add_argument('--collection', default='sentinel-2-l2a')
+    parser.add_argument('--max-cloud', type=float, help="maximum eo:cloud_cover")
+    parser.add_argument('--url', default=STAC_URL)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--path-list', help="write the SAFE paths here, for se2waq.py --path-list")
+    parser.add_argument('--parquet', help="write the matching products here as GeoParquet")
+    args = parser.parse_args(argv)
+
+    params = {'collections': args.collection, 'datetime': args.datetime}
+    if args.bbox:
+        params['bbox'] = args.bbox
+    else:
+        params['intersects'] = mapping(gpd.read_file(args.aoi).union_all())
+    if args.max_cloud is not None:
+        params['query'] = {'eo:cloud_cover': {'lte': args.max_cloud}}
+
+    frame = search(params, args.url, args.cache_dir)
+    print(f"{len(frame)} products")
+    if args.path_list:
+        with open(args.path_list, 'w') as f:
+            f.writelines(path + '\n' for path in frame['product_identifier'].dropna())
+    if args.parquet:
+        frame.to_parquet(args.parquet, index=False, write_covering_bbox=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""uint8 LUT colorization shared by se2waq.py, the notebooks and the app.
+
+Values are quantized to uint8 in one pass and mapped to RGBA by indexing a
+precomputed 256 x 4 uint8 palette, so no float RGBA array is ever allocated
+(5 bytes per pixel instead of 32 for matplotlib's cmap(array)). Palettes are
+any matplotlib colormap (viridis, plasma, Spectral, ...) or the app's
+colorScaleHex. Large rasters are converted block by block.
+
+    import colorize
+    rgba = colorize.colorize(values, 'Spectral', vmin=-50, vmax=50)
+    colorize.save_png(values, 'chl_a_map_only.png', 'viridis_r', vmin=0, vmax=50)
+    colorize.write_paletted('Turb.tif', 'Turb_paletted.tif', 'nipy_spectral', vmin=0, vmax=30)
+"""
+import functools
+
+import numpy as np
+
+# Palette of the app's index maps (pages/Sentinel-2.py)
+COLOR_SCALE_HEX = ['#496FF2', '#82D35F', '#FEFD05', '#FD0004', '#8E2026', '#D97CF5']
+
+CUSTOM_PALETTES = {
+    'colorScaleHex': COLOR_SCALE_HEX,
+}
+
+# Edge of the blocks write_paletted reads and writes
+BLOCK_SIZE = 1024
+
+
+def hex_palette(colors):
+    """256 x 4 uint8 palette interpolated linearly between hex colors"""
+    rgb = np.array([[int(color.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4)] for color in colors], dtype=float)
+    stops = np.linspace(0, 255, len(colors))
+    palette = np.empty((256, 4), dtype=np.uint8)
+    for channel in range(3):
+        palette[:, channel] = np.interp(np.arange(256), stops, rgb[:, channel]).astype(np.uint8)
+    palette[:, 3] = 255
+    return palette
+
+
+@functools.lru_cache(maxsize=None)
+def palette(name):
+    """256 x 4 uint8 RGBA palette by name (read-only, shared)"""
+    if name in CUSTOM_PALETTES:
+        table = hex_palette(CUSTOM_PALETTES[name])
+    else:
+        import matplotlib
+
+        # Truncated like the 256-entry dicts of the Se2WaQ notebooks
+        table = (matplotlib.colormaps[name].resampled(256)(np.arange(256)) * 255).astype(np.uint8)
+    table.flags.writeable = False
+    return table
+
+
+def gdal_colormap(name):
+    """Palette as a GDAL colormap ({value: (r, g, b)}) for write_colormap"""
+    return {i: tuple(int(c) for c in color[:3]) for i, color in enumerate(palette(name))}
+
+
+def quantize(values, vmin, vmax, out=None):
+    """uint8 palette indices of values scaled linearly from vmin..vmax
+
+    Same binning as matplotlib colormaps (256 equal bins). Works on float or
+    integer arrays, NaN gives 0 (mask it separately).
+    """
+    span = vmax - vmin if vmax > vmin else 1
+    scaled = np.multiply(values, np.float32(256 / span), dtype=np.float32)
+    scaled -= np.float32(vmin * 256 / span)
+    np.clip(scaled, 0, 255, out=scaled)
+    scaled[np.isnan(scaled)] = 0
+    if out is None:
+        return scaled.astype(np.uint8)
+    out[...] = scaled
+    return out
+
+
+def invalid_mask(values):
+    """Masked or non-finite pixels of a (masked) array"""
+    mask = np.ma.getmaskarray(values)
+    data = np.ma.getdata(values)
+    if np.issubdtype(data.dtype, np.floating):
+        mask = mask | ~np.isfinite(data)
+    return mask
+
+
+def apply(indices, name, mask=None):
+    """RGBA uint8 image of palette indices, masked pixels transparent"""
+    # One 4-byte lookup per pixel through a uint32 view of the palette
+    packed = np.ascontiguousarray(palette(name)).view(np.uint32).ravel()
+    rgba = packed[indices].view(np.uint8).reshape(indices.shape + (4,))
+    if mask is not None:
+        rgba[mask, 3] = 0
+    return rgba
+
+
+def colorize(values, name='viridis', vmin=None, vmax=None):
+    """RGBA uint8 image of a band (NaN and masked pixels transparent)"""
+    mask = invalid_mask(values)
+    data = np.ma.getdata(values)
+    if (vmin is None or vmax is None) and (~mask).any():
+        valid = data[~mask]
+        vmin = valid.min() if vmin is None else vmin
+        vmax = valid.max() if vmax is None else vmax
+    return apply(quantize(data, vmin or 0, 1 if vmax is None else vmax), name, mask)
+
+
+def save_png(values, path, name='viridis', vmin=None, vmax=None):
+    """Write a band as an RGBA PNG at its own resolution, without matplotlib figures"""
+    from PIL import Image
+
+    Image.fromarray(colorize(values, name, vmin, vmax), 'RGBA').save(path)
+
+
+def write_paletted(src_path, dst_path, name, vmin, vmax, band=1, nodata=255):
+    """Write a band as a tiled uint8 GeoTIFF with a GDAL colormap, block by block
+
+    Values map to 0..254, nodata (255 by default, as in the Se2WaQ COGs)
+    marks masked pixels; convert with rio-cogeo for a COG.
+    """
+    import rasterio
+    from rasterio.windows import Window
+
+    with rasterio.open(src_path) as src:
+        profile = src.profile.copy()
+        profile.update(driver='GTiff', dtype='uint8', count=1, nodata=nodata, compress='deflate',
+                       tiled=True, blockxsize=256, blockysize=256)
+        with rasterio.open(dst_path, 'w', **profile) as dst:
+            for row in range(0, src.height, BLOCK_SIZE):
+                for col in range(0, src.width, BLOCK_SIZE):
+                    window = Window(col, row, min(BLOCK_SIZE, src.width - col), min(BLOCK_SIZE, src.height - row))
+                    values = src.read(band, window=window, masked=True)
+                    indices = quantize(np.ma.getdata(values), vmin, vmax)
+                    if nodata == 255:
+                        # Keep the nodata value free for masked pixels
+                        np.minimum(indices, 254, out=indices)
+                    indices[invalid_mask(values)] = nodata
+                    dst.write(indices, 1, window=window)
+            dst.write_colormap(1, gdal_colormap(name))
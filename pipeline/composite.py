@@ -0,0 +1,232 @@
+"""Cloud-masked temporal composites of the water quality indices over a stackstac cube.
+
+woda.ipynb and STAC.ipynb keep only scenes with eo:cloud_cover <= 1, which
+drops most acquisitions over the lakes. Here every scene of a date window is
+used. Per pixel only clear water observations count: SCL water, not within
+CLOUD_BUFFER pixels of a cloud or cloud shadow. The indices (se2waq.py
+formulas) of those observations are combined over time into one map per
+week or month:
+
+- median: the per-pixel median of the clear observations;
+- best: the observation of the scene that is clearest around the pixel
+  (clear share of its chunk), a tree reduction over time.
+
+Everything is one lazy dask graph per window, computed chunk by chunk on
+all cores. Chunks without clear water in any scene never read their bands.
+A best-pixel task holds at most SPLIT_EVERY scenes of a chunk. A median task
+needs all scenes of a chunk, so for median the chunk edge is derived from
+the number of scenes to keep a task under MEMORY_LIMIT.
+
+    import catalog, composite, cube
+    items = catalog.item_dicts(catalog.search(params))
+    stack = cube.open_cube(items, bbox, bands=['B01_20m', 'B03_20m', 'SCL_20m'])
+    monthly = composite.composite(stack, ['chla', 'turb'], method='median', suffix='_20m')
+    composite.write(monthly, '../output_composites', '2025-05')
+
+    python composite.py --bbox 19.77 50.00 20.16 50.15 --datetime 2025-04-01/2025-09-30 \\
+        --period month --method median --indices chla turb cdom --output ../output_composites
+"""
+import argparse
+import os
+import threading
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import cube
+import se2waq
+import zonal
+
+METHODS = ('median', 'best')
+
+# Pandas frequency of each composite period
+PERIODS = {'week': 'W', 'month': 'M'}
+
+# Pixels around clouds and cloud shadows that are not used (haze, SCL edges)
+CLOUD_BUFFER = 2
+
+# Bytes of input per median task (all scenes of one chunk, all indices)
+MEMORY_LIMIT = 512 * 2 ** 20
+
+# Scenes combined per step of the best-pixel reduction
+SPLIT_EVERY = 8
+
+# Smallest chunk edge used for median composites
+MIN_CHUNK = 128
+
+
+def dilate(mask, radius):
+    """Grow a boolean (..., y, x) mask by radius pixels (square neighbourhood)"""
+    for axis in (mask.ndim - 2, mask.ndim - 1):
+        grown = mask.copy()
+        for shift in range(1, radius + 1):
+            ahead = [slice(None)] * mask.ndim
+            behind = [slice(None)] * mask.ndim
+            ahead[axis] = slice(shift, None)
+            behind[axis] = slice(None, -shift)
+            grown[tuple(ahead)] |= mask[tuple(behind)]
+            grown[tuple(behind)] |= mask[tuple(ahead)]
+        mask = grown
+    return mask
+
+
+def clear_water(scl, cloud_buffer=CLOUD_BUFFER):
+    """Lazy mask of the SCL water pixels away from clouds and cloud shadows"""
+    cloud = scl.isin(zonal.SCL_CLOUD)
+    if cloud_buffer:
+        depth = {0: 0, 1: cloud_buffer, 2: cloud_buffer}
+        cloud = cloud.copy(data=cloud.data.map_overlap(dilate, depth=depth, boundary='none',
+                                                       radius=cloud_buffer, dtype=bool))
+    return (scl == se2waq.SCL_WATER) & ~cloud
+
+
+def clear_fraction(scl):
+    """Share of the observed pixels of each scene in a block that are not cloud, per pixel"""
+    observed = np.isfinite(scl).sum(axis=(-2, -1), keepdims=True)
+    cloudy = np.isin(scl, zonal.SCL_CLOUD).sum(axis=(-2, -1), keepdims=True)
+    fraction = 1 - cloudy / np.maximum(observed, 1)
+    return np.broadcast_to(fraction, scl.shape).astype('float32')
+
+
+def best_observation(block, axis, keepdims):
+    """Per pixel, the layers of the observation with the highest score (layer 0) along axis 0
+
+    Used as the chunk, combine and aggregate step of the best-pixel reduction.
+    Pixels without any scored observation get the (NaN) first one.
+    """
+    scores = np.nan_to_num(block[:, 0], nan=-np.inf)
+    best = np.argmax(scores, axis=0)[np.newaxis, np.newaxis]
+    result = np.take_along_axis(block, np.broadcast_to(best, (1,) + block.shape[1:]), axis=0)
+    return result if keepdims else result[0]
+
+
+def chunk_size(scenes, layers, memory_limit=MEMORY_LIMIT):
+    """Largest chunk edge (SOURCE_TILE halved) whose median inputs fit the memory limit"""
+    chunk = cube.SOURCE_TILE
+    while chunk > MIN_CHUNK and scenes * layers * chunk * chunk * 4 > memory_limit:
+        chunk //= 2
+    return chunk
+
+
+def composite(stack, indices=tuple(se2waq.INDICES), method='median', suffix='',
+              cloud_buffer=CLOUD_BUFFER, split_every=SPLIT_EVERY):
+    """Lazy Dataset of (y, x) composites of the indices over the time axis of a cube
+
+    Also has clear_count, the number of clear water observations per pixel.
+    Computes the clear water mask once to find the chunks with water.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown composite method {method!r} (one of {', '.join(METHODS)})")
+    if 'SCL' + suffix not in stack.band.values:
+        raise ValueError("compositing needs the SCL band (Sentinel-2 L2A)")
+    indices = list(indices)
+
+    scl = cube.band(stack, 'SCL', suffix)
+    clear = clear_water(scl, cloud_buffer)
+    flags = cube.wet_chunks(clear)
+    print(f"{int(flags.any(axis=0).sum())} of {flags[0].size} chunks contain clear water "
+          f"in {stack.sizes['time']} scenes")
+
+    bands = {name: cube.band(stack, name, suffix) for name in se2waq.required_bands(indices)[:-1]}
+    values = {}
+    for name in indices:
+        layer = se2waq.INDICES[name]['formula'](bands).where(clear).astype('float32')
+        values[name] = cube.only_wet(layer, flags)
+
+    data = {'clear_count': clear.sum('time').astype('uint16')}
+    if method == 'median':
+        for name in indices:
+            data[name] = values[name].chunk({'time': -1}).median('time', skipna=True)
+    else:
+        score = scl.copy(data=scl.data.map_blocks(clear_fraction, dtype='float32')).where(clear)
+        # One chunk along the layer axis, so every block has the score next to the values
+        layers = da.stack([score.data] + [values[name].data for name in indices], axis=1).rechunk({1: -1})
+        best = da.reduction(layers, best_observation, best_observation, combine=best_observation,
+                            axis=0, dtype='float32', split_every=split_every)
+        template = values[indices[0]].isel(time=0, drop=True)
+        for i, name in enumerate(indices, 1):
+            data[name] = template.copy(data=best[i])
+    return xr.Dataset(data, attrs={'crs': stack.attrs.get('crs')})
+
+
+def periods(times, period='month'):
+    """Positions along a time axis of each composite period, by period label (YYYYMMDD_YYYYMMDD)"""
+    times = pd.DatetimeIndex(times)
+    if times.tz is not None:
+        times = times.tz_convert(None)
+    labels = times.to_period(PERIODS[period])
+    groups = {}
+    for label in labels.unique().sort_values():
+        name = f"{label.start_time:%Y%m%d}_{label.end_time:%Y%m%d}"
+        groups[name] = np.flatnonzero(labels == label)
+    return groups
+
+
+def write(dataset, output_dir, name, crs=None):
+    """Stream every composite into {output_dir}/{variable}/{name}.tif in one dask computation, returns the paths"""
+    import rioxarray  # noqa: F401, registers the .rio accessor
+
+    crs = crs or dataset.attrs['crs']
+    tasks = []
+    paths = []
+    for variable, values in dataset.data_vars.items():
+        os.makedirs(os.path.join(output_dir, variable), exist_ok=True)
+        path = os.path.join(output_dir, variable, f'{name}.tif')
+        values = values.drop_vars([coord for coord in values.coords if coord not in ('x', 'y')])
+        nodata = 0 if variable == 'clear_count' else np.nan
+        tasks.append(values.rio.write_crs(crs).rio.write_nodata(nodata).rio.to_raster(
+            path, tiled=True, blockxsize=256, blockysize=256, compress='zstd',
+            lock=threading.Lock(), compute=False))
+        paths.append(path)
+    dask.compute(*tasks)
+    return paths
+
+
+def main(argv=None):
+    import catalog
+
+    parser = argparse.ArgumentParser(description="Cloud-masked weekly or monthly composites of water quality indices")
+    parser.add_argument('--bbox', type=float, nargs=4, required=True, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--datetime', required=True, help="START/END dates")
+    parser.add_argument('--collection', default='sentinel-2-l2a')
+    parser.add_argument('--max-cloud', type=float, help="maximum eo:cloud_cover (default: all scenes)")
+    parser.add_argument('--indices', nargs='+', choices=list(se2waq.INDICES), default=list(se2waq.INDICES))
+    parser.add_argument('--method', choices=METHODS, default='median')
+    parser.add_argument('--period', choices=list(PERIODS), default='month')
+    parser.add_argument('--cloud-buffer', type=int, default=CLOUD_BUFFER, help="pixels masked around clouds")
+    parser.add_argument('--memory-limit', type=int, default=MEMORY_LIMIT // 2 ** 20,
+                        help="MB of input per median task")
+    parser.add_argument('--workers', type=int, help="dask threads (default: all cores)")
+    parser.add_argument('--resolution', type=int, default=20)
+    parser.add_argument('--epsg', type=int, default=32634)
+    parser.add_argument('--output', default='../output_composites')
+    args = parser.parse_args(argv)
+
+    params = {'collections': args.collection, 'datetime': args.datetime, 'bbox': args.bbox}
+    if args.max_cloud is not None:
+        params['query'] = {'eo:cloud_cover': {'lte': args.max_cloud}}
+    frame = catalog.search(params)
+    items = catalog.item_dicts(frame)
+
+    chunk = cube.SOURCE_TILE
+    if args.method == 'median':
+        scenes = max(len(positions) for positions in periods(frame['datetime'], args.period).values())
+        chunk = chunk_size(scenes, len(args.indices), args.memory_limit * 2 ** 20)
+
+    suffix = f'_{args.resolution}m'
+    bands = [band + suffix for band in se2waq.required_bands(args.indices)]
+    stack = cube.open_cube(items, args.bbox, bands, args.resolution, args.epsg, chunk)
+
+    with dask.config.set(num_workers=args.workers):
+        for name, positions in periods(stack.time.values, args.period).items():
+            composites = composite(stack.isel(time=positions), args.indices, args.method, suffix,
+                                   args.cloud_buffer)
+            write(composites, args.output, name)
+            print(f"Saved {args.method} composites of {name} ({len(positions)} scenes) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Lazy water quality indices over a stackstac cube.
+
+The notebook version (szybkie indeksy wody/woda.ipynb) builds every index over
+the whole cube and masks water afterwards, which pulls the cube into memory.
+Here the indices are one dask graph: chunks follow the 1024 px JP2 tiles of
+the source bands, the water mask is evaluated first and chunks without water
+become constant NaN blocks that never read their bands, and the results are
+streamed chunk by chunk into tiled GeoTIFFs.
+
+    import catalog, cube
+    items = catalog.item_dicts(catalog.search(params))
+    stack = cube.open_cube(items, (19.77, 50.00, 20.16, 50.15), bands=['B01', 'B03', 'B04', 'B08'])
+    indices = cube.water_indices(stack, ['chla', 'turb', 'cdom', 'doc'])
+    cube.write(indices, '../output_cube')
+
+    python cube.py --bbox 19.77 50.00 20.16 50.15 --datetime 2025-04-01/2025-05-17 \\
+        --collection sentinel-2-l1c --max-cloud 1 --indices chla turb cdom doc --output ../output_cube
+"""
+import argparse
+import os
+import threading
+
+import dask
+import dask.array as da
+import numpy as np
+import pandas as pd
+import xarray as xr
+from rasterio.warp import transform_bounds
+
+import se2waq
+
+# Internal tile edge of the Sentinel-2 JP2 files, used as the chunk size
+SOURCE_TILE = 1024
+
+# Water threshold for NDWI = (B03 - B08) / (B03 + B08), used without SCL (L1C)
+NDWI_THRESHOLD = 0.1
+
+GDAL_ENV = {
+    "GDAL_NUM_THREADS": -1,
+    "GDAL_HTTP_UNSAFESSL": "YES",
+    "GDAL_HTTP_TCP_KEEPALIVE": "YES",
+    "AWS_VIRTUAL_HOSTING": "FALSE",
+    "AWS_HTTPS": "YES",
+}
+
+
+def source_transform(items, resolution):
+    """proj:transform of the first asset at the cube resolution, None if unknown"""
+    for item in items:
+        candidates = [item.get('properties', {})] + list(item.get('assets', {}).values())
+        for meta in candidates:
+            transform = meta.get('proj:transform')
+            if transform and abs(transform[0]) == resolution:
+                return transform
+    return None
+
+
+def aligned_bounds(items, bounds_latlon, epsg, resolution, chunksize=SOURCE_TILE):
+    """Cube bounds in epsg, widened so chunk edges fall on source tile edges"""
+    west, south, east, north = transform_bounds('EPSG:4326', f'EPSG:{epsg}', *bounds_latlon)
+    transform = source_transform(items, resolution)
+    if transform is None:
+        return west, south, east, north
+    step = chunksize * resolution
+    x0, y0 = transform[2], transform[5]
+    west = x0 + np.floor((west - x0) / step) * step
+    north = y0 - np.floor((y0 - north) / step) * step
+    east = west + np.ceil((east - west) / step) * step
+    south = north - np.ceil((north - south) / step) * step
+    return west, south, east, north
+
+
+def open_cube(items, bounds_latlon, bands=None, resolution=20, epsg=32634, chunksize=SOURCE_TILE):
+    """Lazy (time, band, y, x) float32 cube of STAC items, chunked like the source tiles
+
+    Values are raw digital numbers, as read by se2waq.py.
+    """
+    import stackstac
+
+    return stackstac.stack(
+        items=items,
+        assets=bands,
+        resolution=resolution,
+        bounds=aligned_bounds(items, bounds_latlon, epsg, resolution, chunksize),
+        chunksize=chunksize,
+        epsg=epsg,
+        dtype='float32',
+        rescale=False,
+        fill_value=np.float32(np.nan),
+        gdal_env=stackstac.DEFAULT_GDAL_ENV.updated(GDAL_ENV),
+    )
+
+
+def band(stack, name, suffix=''):
+    # L2A assets are named B03_20m, L1C ones B03; per-band scalar coords
+    # (title, gsd, ...) would conflict between bands, so they are dropped
+    layer = stack.sel(band=name + suffix)
+    return layer.drop_vars([coord for coord in layer.coords if layer[coord].dims == ()])
+
+
+def water_mask(stack, suffix='', ndwi_threshold=NDWI_THRESHOLD):
+    """Lazy water mask: SCL == 6 when the cube has SCL, NDWI above a threshold otherwise"""
+    if 'SCL' + suffix in stack.band.values:
+        return band(stack, 'SCL', suffix) == se2waq.SCL_WATER
+    b03 = band(stack, 'B03', suffix)
+    b08 = band(stack, 'B08', suffix)
+    return (b03 - b08) / (b03 + b08) > ndwi_threshold
+
+
+def wet_chunks(mask):
+    """Boolean array with one entry per chunk of the mask, True where it has water"""
+    flags = mask.data.map_blocks(
+        lambda block: np.array(block.any()).reshape((1,) * block.ndim),
+        chunks=tuple((1,) * len(chunks) for chunks in mask.data.chunks),
+        dtype=bool,
+    )
+    return flags.compute()
+
+
+def only_wet(values, flags):
+    """Replace the dry chunks of a lazy array by NaN blocks without dependencies"""
+    data = values.data
+    blocks = np.empty(flags.shape, dtype=object)
+    for index in np.ndindex(flags.shape):
+        if flags[index]:
+            blocks[index] = data.blocks[index]
+        else:
+            shape = tuple(chunks[i] for chunks, i in zip(data.chunks, index))
+            blocks[index] = da.full(shape, np.nan, dtype=data.dtype, chunks=shape)
+    return values.copy(data=da.block(blocks.tolist()))
+
+
+def water_indices(stack, indices=tuple(se2waq.INDICES), suffix='', ndwi_threshold=NDWI_THRESHOLD):
+    """Lazy Dataset of water-masked indices (se2waq.py formulas), one shared graph
+
+    Computes the water mask once to find the chunks with water.
+    """
+    mask = water_mask(stack, suffix, ndwi_threshold)
+    flags = wet_chunks(mask)
+    print(f"{int(flags.sum())} of {flags.size} chunks contain water")
+
+    bands = {name: band(stack, name, suffix) for name in se2waq.required_bands(indices)[:-1]}
+    data = {}
+    for name in indices:
+        values = se2waq.INDICES[name]['formula'](bands).where(mask).astype('float32')
+        data[name] = only_wet(values, flags)
+    return xr.Dataset(data, attrs={'crs': stack.attrs.get('crs')})
+
+
+def write(dataset, output_dir, crs=None):
+    """Stream every index and scene into {output_dir}/{index}/{item id}.tif, returns the paths
+
+    All files are written in one dask computation, so band reads are shared
+    between indices and only the chunks being written are in memory.
+    """
+    import rioxarray  # noqa: F401, registers the .rio accessor
+
+    crs = crs or dataset.attrs['crs']
+    tasks = []
+    paths = []
+    for name, values in dataset.data_vars.items():
+        os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+        for i in range(values.sizes['time']):
+            layer = values.isel(time=i)
+            scene = str(layer['id'].values) if 'id' in layer.coords else pd.Timestamp(layer['time'].values).strftime('%Y%m%dT%H%M%S')
+            path = os.path.join(output_dir, name, f'{scene}.tif')
+            layer = layer.drop_vars([coord for coord in layer.coords if coord not in ('x', 'y')])
+            tasks.append(layer.rio.write_crs(crs).rio.write_nodata(np.nan).rio.to_raster(
+                path, tiled=True, blockxsize=256, blockysize=256, compress='zstd',
+                lock=threading.Lock(), compute=False))
+            paths.append(path)
+    dask.compute(*tasks)
+    return paths
+
+
+def main(argv=None):
+    import catalog
+
+    parser = argparse.ArgumentParser(description="Compute water quality indices lazily over a STAC cube")
+    parser.add_argument('--bbox', type=float, nargs=4, required=True, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--datetime', required=True, help="START/END dates")
+    parser.add_argument('--collection', default='sentinel-2-l2a')
+    parser.add_argument('--max-cloud', type=float, help="maximum eo:cloud_cover")
+    parser.add_argument('--indices', nargs='+', choices=list(se2waq.INDICES), default=list(se2waq.INDICES))
+    parser.add_argument('--resolution', type=int, default=20)
+    parser.add_argument('--epsg', type=int, default=32634)
+    parser.add_argument('--output', default='../output_cube')
+    args = parser.parse_args(argv)
+
+    params = {'collections': args.collection, 'datetime': args.datetime, 'bbox': args.bbox}
+    if args.max_cloud is not None:
+        params['query'] = {'eo:cloud_cover': {'lte': args.max_cloud}}
+    items = catalog.item_dicts(catalog.search(params))
+
+    # L2A assets carry the resolution in their name and have SCL
+    suffix = f'_{args.resolution}m' if 'l2a' in args.collection else ''
+    bands = se2waq.required_bands(args.indices)
+    if not suffix:
+        bands = sorted(set(bands[:-1]) | {'B03', 'B08'})
+    stack = open_cube(items, args.bbox, [b + suffix for b in bands], args.resolution, args.epsg)
+    paths = write(water_indices(stack, args.indices, suffix), args.output)
+    print(f"Saved {len(paths)} rasters to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
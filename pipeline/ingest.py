@@ -0,0 +1,190 @@
+"""Bulk load Se2WaQ outputs into the PostGIS se2waq_* / ndci tables.
+
+All outputs are joined to the product catalog in one keyed merge on the
+product ID. Rows are streamed with COPY into a staging table and inserted in
+a single transaction; files already in a table are left alone. The GIST index
+is created after loading.
+
+    python ingest.py --geojson s2_polska_2023_2024_wkt.geojson --output ../ \\
+        --dsn "host=... dbname=... user=..." --url-base https://s3.waw3-1.cloudferro.com
+"""
+import argparse
+import io
+import os
+
+import geopandas as gpd
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+
+import manifest
+import metrics
+import se2waq
+
+STAGING = """
+CREATE TEMP TABLE se2waq_staging (
+    product_id text,
+    date date,
+    cloud_cover double precision,
+    file_path text,
+    wkt text
+) ON COMMIT DROP
+"""
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id serial PRIMARY KEY,
+    product_id text,
+    date date,
+    cloud_cover double precision,
+    file_path text,
+    geometry geometry
+)
+"""
+
+INSERT = """
+INSERT INTO {table} (product_id, date, cloud_cover, file_path, geometry)
+SELECT s.product_id, s.date, s.cloud_cover, s.file_path, ST_GeomFromText(s.wkt, {srid})
+FROM se2waq_staging s
+WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.file_path = s.file_path)
+"""
+
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS {index} ON {table} USING GIST (geometry)"
+
+
+def load_catalog(geojson_file_path):
+    """Product catalog with product_id (SAFE name), cc and geometry"""
+    if geojson_file_path.endswith('.parquet'):
+        catalog = gpd.read_parquet(geojson_file_path)
+    else:
+        catalog = gpd.read_file(geojson_file_path)
+    catalog['product_id'] = catalog['product_identifier'].str.rsplit('/', n=1).str[-1]
+    return catalog.drop_duplicates('product_id')
+
+
+def outputs_from_manifest(manifest_path, indices):
+    conn = manifest.open_manifest(manifest_path)
+    try:
+        outputs = pd.read_sql_query(
+            "SELECT product_id, index_name, output_path FROM manifest WHERE status = 'done'", conn)
+    finally:
+        conn.close()
+    return outputs[outputs['index_name'].isin(indices)]
+
+
+def outputs_from_tree(output_base_path, indices):
+    # Files are named {product_id}_{version or timestamp}_{suffix}.tif
+    records = []
+    for name in indices:
+        for root, dirs, files in os.walk(os.path.join(output_base_path, se2waq.INDICES[name]['output_dir'])):
+            for file in files:
+                if file.endswith('.tif'):
+                    records.append((file.rsplit('_', 2)[0], name, os.path.join(root, file)))
+    return pd.DataFrame(records, columns=['product_id', 'index_name', 'output_path'])
+
+
+def ingestion_rows(outputs, catalog, output_base_path, url_base=None, srid=3857):
+    """Join outputs to the catalog, returns (rows, product IDs missing from the catalog)
+
+    Geometries of a catalog with a CRS (GeoParquet is EPSG:4326) are
+    reprojected to srid, the SRID they are stored with.
+    """
+    rows = outputs.merge(
+        catalog[['product_id', 'product_identifier', 'cc', 'geometry']],
+        on='product_id', how='left', validate='many_to_one'
+    )
+    missing = rows['product_identifier'].isna()
+    missing_ids = sorted(rows.loc[missing, 'product_id'].unique())
+    rows = rows[~missing].copy()
+
+    # /eodata/Sentinel-2/MSI/L2A/YYYY/MM/DD/...
+    rows['date'] = pd.to_datetime(rows['product_identifier'].str.split('/').str[5:8].str.join('-')).dt.date
+    geometries = gpd.GeoSeries(rows['geometry'], crs=catalog.crs)
+    if geometries.crs is not None:
+        geometries = geometries.to_crs(epsg=srid)
+    rows['wkt'] = geometries.to_wkt()
+
+    if url_base:
+        # Output folders are synced as-is to their bucket:
+        # {output_dir}/YYYY/MM/DD/file.tif -> {url_base}/{bucket}/YYYY/MM/DD/file.tif
+        output_dirs = rows['index_name'].map(lambda name: se2waq.INDICES[name]['output_dir'])
+        buckets = rows['index_name'].map(lambda name: se2waq.INDICES[name]['bucket'])
+        relative = [
+            os.path.relpath(path, os.path.join(output_base_path, output_dir))
+            for path, output_dir in zip(rows['output_path'], output_dirs)
+        ]
+        rows['file_path'] = url_base.rstrip('/') + '/' + buckets + '/' + pd.Series(relative, index=rows.index)
+    else:
+        rows['file_path'] = rows['output_path']
+
+    rows = rows.rename(columns={'cc': 'cloud_cover'})
+    return rows[['index_name', 'product_id', 'date', 'cloud_cover', 'file_path', 'wkt']], missing_ids
+
+
+def load(conn, rows, srid=3857):
+    """COPY rows into their tables in one transaction, returns {table: inserted rows}"""
+    inserted = {}
+    timings = metrics.Recorder(source='pipeline', scene='*')
+    with conn:
+        with conn.cursor() as cursor:
+            cursor.execute(STAGING)
+            for name, frame in rows.groupby('index_name'):
+                table = sql.Identifier(se2waq.INDICES[name]['table'])
+                cursor.execute(sql.SQL(CREATE_TABLE).format(table=table))
+
+                with timings.stage('db_insert') as record:
+                    buffer = io.StringIO()
+                    frame.drop(columns='index_name').to_csv(buffer, index=False, header=False)
+                    buffer.seek(0)
+                    cursor.copy_expert("COPY se2waq_staging FROM STDIN WITH (FORMAT csv)", buffer)
+
+                    cursor.execute(sql.SQL(INSERT).format(table=table, srid=sql.Literal(srid)))
+                    inserted[se2waq.INDICES[name]['table']] = cursor.rowcount
+                    cursor.execute("TRUNCATE se2waq_staging")
+                    record['rows'] = record.get('rows', 0) + len(frame)
+
+            # Index after the load, so the inserts do not maintain it row by row
+            with timings.stage('db_index'):
+                for name in rows['index_name'].unique():
+                    cursor.execute(sql.SQL(CREATE_INDEX).format(
+                        index=sql.Identifier(f"{name}_geometry_idx"),
+                        table=sql.Identifier(se2waq.INDICES[name]['table'])
+                    ))
+    timings.flush()
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load Se2WaQ/NDCI outputs into PostGIS")
+    parser.add_argument('--geojson', required=True, help="product catalog, GeoJSON or GeoParquet (product_identifier, cc, geometry)")
+    parser.add_argument('--output', default='../', help="base directory of the output_* folders")
+    parser.add_argument('--manifest', help="take outputs from this manifest instead of walking --output")
+    parser.add_argument('--indices', nargs='+', choices=list(se2waq.INDICES), default=list(se2waq.INDICES))
+    parser.add_argument('--dsn', default='', help="libpq connection string, PG* environment variables otherwise")
+    parser.add_argument('--url-base', help="store {url-base}/{bucket}/... instead of local file paths")
+    parser.add_argument('--srid', type=int, default=3857, help="SRID the geometries are stored with, catalogs with a CRS are reprojected to it")
+    parser.add_argument('--metrics', help="append per-stage timings as JSON lines to this file (see metrics.py)")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.configure(args.metrics)
+
+    if args.manifest:
+        outputs = outputs_from_manifest(args.manifest, args.indices)
+    else:
+        outputs = outputs_from_tree(args.output, args.indices)
+    rows, missing_ids = ingestion_rows(outputs, load_catalog(args.geojson), args.output, args.url_base,
+                                         args.srid)
+    for product_id in missing_ids:
+        print(f"No matching record found for product ID: {product_id}")
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        inserted = load(conn, rows, args.srid)
+    finally:
+        conn.close()
+    for table, count in inserted.items():
+        print(f"{table}: {count} rows inserted")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Product manifest for resumable Se2WaQ runs.
+
+One SQLite row per (product, index, algorithm version) with the input
+checksum, output path and status. Finished work is skipped on re-runs, rows
+left 'running' by a crash are redone, and a new formula version is computed
+next to the old outputs.
+
+    python manifest.py ../se2waq_manifest.sqlite
+"""
+import datetime
+import os
+import sqlite3
+import sys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    product_id TEXT NOT NULL,
+    index_name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    input_checksum TEXT,
+    output_path TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated TEXT NOT NULL,
+    PRIMARY KEY (product_id, index_name, version)
+)
+"""
+
+
+def open_manifest(manifest_path):
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    # WAL and a busy timeout let the batch workers write concurrently
+    conn = sqlite3.connect(manifest_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(SCHEMA)
+    conn.commit()
+    return conn
+
+
+def done_outputs(conn, product_id, versions):
+    """Output paths of finished indices ({index: path}) for {index: version}"""
+    outputs = {}
+    for name, version in versions.items():
+        row = conn.execute(
+            "SELECT output_path FROM manifest "
+            "WHERE product_id = ? AND index_name = ? AND version = ? AND status = 'done'",
+            (product_id, name, version)
+        ).fetchone()
+        # A deleted output file counts as not done
+        if row and os.path.exists(row[0]):
+            outputs[name] = row[0]
+    return outputs
+
+
+def mark(conn, product_id, name, version, status, input_checksum=None, output_path=None, error=None):
+    conn.execute(
+        "INSERT OR REPLACE INTO manifest "
+        "(product_id, index_name, version, input_checksum, output_path, status, error, updated) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (product_id, name, version, input_checksum, output_path, status, error,
+         datetime.datetime.now().isoformat(timespec='seconds'))
+    )
+    conn.commit()
+
+
+def summary(conn):
+    """Row counts per index, version and status"""
+    return conn.execute(
+        "SELECT index_name, version, status, COUNT(*) FROM manifest "
+        "GROUP BY index_name, version, status ORDER BY index_name, version, status"
+    ).fetchall()
+
+
+if __name__ == '__main__':
+    conn = open_manifest(sys.argv[1])
+    for name, version, status, count in summary(conn):
+        print(f"{name:6} {version} {status:8} {count}")
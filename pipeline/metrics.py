@@ -0,0 +1,321 @@
+"""Per-stage timing and resource records of the processing pipeline and the app.
+
+Every stage of a scene appends one JSON line to the metrics file:
+
+- listing: resolving the band assets;
+- read: opening the band files;
+- warp: reading and warping the bands;
+- compute: the index values;
+- normalize: the uint8 stretch;
+- cog_write: writing the COGs;
+- cube_append: adding the values to the time-series cubes;
+- db_insert: loading rows into PostGIS;
+- db_index: building the geometry index afterwards.
+
+Each line holds wall and CPU time, bytes read, GDAL network bytes and
+requests, peak RSS and pixels (rows for db_insert). Stages repeated within a
+scene, such as one per tile, are summed into one line. The app records
+every rerun of a map tab the same way: ee_layers, map_build (which includes
+the other two), to_streamlit, and the rerun as a whole.
+
+Recording is off unless SE2WAQ_METRICS names the file. se2waq.py, batch.py
+and ingest.py set it from --metrics, and pool workers inherit it. The app
+sets it from K_WQ_METRICS.
+
+    python batch.py --geojson s2.geojson --metrics night.jsonl
+    python metrics.py night.jsonl                               # totals per stage
+    python metrics.py night.jsonl --prometheus night.prom       # Prometheus text format
+    python metrics.py last_night.jsonl night.jsonl              # change per stage
+
+    import metrics
+    with metrics.stage('warp', source='pipeline', scene=product_id) as record:
+        bands = warp.read(scene)
+        record['pixels'] += bands['SCL'].size
+
+bytes_read is what the process read through read() calls (rchar: local
+files, pipes). network_bytes and network_requests are what GDAL fetched over
+HTTP (/vsis3/, /vsicurl/); they are only counted once rasterio is loaded.
+peak_rss_bytes is the high-water mark of the process during the stage.
+On Linux it is reset at every stage.
+"""
+import argparse
+import contextlib
+import ctypes
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+METRICS_ENV = 'SE2WAQ_METRICS'
+
+# Run label shared by all processes of a run
+RUN_ENV = 'SE2WAQ_METRICS_RUN'
+
+# Summed over calls and records; peak_rss_bytes is a maximum
+COUNTERS = ['calls', 'wall_s', 'cpu_s', 'bytes_read', 'network_bytes', 'network_requests', 'pixels', 'rows', 'layers']
+
+# Record fields that identify what was measured
+LABELS = ['source', 'stage', 'scene', 'page', 'tab']
+
+PROMETHEUS = {
+    'calls': ('se2waq_stage_calls_total', 'counter', "Times a stage ran"),
+    'wall_s': ('se2waq_stage_seconds_total', 'counter', "Wall time spent in a stage"),
+    'cpu_s': ('se2waq_stage_cpu_seconds_total', 'counter', "Process CPU time spent in a stage"),
+    'bytes_read': ('se2waq_stage_read_bytes_total', 'counter', "Bytes read by the process in a stage"),
+    'network_bytes': ('se2waq_stage_network_bytes_total', 'counter', "Bytes GDAL downloaded in a stage"),
+    'network_requests': ('se2waq_stage_network_requests_total', 'counter', "HTTP requests GDAL made in a stage"),
+    'pixels': ('se2waq_stage_pixels_total', 'counter', "Pixels processed in a stage"),
+    'rows': ('se2waq_stage_rows_total', 'counter', "Rows inserted in a stage"),
+    'layers': ('se2waq_stage_layers_total', 'counter', "Map layers resolved in a stage"),
+    'peak_rss_bytes': ('se2waq_stage_peak_rss_bytes', 'gauge', "Highest process RSS during a stage"),
+}
+
+_lock = threading.Lock()
+# Open stages (their running peak RSS), outermost first
+_active = []
+_gdal = None
+
+
+def configure(path):
+    """Record to path from now on, in this process and the ones it starts"""
+    os.environ[METRICS_ENV] = os.path.abspath(path)
+    os.environ.setdefault(RUN_ENV, datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+    # Read by GDAL once, before its first network access
+    os.environ.setdefault('CPL_VSIL_NETWORK_STATS_ENABLED', 'YES')
+
+
+def enabled():
+    return bool(os.environ.get(METRICS_ENV))
+
+
+def read_proc(path, key):
+    """Integer field of a /proc/self file, None where there is no /proc"""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(key):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss():
+    """High-water RSS of the process in bytes"""
+    peak = read_proc('/proc/self/status', 'VmHWM:')
+    if peak is not None:
+        return peak * 1024
+    import resource
+
+    # kB on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def gdal_library():
+    """ctypes handle of the GDAL library rasterio loaded, None before rasterio is imported"""
+    global _gdal
+    if _gdal is None and 'rasterio' in sys.modules:
+        _gdal = False
+        try:
+            with open('/proc/self/maps') as f:
+                paths = sorted({line.split()[-1] for line in f if 'libgdal' in line})
+            if paths:
+                library = ctypes.CDLL(paths[0])
+                library.VSINetworkStatsGetAsSerializedJSON.restype = ctypes.c_void_p
+                library.VSINetworkStatsGetAsSerializedJSON.argtypes = [ctypes.c_char_p]
+                library.VSIFree.argtypes = [ctypes.c_void_p]
+                _gdal = library
+        except (OSError, AttributeError):
+            pass
+    return _gdal or None
+
+
+def network_stats():
+    """(bytes downloaded, requests) by GDAL since the last reset, (0, 0) without GDAL"""
+    library = gdal_library()
+    if library is None:
+        return 0, 0
+    pointer = library.VSINetworkStatsGetAsSerializedJSON(None)
+    if not pointer:
+        return 0, 0
+    try:
+        methods = json.loads(ctypes.string_at(pointer).decode()).get('methods', {})
+    finally:
+        library.VSIFree(pointer)
+    return (sum(method.get('downloaded_bytes', 0) for method in methods.values()),
+            sum(method.get('count', 0) for method in methods.values()))
+
+
+def counters():
+    network_bytes, network_requests = network_stats()
+    return {
+        'wall_s': time.perf_counter(),
+        'cpu_s': time.process_time(),
+        'bytes_read': read_proc('/proc/self/io', 'rchar:') or 0,
+        'network_bytes': network_bytes,
+        'network_requests': network_requests,
+    }
+
+
+def _enter(entry):
+    with _lock:
+        peak = peak_rss()
+        for active in _active:
+            active['peak'] = max(active['peak'], peak)
+        reset_peak_rss()
+        if not _active:
+            # GDAL's statistics list every file, keep them short
+            library = gdal_library()
+            if library is not None:
+                library.VSINetworkStatsReset()
+        _active.append(entry)
+
+
+def _exit(entry):
+    with _lock:
+        peak = peak_rss()
+        for active in _active:
+            active['peak'] = max(active['peak'], peak)
+        _active.remove(entry)
+    return entry['peak']
+
+
+class Recorder:
+    """Stage records of one unit of work (a scene, an app rerun), written by flush()
+
+    Repeated stages (e.g. one per tile) add up into one record.
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.records = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = self.records.setdefault(name, {'stage': name, 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                'bytes_read': 0, 'network_bytes': 0, 'network_requests': 0,
+                                                'pixels': 0, 'peak_rss_bytes': 0})
+        if not enabled():
+            yield record
+            return
+        entry = {'peak': 0}
+        _enter(entry)
+        start = counters()
+        try:
+            yield record
+        finally:
+            end = counters()
+            record['peak_rss_bytes'] = max(record['peak_rss_bytes'], _exit(entry))
+            record['calls'] += 1
+            for key, value in end.items():
+                record[key] += value - start[key]
+
+    def flush(self):
+        """Append the records to the metrics file and start over"""
+        records = [record for record in self.records.values() if record['calls']]
+        self.records = {}
+        if not enabled() or not records:
+            return
+        common = {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'run': os.environ.get(RUN_ENV),
+            'pid': os.getpid(),
+        }
+        lines = ''.join(json.dumps(dict(common, **self.labels, **record), sort_keys=True, default=str) + '\n'
+                        for record in records)
+        # One append per flush, so lines of parallel workers do not interleave
+        with _lock, open(os.environ[METRICS_ENV], 'a') as f:
+            f.write(lines)
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    """Record one stage on its own, also when it fails"""
+    recorder = Recorder(**labels)
+    try:
+        with recorder.stage(name) as record:
+            yield record
+    finally:
+        recorder.flush()
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records, labels=('source', 'stage')):
+    """Totals of the records per combination of labels, in a stable order"""
+    totals = {}
+    for record in records:
+        key = tuple(record.get(label) or '' for label in labels)
+        total = totals.setdefault(key, dict.fromkeys(COUNTERS, 0) | {'peak_rss_bytes': 0})
+        for counter in COUNTERS:
+            total[counter] += record.get(counter) or 0
+        total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record.get('peak_rss_bytes') or 0)
+    return dict(sorted(totals.items()))
+
+
+def prometheus(totals, labels=('source', 'stage')):
+    """Prometheus text exposition of summarize() totals"""
+    lines = []
+    for field, (metric, kind, description) in PROMETHEUS.items():
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for key, total in totals.items():
+            label_text = ','.join(f'{label}="{value}"' for label, value in zip(labels, key))
+            lines.append(f"{metric}{{{label_text}}} {total[field]:.6g}")
+    return '\n'.join(lines) + '\n'
+
+
+def print_table(totals, before=None):
+    print(f"{'stage':34s} {'calls':>7s} {'wall s':>10s} {'cpu s':>10s} {'read MB':>9s} {'net MB':>9s} "
+          f"{'peak MB':>8s} {'Mpx':>8s}" + (f" {'wall vs before':>15s}" if before is not None else ''))
+    for key, total in totals.items():
+        line = (f"{'/'.join(key):34s} {total['calls']:7d} {total['wall_s']:10.2f} {total['cpu_s']:10.2f} "
+                f"{total['bytes_read'] / 1e6:9.1f} {total['network_bytes'] / 1e6:9.1f} "
+                f"{total['peak_rss_bytes'] / 1e6:8.0f} {total['pixels'] / 1e6:8.1f}")
+        if before is not None:
+            previous = before.get(key)
+            line += f" {total['wall_s'] / previous['wall_s']:14.2f}x" if previous and previous['wall_s'] else f" {'new':>15s}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize per-stage metrics (JSON lines) of a run")
+    parser.add_argument('files', nargs='+', metavar='FILE', help="metrics file, or a baseline and a metrics file")
+    parser.add_argument('--by', nargs='+', choices=LABELS, default=['source', 'stage'],
+                        help="labels to total by (default: source stage)")
+    parser.add_argument('--run', help="only records of this run label")
+    parser.add_argument('--prometheus', help="write the totals in Prometheus text format")
+    args = parser.parse_args(argv)
+    if len(args.files) > 2:
+        parser.error("give one metrics file, or a baseline and a metrics file")
+
+    totals = []
+    for path in args.files:
+        records = read_records(path)
+        if args.run:
+            records = [record for record in records if record.get('run') == args.run]
+        totals.append(summarize(records, args.by))
+
+    print_table(totals[-1], totals[0] if len(totals) == 2 else None)
+    if args.prometheus:
+        with open(args.prometheus + '.part', 'w') as f:
+            f.write(prometheus(totals[-1], args.by))
+        os.replace(args.prometheus + '.part', args.prometheus)
+        print(f"Saved {args.prometheus}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Mergeable streaming histograms and fixed per-season scales of the indices.
+
+The notebooks stretch every scene between its own min and max, which needs
+the whole water array first and gives the same uint8 value a different
+concentration on every date. Instead, se2waq.py adds each tile's values to
+a fixed-bin histogram while it processes a scene (one small file per product
+and index). Histograms of a season are summed, and robust quantiles
+(2 % / 98 % by default) give one fixed range per index. Scenes normalized
+with that range need no scene-wide pass and are comparable over time.
+
+    python se2waq.py --path-list paths.txt --histogram-dir ../histograms
+    python scales.py ../histograms --season 2024 --output ../scales.json
+    python se2waq.py --path-list paths.txt --scales ../scales.json --tile-size
+
+    import scales
+    counts = scales.read_histograms('../histograms', 'cdom', '2024')
+    scales.quantile(counts, 0.5)
+
+Bins are uniform in asinh(value), about 0.35 % of the value wide above 1
+and 0.0035 wide around 0, so one layout fits every index and histograms of any
+scenes can be added.
+"""
+import argparse
+import functools
+import json
+import os
+
+import numpy as np
+
+BINS = 8192
+
+# Values beyond +-LIMIT fall into the outer bins
+LIMIT = 1e6
+_SPAN = np.arcsinh(LIMIT)
+
+QUANTILES = (0.02, 0.98)
+
+
+def bin_index(values):
+    position = (np.arcsinh(values) + _SPAN) * (BINS / (2 * _SPAN))
+    return np.clip(position, 0, BINS - 1).astype(np.intp)
+
+
+def bin_value(position):
+    """Value at a (fractional) bin position"""
+    return np.sinh(position * (2 * _SPAN / BINS) - _SPAN)
+
+
+def histogram(values):
+    """int64 counts of the finite values over the fixed bins"""
+    finite = values[np.isfinite(values)]
+    return np.bincount(bin_index(finite), minlength=BINS).astype(np.int64)
+
+
+def empty():
+    return np.zeros(BINS, dtype=np.int64)
+
+
+def quantile(counts, q):
+    """Approximate q-quantile of a histogram (linear within the bin), None if empty"""
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    if total == 0:
+        return None
+    target = q * total
+    i = min(int(np.searchsorted(cumulative, target)), BINS - 1)
+    before = cumulative[i - 1] if i else 0
+    fraction = (target - before) / counts[i] if counts[i] else 0
+    return float(bin_value(i + fraction))
+
+
+def season_of(date):
+    """Season of a YYYY-MM-DD date: the calendar year"""
+    return str(date)[:4]
+
+
+def histogram_path(histogram_dir, name, product_id):
+    return os.path.join(histogram_dir, name, f'{product_id}.npz')
+
+
+def write_histograms(histograms, histogram_dir, product_id, date):
+    """Store one product's histograms (index -> counts), replacing earlier ones"""
+    for name, counts in histograms.items():
+        path = histogram_path(histogram_dir, name, product_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'wb') as f:
+            np.savez_compressed(f, counts=counts, date=str(date))
+        os.replace(path + '.part', path)
+
+
+def read_histograms(histogram_dir, name, season=None):
+    """Sum of the histograms of an index, optionally of one season only"""
+    total = empty()
+    directory = os.path.join(histogram_dir, name)
+    if not os.path.isdir(directory):
+        return total
+    for file in os.listdir(directory):
+        if not file.endswith('.npz'):
+            continue
+        with np.load(os.path.join(directory, file)) as stored:
+            if season is None or season_of(stored['date']) == season:
+                total += stored['counts']
+    return total
+
+
+def season_scales(histogram_dir, indices, season, quantiles=QUANTILES):
+    """Fixed range of every index with data in a season"""
+    table = {}
+    for name in indices:
+        counts = read_histograms(histogram_dir, name, season)
+        if counts.sum():
+            low, high = quantiles
+            table[name] = {'vmin': quantile(counts, low), 'vmax': quantile(counts, high),
+                           'quantiles': list(quantiles), 'count': int(counts.sum())}
+    return table
+
+
+def write_scales(table, path, season):
+    """Add a season's ranges to a scales file"""
+    scales = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            scales = json.load(f)
+    scales.setdefault(season, {}).update(table)
+    with open(path + '.part', 'w') as f:
+        json.dump(scales, f, indent=2, sort_keys=True)
+    os.replace(path + '.part', path)
+
+
+@functools.lru_cache(maxsize=8)
+def load_scales(path, mtime):
+    with open(path) as f:
+        return json.load(f)
+
+
+def scene_ranges(path, indices, date):
+    """Fixed (vmin, vmax) of the indices for a scene date, indices without a range are left out"""
+    season = load_scales(path, os.path.getmtime(path)).get(season_of(date), {})
+    return {name: (season[name]['vmin'], season[name]['vmax']) for name in indices if name in season}
+
+
+def main(argv=None):
+    import se2waq
+
+    parser = argparse.ArgumentParser(description="Fixed per-season index ranges from the scene histograms")
+    parser.add_argument('histogram_dir')
+    parser.add_argument('--season', required=True, help="season to aggregate (the year, e.g. 2024)")
+    parser.add_argument('--indices', nargs='+', choices=list(se2waq.INDICES), default=list(se2waq.INDICES))
+    parser.add_argument('--quantiles', type=float, nargs=2, default=QUANTILES, metavar=('LOW', 'HIGH'))
+    parser.add_argument('--output', default='../scales.json')
+    args = parser.parse_args(argv)
+
+    table = season_scales(args.histogram_dir, args.indices, args.season, tuple(args.quantiles))
+    write_scales(table, args.output, args.season)
+    for name, scale in table.items():
+        print(f"{name}: {scale['vmin']:.4g} .. {scale['vmax']:.4g} ({scale['count']} pixels)")
+    print(f"Saved {args.season} scales to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,649 @@
+"""Se2WaQ water quality indices for Sentinel-2 L2A products.
+
+Replaces the per-index notebooks in stare_notebooki/: every band of a SAFE
+product is read and warped to EPSG:3857 once (see warp.py), and all requested
+indices (CDOM, DOC, Chl-a, turbidity, cyanobacteria, color, NDCI) are computed
+from the same arrays and written as COGs.
+
+    python se2waq.py --geojson s2_polska_2023_2024_wkt.geojson --output ../
+    python se2waq.py --path-list paths.txt --indices cdom doc --tile-size 1024
+    python se2waq.py --path-list paths.txt --tile-size 1024 --scales ../scales.json
+    python se2waq.py --path-list paths.txt --cube-store ../cubes --regions krakow sniardwy
+"""
+import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+
+import numpy as np
+import rasterio
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+from rio_cogeo.cogeo import cog_translate
+from rio_cogeo.profiles import cog_profiles
+
+import assets
+import colorize
+import manifest
+import metrics
+import scales
+import timeseries
+import warp
+import zonal
+
+S3_ENDPOINT = 'eodata.cloudferro.com'
+
+# SCL class used as the water mask
+SCL_WATER = 6
+
+NODATA = 255
+
+# Tile edge in pixels for the bounded-memory mode (multiple of the 256 block size)
+TILE_SIZE = 1024
+
+
+# Index formulas, evaluated on the water pixels of the warped bands
+def cdom(b):
+    return 537 * np.exp(-2.93 * (b['B03'] / b['B04']))
+
+
+def doc(b):
+    return 432 * np.exp(-2.24 * (b['B03'] / b['B04']))
+
+
+def chla(b):
+    return 4.26 * np.power(b['B03'] / b['B01'], 3.94)
+
+
+def turb(b):
+    return 8.93 * (b['B03'] / b['B01']) - 6.39
+
+
+def cya(b):
+    return 115530.31 * np.power((b['B03'] * b['B04']) / b['B02'], 2.38)
+
+
+def color(b):
+    return 25366 * np.exp(-4.53 * (b['B03'] / b['B04']))
+
+
+def ndci(b):
+    return (b['B05'] - b['B04']) / (b['B05'] + b['B04']) * 100
+
+
+# Index definitions
+# version: bump to reprocess an index when its output changes for another reason
+# stretch: 'sqrt'   - square root stretch between scene min and max
+#          'linear' - linear stretch between scene min and max
+#          'fixed'  - linear stretch over a fixed physical range
+# low_stretch: after the sqrt stretch, values up to this level are spread over 0-255
+INDICES = {
+    'cdom': {
+        'bands': ['B03', 'B04'],
+        'version': 1,
+        'formula': cdom,
+        'stretch': 'sqrt',
+        'colormap': 'plasma',
+        'output_dir': 'output_se2waq_cdom',
+        'table': 'se2waq_cdom',
+        'bucket': 'SE2WAQ_CDOM',
+        'suffix': 'Se2WaQ',
+    },
+    'doc': {
+        'bands': ['B03', 'B04'],
+        'version': 1,
+        'formula': doc,
+        'stretch': 'sqrt',
+        'colormap': 'gist_earth',
+        'output_dir': 'output_se2waq_doc',
+        'table': 'se2waq_doc',
+        'bucket': 'SE2WAQ_DOC',
+        'suffix': 'Se2WaQ',
+    },
+    'chla': {
+        'bands': ['B01', 'B03'],
+        'version': 1,
+        'formula': chla,
+        'stretch': 'fixed',
+        'range': (0, 20),
+        'colormap': 'nipy_spectral',
+        'output_dir': 'output_se2waq_chla',
+        'table': 'se2waq_chla',
+        'bucket': 'SE2WAQ_CHLA',
+        'suffix': 'Se2WaQ',
+    },
+    'turb': {
+        'bands': ['B01', 'B03'],
+        'version': 1,
+        'formula': turb,
+        'stretch': 'sqrt',
+        'low_stretch': 10,
+        'colormap': 'turbo',
+        'output_dir': 'output_se2waq_turb',
+        'table': 'se2waq_turb',
+        'bucket': 'SE2WAQ_TURB',
+        'suffix': 'Se2WaQ',
+    },
+    'cya': {
+        'bands': ['B02', 'B03', 'B04'],
+        'version': 1,
+        'formula': cya,
+        'stretch': 'sqrt',
+        'low_stretch': 25,
+        'colormap': 'brg',
+        'output_dir': 'output_se2waq_cya',
+        'table': 'se2waq_cya',
+        'bucket': 'SE2WAQ_CYA',
+        'suffix': 'Se2WaQ',
+    },
+    'color': {
+        'bands': ['B03', 'B04'],
+        'version': 1,
+        'formula': color,
+        'stretch': 'sqrt',
+        'colormap': 'viridis_r',
+        'output_dir': 'output_se2waq_color',
+        'table': 'se2waq_color',
+        'bucket': 'SE2WAQ_COLOR',
+        'suffix': 'Se2WaQ',
+    },
+    'ndci': {
+        'bands': ['B04', 'B05'],
+        'version': 1,
+        'formula': ndci,
+        'stretch': 'linear',
+        'colormap': 'Spectral',
+        'output_dir': 'output_ndci',
+        'table': 'ndci',
+        'bucket': 'NDCI',
+        'suffix': 'NDCI',
+    },
+}
+
+COG_CONFIG = {
+    "GDAL_NUM_THREADS": "ALL_CPUS",
+    "GDAL_TIFF_INTERNAL_MASK": True,
+    "GDAL_TIFF_OVR_BLOCKSIZE": "256",
+    "BIGTIFF": "YES",
+    "SPARSE_OK": "TRUE",
+    "COMPRESS": "ZSTD",
+}
+
+
+def configure_s3():
+    """Set the GDAL/S3 environment for eodata (keys come from .env)"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    os.environ['GDAL_HTTP_TCP_KEEPALIVE'] = "YES"
+    os.environ['AWS_S3_ENDPOINT'] = S3_ENDPOINT
+    os.environ['AWS_HTTPS'] = "YES"
+    os.environ['AWS_VIRTUAL_HOSTING'] = "FALSE"
+    # Let GDAL retry throttled or dropped S3 requests before failing a read
+    os.environ.setdefault('GDAL_HTTP_MAX_RETRY', "5")
+    os.environ.setdefault('GDAL_HTTP_RETRY_DELAY', "2")
+
+
+def extract_date_and_tile_id(identifier):
+    try:
+        date_part = "/".join(identifier.split('/')[5:8])
+        date_obj = datetime.datetime.strptime(date_part, '%Y/%m/%d')
+        tile_id = identifier.split('_')[-2]
+        return date_obj.year, date_obj.month, date_obj.day, tile_id
+    except Exception as e:
+        print(f"Error extracting date and tile ID from identifier {identifier}: {e}")
+        return None, None, None, None
+
+
+def required_bands(indices):
+    bands = sorted({band for name in indices for band in INDICES[name]['bands']})
+    return bands + ['SCL']
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_for(name):
+    """256-entry GDAL colormap for an index"""
+    return colorize.gdal_colormap(INDICES[name]['colormap'])
+
+
+def iter_windows(width, height, tile_size):
+    # Tiles aligned to a tile_size grid, clipped at the right and bottom edges
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            yield Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+
+
+def compute_values(bands, indices):
+    """Index values on the water pixels of a scene or tile, NaN elsewhere"""
+    water_mask = bands['SCL'] == SCL_WATER
+    water = {band: array[water_mask] for band, array in bands.items() if band != 'SCL'}
+
+    values = {}
+    for name in indices:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            water_values = INDICES[name]['formula'](water)
+        image = np.full(water_mask.shape, np.nan, dtype=np.float32)
+        image[water_mask] = water_values
+        values[name] = image
+    return values
+
+
+def value_range(values, current=None):
+    """Min/max of the finite values, merged with a range from other tiles"""
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return current
+    vmin, vmax = finite.min(), finite.max()
+    if current is not None:
+        vmin, vmax = min(vmin, current[0]), max(vmax, current[1])
+    return vmin, vmax
+
+
+def normalize(name, values, vrange):
+    """Scale index values to uint8, NaN (no water, invalid) becomes nodata"""
+    spec = INDICES[name]
+    valid = np.isfinite(values)
+    result = np.full(values.shape, NODATA, dtype='uint8')
+    if not valid.any():
+        return result
+    values = values[valid]
+
+    if spec['stretch'] == 'fixed':
+        vmin, vmax = spec['range']
+        scaled = np.clip((values - vmin) / (vmax - vmin), 0, 1) * 255
+        result[valid] = scaled.round().astype('uint8')
+        return result
+
+    vmin, vmax = vrange
+    span = vmax - vmin if vmax > vmin else 1
+    if spec['stretch'] == 'linear':
+        scaled = (values - vmin) / span * 255
+    else:
+        # Values below a fixed season range are clipped like those above it
+        scaled = np.sqrt(np.maximum(values - vmin, 0)) / np.sqrt(span) * 255
+    scaled = np.clip(scaled, 0, 255).round().astype('uint8')
+
+    low = spec.get('low_stretch')
+    if low:
+        low_values = scaled <= low
+        scaled[low_values] = (scaled[low_values] / low * 255).round().astype('uint8')
+
+    result[valid] = scaled
+    return result
+
+
+def image_profile(profile):
+    kwargs = profile.copy()
+    kwargs.update({
+        'driver': 'GTiff',
+        'dtype': 'uint8',
+        'count': 1,
+        'nodata': NODATA,
+        'compress': 'zstd',
+    })
+    return kwargs
+
+
+def write_cog(image, profile, name, output_filename):
+    with MemoryFile() as memfile:
+        with memfile.open(**image_profile(profile)) as dst:
+            dst.write(image, 1)
+            dst.write_colormap(1, colormap_for(name))
+
+        cog_translate(
+            memfile.name,
+            output_filename,
+            cog_profiles.get("deflate"),
+            config=COG_CONFIG,
+            in_memory=True,
+            quiet=True
+        )
+
+
+def write_indices(scene, indices, output_filenames, water_bodies=None, ranges=None, timings=None, regions=None):
+    """Whole-array path: warp the full scene into memory and write every index
+
+    Indices in ranges (index -> fixed season range, see scales.py) are
+    stretched over that range instead of the scene's min/max. Returns the
+    water body statistics for zonal.summarize (None without water_bodies), the
+    value histograms of the indices and the values on the grid of every
+    region the scene covers (see timeseries.regrid). Stage timings go to a
+    metrics.Recorder.
+    """
+    ranges = ranges or {}
+    timings = timings or metrics.Recorder()
+    pixels = scene['profile']['width'] * scene['profile']['height']
+    with timings.stage('warp') as record:
+        bands = warp.read(scene)
+        record['pixels'] += pixels
+    with timings.stage('compute') as record:
+        values = compute_values(bands, indices)
+        histograms = {name: scales.histogram(values[name]) for name in indices}
+        record['pixels'] += pixels * len(indices)
+    for name in indices:
+        with timings.stage('normalize') as record:
+            image = normalize(name, values[name], ranges.get(name) or value_range(values[name]))
+            record['pixels'] += pixels
+        with timings.stage('cog_write') as record:
+            write_cog(image, scene['profile'], name, output_filenames[name])
+            record['pixels'] += pixels
+
+    profile = scene['profile']
+    cubes = {}
+    for region in regions or []:
+        grid = timeseries.region_grid(region)
+        cubes[region] = timeseries.regrid(values, profile['crs'], profile['transform'], None, grid)
+    cubes = {region: cube for region, cube in cubes.items() if cube is not None}
+
+    water_stats = None
+    if water_bodies is not None:
+        water_stats = zonal.sample(water_bodies, profile['crs'], profile['transform'], None, bands['SCL'], values)
+    return water_stats, histograms, cubes
+
+
+def write_indices_windowed(scene, indices, output_filenames, tile_size=TILE_SIZE, water_bodies=None,
+                           ranges=None, timings=None, regions=None):
+    """Tiled path: peak memory is bounded by tile_size, output is byte-identical to write_indices
+
+    Indices with a fixed range are normalized tile by tile in a single pass;
+    the others keep their float values on disk until the scene's min/max is known.
+    """
+    if tile_size % 256:
+        raise ValueError("tile_size must be a multiple of 256")
+    timings = timings or metrics.Recorder()
+
+    profile = scene['profile']
+    windows = list(iter_windows(profile['width'], profile['height'], tile_size))
+    tiled = {'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'BIGTIFF': 'IF_SAFER'}
+    ranges = {name: (ranges or {}).get(name) for name in indices}
+    deferred = [name for name in indices if ranges[name] is None]
+    histograms = {name: scales.empty() for name in indices}
+    grids = {region: timeseries.region_grid(region) for region in regions or []}
+    cubes = dict.fromkeys(grids)
+
+    with tempfile.TemporaryDirectory() as tmpdir, contextlib.ExitStack() as stack:
+        image_paths = {name: os.path.join(tmpdir, f'{name}.tif') for name in indices}
+        images = {
+            name: stack.enter_context(rasterio.open(image_paths[name], 'w', **image_profile(profile), **tiled))
+            for name in indices if name not in deferred
+        }
+
+        # First pass: warp and compute tile by tile; fixed-range indices are
+        # written right away, the others go to a float file while the
+        # scene-wide min/max needed by the stretch is collected
+        values_path = os.path.join(tmpdir, 'values.tif')
+        values_profile = profile.copy()
+        values_profile.update(tiled)
+        values_profile.update({
+            'driver': 'GTiff',
+            'dtype': 'float32',
+            'count': max(len(deferred), 1),
+            'nodata': np.nan,
+            'compress': 'zstd',
+            'predictor': 3,
+        })
+        water_stats = None
+        with rasterio.open(values_path, 'w', **values_profile) as tmp:
+            for window in windows:
+                pixels = window.width * window.height
+                with timings.stage('warp') as record:
+                    bands = warp.read(scene, window)
+                    record['pixels'] += pixels
+                with timings.stage('compute') as record:
+                    values = compute_values(bands, indices)
+                    for name in indices:
+                        histograms[name] += scales.histogram(values[name])
+                    record['pixels'] += pixels * len(indices)
+                if water_bodies is not None:
+                    water_stats = zonal.add(water_stats, zonal.sample(
+                        water_bodies, profile['crs'], profile['transform'], window, bands['SCL'], values))
+                for region, grid in grids.items():
+                    cubes[region] = timeseries.regrid(values, profile['crs'], profile['transform'], window, grid,
+                                                      cubes[region])
+                with timings.stage('normalize') as record:
+                    for name in images:
+                        images[name].write(normalize(name, values[name], ranges[name]), 1, window=window)
+                    for band, name in enumerate(deferred, 1):
+                        ranges[name] = value_range(values[name], ranges[name])
+                        tmp.write(values[name], band, window=window)
+                    record['pixels'] += pixels * len(indices)
+        for name, image in images.items():
+            image.write_colormap(1, colormap_for(name))
+
+        # Second pass: normalize the other indices with the scene-wide range
+        with timings.stage('normalize') as record, rasterio.open(values_path) as tmp:
+            for band, name in enumerate(deferred, 1):
+                with rasterio.open(image_paths[name], 'w', **image_profile(profile), **tiled) as dst:
+                    for window in windows:
+                        dst.write(normalize(name, tmp.read(band, window=window), ranges[name]), 1, window=window)
+                    dst.write_colormap(1, colormap_for(name))
+                record['pixels'] += profile['width'] * profile['height']
+        stack.close()
+
+        for name in indices:
+            with timings.stage('cog_write') as record:
+                cog_translate(
+                    image_paths[name],
+                    output_filenames[name],
+                    cog_profiles.get("deflate"),
+                    config=COG_CONFIG,
+                    in_memory=False,
+                    quiet=True
+                )
+                record['pixels'] += profile['width'] * profile['height']
+    return water_stats, histograms, {region: cube for region, cube in cubes.items() if cube is not None}
+
+
+def index_version(name):
+    """Algorithm version of an index: its version number plus a hash of
+    everything that changes the output (formula source, stretch, colormap)"""
+    spec = INDICES[name]
+    parts = [
+        inspect.getsource(spec['formula']),
+        spec['stretch'],
+        repr(spec.get('range')),
+        repr(spec.get('low_stretch')),
+        spec['colormap'],
+    ]
+    digest = hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:8]
+    return f"v{spec['version']}-{digest}"
+
+
+def input_checksum(band_paths):
+    # SAFE products are immutable, so their band hrefs identify the input
+    listing = '\n'.join(f"{band}={href}" for band, href in sorted(band_paths.items()))
+    return hashlib.sha1(listing.encode()).hexdigest()
+
+
+def output_path(directory_path, output_base_path, name, date):
+    # Deterministic name: a re-run overwrites instead of adding a copy, and a
+    # new algorithm version gets its own file
+    year, month, day = date
+    spec = INDICES[name]
+    unique_id = f"{os.path.basename(directory_path)}_{index_version(name)}_{spec['suffix']}"
+    date_path = os.path.join(output_base_path, spec['output_dir'], f"{year}/{month:02d}/{day:02d}")
+    os.makedirs(date_path, exist_ok=True)
+    return os.path.join(date_path, f"{unique_id}.tif")
+
+
+def write_scene(band_paths, indices, output_filenames, tile_size=None, water_bodies=None, ranges=None,
+                timings=None, regions=None):
+    """Warp a band set and write the indices, files appear only once complete
+
+    Returns the water body statistics, the value histograms and the region
+    values (see write_indices).
+    """
+    timings = timings or metrics.Recorder()
+    part_filenames = {name: output_filenames[name] + '.part' for name in indices}
+    with contextlib.ExitStack() as stack:
+        with timings.stage('read'):
+            scene = stack.enter_context(warp.open_stack(band_paths))
+        options = dict(water_bodies=water_bodies, ranges=ranges, timings=timings, regions=regions)
+        if tile_size:
+            collected = write_indices_windowed(scene, indices, part_filenames, tile_size=tile_size, **options)
+        else:
+            collected = write_indices(scene, indices, part_filenames, **options)
+    for name in indices:
+        os.replace(part_filenames[name], output_filenames[name])
+    return collected
+
+
+def process_scene(directory_path, output_base_path, indices=tuple(INDICES), tile_size=None,
+                  manifest_path=None, force=False, water_bodies=None, stats_dir=None,
+                  histogram_dir=None, scales_path=None, cube_store=None, regions=None):
+    """Compute all requested indices for one SAFE product, returns the output files
+
+    With tile_size the scene is streamed in tiles instead of warped into memory.
+    With manifest_path indices already done at their current version are skipped.
+    With water_bodies (polygon file) zonal statistics are written to stats_dir.
+    With histogram_dir the value histograms are stored for scales.py; with
+    scales_path (scales.py output) indices are stretched over the fixed
+    range of the scene's season instead of its own min/max. With cube_store
+    the index values are appended to the time-series cubes of the regions
+    (see timeseries.py).
+    """
+    print(f"Calculating Se2WaQ for {directory_path}:")
+
+    year, month, day, tile_id = extract_date_and_tile_id(directory_path)
+    if year is None:
+        print(f"Skipping directory {directory_path} due to missing date or tile information.")
+        return []
+
+    product_id = os.path.basename(directory_path)
+    date = f'{year:04d}-{month:02d}-{day:02d}'
+    versions = {name: index_version(name) for name in indices}
+    timings = metrics.Recorder(source='pipeline', scene=product_id)
+    conn = manifest.open_manifest(manifest_path) if manifest_path else None
+    try:
+        done = {} if conn is None or force else manifest.done_outputs(conn, product_id, versions)
+        todo = [name for name in indices if name not in done]
+        if not todo:
+            print(f"Already processed {directory_path}")
+            return [done[name] for name in indices]
+
+        with timings.stage('listing'):
+            band_paths = assets.band_hrefs(directory_path, required_bands(todo))
+        checksum = input_checksum(band_paths)
+
+        output_filenames = {
+            name: output_path(directory_path, output_base_path, name, (year, month, day))
+            for name in todo
+        }
+        if conn:
+            for name in todo:
+                manifest.mark(conn, product_id, name, versions[name], 'running', checksum)
+
+        ranges = scales.scene_ranges(scales_path, todo, date) if scales_path else None
+        try:
+            water_stats, histograms, cubes = write_scene(
+                band_paths, todo, output_filenames, tile_size=tile_size, water_bodies=water_bodies,
+                ranges=ranges, timings=timings, regions=regions if cube_store else None)
+        except Exception as e:
+            if conn:
+                for name in todo:
+                    manifest.mark(conn, product_id, name, versions[name], 'failed', checksum,
+                                  error=f"{type(e).__name__}: {e}")
+            raise
+
+        for name in todo:
+            if conn:
+                manifest.mark(conn, product_id, name, versions[name], 'done', checksum, output_filenames[name])
+            print(f"Saved COG to {output_filenames[name]}")
+
+        if histogram_dir:
+            scales.write_histograms(histograms, histogram_dir, product_id, date)
+        if water_bodies is not None:
+            table = zonal.summarize(water_stats, water_bodies, todo, date, product_id)
+            zonal.write_stats(table, stats_dir, product_id)
+            print(f"Saved zonal statistics of {table['water_body_id'].nunique()} water bodies")
+        for region, values in cubes.items():
+            with timings.stage('cube_append'):
+                appended = timeseries.append_scene(cube_store, region, values, date, product_id)
+            if appended:
+                print(f"Appended {', '.join(appended)} to the {region} cubes")
+    finally:
+        timings.flush()
+        if conn:
+            conn.close()
+
+    done.update(output_filenames)
+    return [done[name] for name in indices]
+
+
+def load_path_list(geojson_file_path=None, path_list_file=None):
+    """Product paths from a GeoJSON/GeoParquet catalog (product_identifier) or a text file"""
+    if geojson_file_path and geojson_file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        paths = pq.read_table(geojson_file_path, columns=['product_identifier']).column(0).to_pylist()
+        return [path for path in paths if path]
+    if geojson_file_path:
+        with open(geojson_file_path) as f:
+            geojson = json.load(f)
+        return [feature['properties']['product_identifier'] for feature in geojson['features']]
+    with open(path_list_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_parser(description="Compute Se2WaQ/NDCI indices for Sentinel-2 L2A products"):
+    parser = argparse.ArgumentParser(description=description)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--geojson', help="GeoJSON or GeoParquet catalog (catalog.py) with a product_identifier per product")
+    source.add_argument('--path-list', help="text file with one product path per line")
+    parser.add_argument('--indices', nargs='+', choices=list(INDICES), default=list(INDICES))
+    parser.add_argument('--output', default='../', help="base directory for the output_* folders")
+    parser.add_argument('--limit', type=int, help="process only the first N products")
+    parser.add_argument('--manifest', help="product manifest (default: se2waq_manifest.sqlite in --output)")
+    parser.add_argument('--force', action='store_true', help="recompute indices already in the manifest")
+    parser.add_argument('--tile-size', type=int, nargs='?', const=TILE_SIZE,
+                        help=f"stream scenes in tiles to bound memory (default {TILE_SIZE} px)")
+    parser.add_argument('--water-bodies', help="lake/river polygons (id, name) for zonal statistics")
+    parser.add_argument('--stats-dir', help="zonal statistics directory (default: zonal_stats in --output)")
+    parser.add_argument('--histogram-dir', help="store per-product value histograms for scales.py")
+    parser.add_argument('--scales', help="fixed per-season ranges from scales.py (use --force to restretch "
+                                         "products already in the manifest)")
+    parser.add_argument('--cube-store', help="append index values to the Zarr time-series cubes in this "
+                                             "directory (use --force for products already in the manifest)")
+    parser.add_argument('--regions', nargs='+', choices=list(timeseries.REGIONS), default=list(timeseries.REGIONS),
+                        help="regions of the time-series cubes (default: all)")
+    parser.add_argument('--metrics', help="append per-stage timings as JSON lines to this file (see metrics.py)")
+    return parser
+
+
+def path_list_from_args(args):
+    path_list = load_path_list(args.geojson, args.path_list)
+    if args.limit:
+        path_list = path_list[:args.limit]
+    return path_list
+
+
+def manifest_from_args(args):
+    return args.manifest or os.path.join(args.output, 'se2waq_manifest.sqlite')
+
+
+def stats_dir_from_args(args):
+    return args.stats_dir or os.path.join(args.output, 'zonal_stats')
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    path_list = path_list_from_args(args)
+    if args.metrics:
+        metrics.configure(args.metrics)
+
+    configure_s3()
+    for directory_path in path_list:
+        process_scene(directory_path, args.output, indices=args.indices, tile_size=args.tile_size,
+                      manifest_path=manifest_from_args(args), force=args.force,
+                      water_bodies=args.water_bodies, stats_dir=stats_dir_from_args(args),
+                      histogram_dir=args.histogram_dir, scales_path=args.scales,
+                      cube_store=args.cube_store, regions=args.regions)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Se2WaQ indices straight from a multi-band super-resolution (SEN2SR) product.
+
+The tiff_to_bands notebook used to split super_res_output.tif into one file
+per band and re-open two of them for turbidity. Here only the bands an index
+needs are read, window by window, from the SR product itself, and all
+requested indices are written as the bands of one tiled, compressed float32
+COG (band descriptions are the index names). No per-band files are written.
+
+    python superres.py super_res_output.tif Turb.tif --indices turb
+    python superres.py super_res_output.tif sr_indices.tif --indices turb chla cdom doc
+
+    import superres
+    superres.compute_indices('super_res_output.tif', 'Turb.tif', ['turb'])
+
+Band names come from the band descriptions of the product when they name
+Sentinel-2 bands, otherwise from BAND_ORDER (or --band-order). upscale.py
+products describe their bands; the default RGBN model gives B04 B03 B02 B08,
+enough for cdom, doc, cya and color:
+
+    python superres.py super_res_output.tif sr_indices.tif --indices cdom doc cya color
+"""
+import argparse
+import os
+import re
+import tempfile
+
+import numpy as np
+import rasterio
+from rio_cogeo.cogeo import cog_translate
+from rio_cogeo.profiles import cog_profiles
+
+import se2waq
+
+# Band order of super_res_output.tif when it has no band descriptions
+# (band 1 is B01, band 3 is B03, as in tiff_to_bands.ipynb)
+BAND_ORDER = ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B08', 'B8A', 'B11', 'B12']
+
+BAND_NAME = re.compile(r'^B(\d{1,2}|8A)$', re.IGNORECASE)
+
+
+def band_indexes(src, band_order=None):
+    """Band name -> 1-based band index of an SR product"""
+    descriptions = [(description or '').strip() for description in src.descriptions]
+    if band_order is None and all(BAND_NAME.match(description) for description in descriptions):
+        # B1 / B01 / b8a all map to the se2waq names
+        names = [description.upper() for description in descriptions]
+        band_order = [name if name == 'B8A' else f'B{int(name[1:]):02d}' for name in names]
+    band_order = band_order or BAND_ORDER
+    return {name: i for i, name in enumerate(band_order[:src.count], 1)}
+
+
+def supported_indices(band_names):
+    """Indices whose bands are all among band_names"""
+    return [name for name, spec in se2waq.INDICES.items() if set(spec['bands']) <= set(band_names)]
+
+
+def output_profile(src, count):
+    profile = src.profile.copy()
+    profile.update({
+        'driver': 'GTiff',
+        'dtype': 'float32',
+        'count': count,
+        'nodata': np.nan,
+        'tiled': True,
+        'blockxsize': 256,
+        'blockysize': 256,
+        'compress': 'zstd',
+        'predictor': 3,
+        'BIGTIFF': 'IF_SAFER',
+    })
+    profile.pop('photometric', None)
+    return profile
+
+
+def compute_indices(src_path, dst_path, indices=('turb',), band_order=None, tile_size=se2waq.TILE_SIZE):
+    """Write the indices of an SR product as one multi-band COG, returns dst_path
+
+    Each window reads only the bands the indices use; source nodata and
+    invalid results (e.g. division by zero) become NaN.
+    """
+    indices = list(indices)
+    with rasterio.open(src_path) as src:
+        lookup = band_indexes(src, band_order)
+        needed = sorted({band for name in indices for band in se2waq.INDICES[name]['bands']})
+        missing = [band for band in needed if band not in lookup]
+        if missing:
+            raise ValueError(f"{src_path} has no band {', '.join(missing)} (bands: {', '.join(lookup)}; "
+                             f"indices it supports: {', '.join(supported_indices(lookup)) or 'none'})")
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(dst_path))) as tmpdir:
+            values_path = os.path.join(tmpdir, 'values.tif')
+            with rasterio.open(values_path, 'w', **output_profile(src, len(indices))) as dst:
+                for band, name in enumerate(indices, 1):
+                    dst.set_band_description(band, name)
+                for window in se2waq.iter_windows(src.width, src.height, tile_size):
+                    data = src.read([lookup[band] for band in needed], window=window, masked=True)
+                    bands = dict(zip(needed, data.astype('float32').filled(np.nan)))
+                    for band, name in enumerate(indices, 1):
+                        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                            values = se2waq.INDICES[name]['formula'](bands).astype('float32')
+                        values[~np.isfinite(values)] = np.nan
+                        dst.write(values, band, window=window)
+
+            profile = cog_profiles.get("deflate")
+            profile.update(predictor=3)
+            cog_translate(
+                values_path,
+                dst_path + '.part',
+                profile,
+                config=se2waq.COG_CONFIG,
+                in_memory=False,
+                quiet=True
+            )
+    os.replace(dst_path + '.part', dst_path)
+    return dst_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute Se2WaQ indices from a multi-band super-resolution product")
+    parser.add_argument('src', help="multi-band SR GeoTIFF (e.g. super_res_output.tif)")
+    parser.add_argument('dst', help="output COG, one band per index")
+    parser.add_argument('--indices', nargs='+', choices=list(se2waq.INDICES), default=['turb'])
+    parser.add_argument('--band-order', nargs='+', help=f"band names of the SR bands (default {' '.join(BAND_ORDER)})")
+    parser.add_argument('--tile-size', type=int, default=se2waq.TILE_SIZE)
+    args = parser.parse_args(argv)
+
+    compute_indices(args.src, args.dst, args.indices, args.band_order, args.tile_size)
+    print(f"Saved {', '.join(args.indices)} to {args.dst}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The pipeline modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture(scope='session')
+def s3_server():
+    """URL of a local moto S3 server"""
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f'http://{host}:{port}'
+    server.stop()
+
+
+@pytest.fixture
+def s3(s3_server, monkeypatch):
+    """boto3 client of an empty eodata bucket, with assets pointed at it"""
+    import boto3
+    import requests
+
+    for variable in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(variable, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('S3_ENDPOINT_URL', s3_server)
+    requests.post(f'{s3_server}/moto-api/reset')
+    client = boto3.client('s3', endpoint_url=s3_server)
+    client.create_bucket(Bucket='eodata')
+    return client
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import assets
+
+PRODUCT = '/eodata/Sentinel-2/MSI/L2A/2024/05/01/S2A_MSIL2A_20240501T100021_N0510_R122_T34UDA_20240501T141226.SAFE'
+GRANULE = 'L2A_T34UDA_A046156_20240501T100021'
+
+
+def band_key(band, resolution='20m', product=PRODUCT):
+    name = f'T34UDA_20240501T100021_{band}_{resolution}.jp2'
+    return f"{product.strip('/').partition('/')[2]}/GRANULE/{GRANULE}/IMG_DATA/R{resolution}/{name}"
+
+
+def put_product(s3, bands=('B01', 'B02', 'B03', 'B04', 'B05', 'B8A', 'SCL'), product=PRODUCT):
+    for band in bands:
+        s3.put_object(Bucket='eodata', Key=band_key(band, product=product), Body=b'')
+    # Other resolutions and metadata are not bands of the product
+    s3.put_object(Bucket='eodata', Key=band_key('B03', '10m', product), Body=b'')
+    s3.put_object(Bucket='eodata', Key=band_key('B01', '60m', product), Body=b'')
+    s3.put_object(Bucket='eodata', Key=band_key('B03', product=product) + '.aux.xml', Body=b'')
+
+
+@pytest.mark.parametrize('name, band', [
+    ('T34UDA_20240501T100021_B03_20m.jp2', 'B03'),
+    ('T34UDA_20240501T100021_B8A_20m.jp2', 'B8A'),
+    ('T34UDA_20240501T100021_SCL_20m.jp2', 'SCL'),
+    ('T34UDA_20240501T100021_B03_10m.jp2', None),
+    ('T34UDA_20240501T100021_B03_20m.jp2.aux.xml', None),
+    ('T34UDA_20240501T100021_MSK_20m.jp2', None),
+])
+def test_band_pattern(name, band):
+    match = assets.BAND_PATTERN.search(name)
+    assert (match.group(1) if match else None) == band
+
+
+def test_resolve_lists_20m_bands(s3, tmp_path):
+    put_product(s3)
+    bands = assets.resolve([PRODUCT], cache_dir=str(tmp_path))[PRODUCT]
+    assert sorted(bands) == ['B01', 'B02', 'B03', 'B04', 'B05', 'B8A', 'SCL']
+    assert bands['B03'] == f"s3://eodata/{band_key('B03')}"
+
+
+def test_resolve_many_products(s3, tmp_path):
+    products = [PRODUCT.replace('T141226', f'T14122{i}') for i in range(5)]
+    for product in products:
+        put_product(s3, ('B01', 'B03', 'SCL'), product)
+    results = assets.resolve(products + [PRODUCT], concurrency=2, cache_dir=str(tmp_path))
+    assert all(sorted(results[product]) == ['B01', 'B03', 'SCL'] for product in products)
+    # Not published (yet): an empty listing, not cached
+    assert results[PRODUCT] == {}
+    assert not os.path.exists(assets.cache_path(PRODUCT, str(tmp_path)))
+
+
+def test_resolve_reuses_cache(s3, tmp_path):
+    put_product(s3)
+    first = assets.resolve([PRODUCT], cache_dir=str(tmp_path))
+    assert os.path.exists(assets.cache_path(PRODUCT, str(tmp_path)))
+
+    # The cached listing is used even after the objects are gone
+    for item in s3.list_objects_v2(Bucket='eodata')['Contents']:
+        s3.delete_object(Bucket='eodata', Key=item['Key'])
+    assert assets.resolve([PRODUCT], cache_dir=str(tmp_path)) == first
+    assert assets.resolve([PRODUCT], cache_dir=None)[PRODUCT] == {}
+
+
+def test_band_hrefs(s3, tmp_path):
+    put_product(s3)
+    hrefs = assets.band_hrefs(PRODUCT, ['B01', 'B03', 'SCL'], cache_dir=str(tmp_path))
+    assert list(hrefs) == ['B01', 'B03', 'SCL']
+    assert hrefs['SCL'] == f"s3://eodata/{band_key('SCL')}"
+
+    with pytest.raises(FileNotFoundError, match='B09'):
+        assets.band_hrefs(PRODUCT, ['B03', 'B09'], cache_dir=str(tmp_path))
+
+
+def test_band_hrefs_listing_failure(s3, tmp_path, monkeypatch):
+    # Nothing listens there: the listing fails and is worth retrying
+    monkeypatch.setenv('S3_ENDPOINT_URL', 'http://127.0.0.1:9')
+    with pytest.raises(assets.ListingError):
+        assets.band_hrefs(PRODUCT, ['B03'], cache_dir=str(tmp_path))
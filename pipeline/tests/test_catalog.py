@@ -0,0 +1,107 @@
+import datetime
+import json
+import os
+
+import pytest
+from shapely.geometry import box, mapping
+
+import catalog
+
+POLAND = [14.07, 49.00, 24.15, 54.84]
+KRAKOW = [19.80, 49.95, 20.15, 50.15]
+
+
+def item(day, bbox=KRAKOW):
+    return {
+        'id': f'S2A_{day}', 'bbox': bbox, 'assets': {},
+        'properties': {'datetime': f'{day}T10:00:00Z', 'eo:cloud_cover': 5.0},
+    }
+
+
+@pytest.fixture
+def fetches(monkeypatch):
+    """Date ranges requested from the API, which returns one item per day"""
+    calls = []
+
+    def fetch(filters, geometry, start, end, url=catalog.STAC_URL):
+        calls.append((start, end))
+        days = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+        return catalog.items_frame([item(day.isoformat()) for day in days])
+
+    monkeypatch.setattr(catalog, 'fetch', fetch)
+    return calls
+
+
+def params(start, end, bbox=KRAKOW, **extra):
+    return dict({'collections': 'sentinel-2-l2a', 'bbox': bbox, 'datetime': f'{start}/{end}'}, **extra)
+
+
+def meta_of(search, cache_dir):
+    key = catalog.query_key(catalog.query_filters(search), catalog.query_geometry(search))
+    return catalog.read_meta(key, str(cache_dir))
+
+
+def test_covers():
+    meta = {'filters': {'collections': ['sentinel-2-l2a']}, 'geometry': mapping(box(*POLAND)),
+            'start': '2023-02-01', 'end': '2024-12-31', 'fetched': '2025-01-10'}
+    filters = {'collections': ['sentinel-2-l2a']}
+    day = datetime.date.fromisoformat
+    assert catalog.covers(meta, filters, box(*KRAKOW), day('2024-05-01'), day('2024-05-08'))
+    assert not catalog.covers(meta, filters, box(*KRAKOW), day('2024-12-20'), day('2025-01-02'))
+    assert not catalog.covers(meta, filters, box(10, 50, 11, 51), day('2024-05-01'), day('2024-05-08'))
+    assert not catalog.covers(meta, dict(filters, query={'eo:cloud_cover': {'lte': 30}}), box(*KRAKOW),
+                              day('2024-05-01'), day('2024-05-08'))
+
+
+def test_covers_rejects_the_stale_end():
+    # Fetched on the cached end date: its last REFRESH_DAYS may miss late products
+    meta = {'filters': {}, 'geometry': None, 'start': '2024-05-01', 'end': '2024-05-10', 'fetched': '2024-05-10'}
+    day = datetime.date.fromisoformat
+    assert catalog.stale_since(meta, day('2024-05-12')) == day('2024-05-07')
+    assert catalog.covers(meta, {}, None, day('2024-05-01'), day('2024-05-06'), day('2024-05-12'))
+    assert not catalog.covers(meta, {}, None, day('2024-05-01'), day('2024-05-08'), day('2024-05-12'))
+    # Fetched today, or long enough after the end date: settled
+    assert catalog.stale_since(meta, day('2024-05-10')) is None
+    assert catalog.stale_since(dict(meta, fetched='2024-05-13'), day('2024-06-01')) is None
+
+
+def test_search_fetches_only_missing_days(tmp_path, fetches):
+    first = catalog.search(params('2024-05-01', '2024-05-10'), cache_dir=str(tmp_path))
+    assert len(first) == 10
+    assert fetches == [(datetime.date(2024, 5, 1), datetime.date(2024, 5, 10))]
+
+    # Inside the cached range: answered locally
+    assert len(catalog.search(params('2024-05-03', '2024-05-04'), cache_dir=str(tmp_path))) == 2
+    assert len(fetches) == 1
+
+    # Extended on both sides: only the new days are fetched
+    both = catalog.search(params('2024-04-28', '2024-05-12'), cache_dir=str(tmp_path))
+    assert fetches[1:] == [(datetime.date(2024, 4, 28), datetime.date(2024, 4, 30)),
+                           (datetime.date(2024, 5, 11), datetime.date(2024, 5, 12))]
+    assert len(both) == 15 and both['id'].is_unique
+    assert meta_of(params('2024-04-28', '2024-05-12'), tmp_path)['start'] == '2024-04-28'
+
+
+def test_search_refreshes_the_stale_end(tmp_path, fetches):
+    search = params('2024-05-01', '2024-05-10')
+    catalog.search(search, cache_dir=str(tmp_path))
+    # As if the catalog had been fetched on its end date
+    meta = meta_of(search, tmp_path)
+    meta['fetched'] = '2024-05-10'
+    with open(os.path.join(tmp_path, f"{meta['key']}.json"), 'w') as f:
+        json.dump(meta, f)
+
+    # A search ending inside the last REFRESH_DAYS fetches them again, once
+    catalog.search(params('2024-05-01', '2024-05-08'), cache_dir=str(tmp_path))
+    assert fetches[1:] == [(datetime.date(2024, 5, 7), datetime.date(2024, 5, 10))]
+    catalog.search(params('2024-05-01', '2024-05-08'), cache_dir=str(tmp_path))
+    assert len(fetches) == 2
+    assert len(catalog.search(search, cache_dir=str(tmp_path))) == 10
+
+
+def test_search_inside_a_larger_catalog(tmp_path, fetches):
+    catalog.search(params('2024-05-01', '2024-05-10', POLAND), cache_dir=str(tmp_path))
+    frame = catalog.search(params('2024-05-02', '2024-05-03', KRAKOW, sortby='-datetime', max_items=1),
+                           cache_dir=str(tmp_path))
+    assert len(fetches) == 1
+    assert list(frame['id']) == ['S2A_2024-05-03']
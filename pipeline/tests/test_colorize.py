@@ -0,0 +1,60 @@
+import matplotlib
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import colorize
+
+
+def matplotlib_rgba(values, name, vmin, vmax):
+    # What the notebooks did: float RGBA from the colormap, scaled to uint8
+    norm = matplotlib.colors.Normalize(vmin, vmax)
+    return (matplotlib.colormaps[name].resampled(256)(norm(values)) * 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('name', ['viridis', 'nipy_spectral', 'Spectral', 'viridis_r'])
+def test_lut_matches_matplotlib(name):
+    rng = np.random.default_rng(0)
+    # Every bin, values beyond both ends, and random values
+    values = np.concatenate([-40 + (np.arange(256) + 0.5) * 80 / 256, [-1000, 1000],
+                             rng.uniform(-60, 60, 10000)]).astype('float32')
+    np.testing.assert_array_equal(colorize.colorize(values, name, -40, 40), matplotlib_rgba(values, name, -40, 40))
+
+
+def test_invalid_pixels_are_transparent():
+    values = np.ma.masked_array([[1.0, np.nan], [np.inf, 2.0]], mask=[[False, False], [False, True]])
+    rgba = colorize.colorize(values, 'viridis', 0, 2)
+    assert rgba.dtype == np.uint8 and rgba.shape == (2, 2, 4)
+    assert rgba[..., 3].tolist() == [[255, 0], [0, 0]]
+
+
+def test_range_defaults_to_the_valid_values():
+    values = np.array([np.nan, 10.0, 20.0], dtype='float32')
+    np.testing.assert_array_equal(colorize.colorize(values), colorize.colorize(values, 'viridis', 10, 20))
+
+
+def test_hex_palette_ends_on_its_colors():
+    table = colorize.palette('colorScaleHex')
+    assert table.shape == (256, 4) and not table.flags.writeable
+    assert tuple(table[0]) == (0x49, 0x6F, 0xF2, 255)
+    assert tuple(table[-1]) == (0xD9, 0x7C, 0xF5, 255)
+
+
+def test_write_paletted(tmp_path):
+    values = np.linspace(0, 30, 1500 * 1100, dtype='float32').reshape(1100, 1500)
+    values[0, 0] = np.nan
+    profile = {'driver': 'GTiff', 'width': 1500, 'height': 1100, 'count': 1, 'dtype': 'float32',
+               'crs': 'EPSG:3857', 'transform': from_origin(0, 0, 10, 10)}
+    with rasterio.open(tmp_path / 'turb.tif', 'w', **profile) as dst:
+        dst.write(values, 1)
+
+    colorize.write_paletted(str(tmp_path / 'turb.tif'), str(tmp_path / 'paletted.tif'), 'nipy_spectral', 0, 30)
+    with rasterio.open(tmp_path / 'paletted.tif') as src:
+        indices = src.read(1)
+        assert src.nodata == 255
+        assert src.colormap(1)[100] == tuple(colorize.palette('nipy_spectral')[100])
+    # Written block by block, same as quantizing the whole array; 255 only for NaN
+    expected = np.minimum(colorize.quantize(values, 0, 30), 254)
+    expected[0, 0] = 255
+    np.testing.assert_array_equal(indices, expected)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+import composite
+import se2waq
+
+
+def make_stack(ratios, clouds, size=8, chunk=4):
+    """(time, band, y, x) cube of all-water scenes with a B03/B01 ratio and cloud pixels per scene
+
+    Cloud pixels are put in column t of every chunk of scene t, from its top.
+    """
+    data = np.zeros((len(ratios), 3, size, size), dtype='float32')
+    for t, (ratio, cloud) in enumerate(zip(ratios, clouds)):
+        data[t, 0] = 1000
+        data[t, 1] = 1000 * ratio
+        data[t, 2] = se2waq.SCL_WATER
+        for pixel in range(cloud):
+            data[t, 2, pixel::chunk, t::chunk] = 9
+    stack = xr.DataArray(
+        data, dims=('time', 'band', 'y', 'x'),
+        coords={'time': np.arange(len(ratios)), 'band': ['B01', 'B03', 'SCL'],
+                'y': np.arange(size), 'x': np.arange(size)},
+    )
+    return stack.chunk({'time': 1, 'band': 1, 'y': chunk, 'x': chunk})
+
+
+def turb(ratio):
+    return se2waq.INDICES['turb']['formula']({'B01': np.float32(1000), 'B03': np.float32(1000 * ratio)})
+
+
+def test_best_takes_the_clearest_scene_not_the_highest_value():
+    # The highest turbidity is in the cloudiest scene, the clearest scene has the lowest
+    stack = make_stack(ratios=[3.0, 1.5, 2.0], clouds=[2, 0, 1])
+    result = composite.composite(stack, ['turb', 'chla'], method='best', cloud_buffer=0, split_every=2).compute()
+
+    np.testing.assert_allclose(result['turb'].values, turb(1.5), rtol=1e-6)
+    np.testing.assert_array_equal(result['clear_count'].values, 3 - (stack.sel(band='SCL') == 9).sum('time'))
+
+
+def test_best_falls_back_to_the_clear_observations():
+    # Pixels cloudy in the clearest scene come from the next clearest one
+    stack = make_stack(ratios=[3.0, 1.5, 2.0], clouds=[2, 1, 3])
+    result = composite.composite(stack, ['turb'], method='best', cloud_buffer=0).compute()
+
+    cloudy = (stack.sel(band='SCL', time=1) == 9).values
+    np.testing.assert_allclose(result['turb'].values[~cloudy], turb(1.5), rtol=1e-6)
+    np.testing.assert_allclose(result['turb'].values[cloudy], turb(3.0), rtol=1e-6)
+
+
+def test_median():
+    stack = make_stack(ratios=[3.0, 1.5, 2.0], clouds=[0, 0, 0])
+    result = composite.composite(stack, ['turb'], method='median', cloud_buffer=0).compute()
+    np.testing.assert_allclose(result['turb'].values, turb(2.0), rtol=1e-6)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError, match='unknown composite method'):
+        composite.composite(make_stack([1.0], [0]), ['turb'], method='mean')
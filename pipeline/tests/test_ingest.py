@@ -0,0 +1,111 @@
+import os
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+import ingest
+import manifest
+import se2waq
+
+PRODUCTS = [
+    'S2A_MSIL2A_20240501T100021_N0510_R122_T34UDA_20240501T141226.SAFE',
+    'S2B_MSIL2A_20240503T095549_N0510_R122_T34UDA_20240503T120000.SAFE',
+]
+
+
+def catalog_frame(products=PRODUCTS, crs='EPSG:4326'):
+    # Sensing date from the product name, as in the /eodata tree
+    return gpd.GeoDataFrame({
+        'product_identifier': [f'/eodata/Sentinel-2/MSI/L2A/2024/05/{p[17:19]}/{p}' for p in products],
+        'cc': [10.0 * (i + 1) for i in range(len(products))],
+        'geometry': [box(19, 50, 20, 51)] * len(products),
+    }, crs=crs)
+
+
+def write_output(base, name, product, date='2024/05/01'):
+    spec = se2waq.INDICES[name]
+    directory = os.path.join(base, spec['output_dir'], date)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{product}_v1-abcdef12_{spec['suffix']}.tif")
+    open(path, 'wb').close()
+    return path
+
+
+def test_load_catalog_drops_duplicate_products(tmp_path):
+    # The same product listed twice (e.g. two catalog pages) is loaded once
+    frame = catalog_frame(PRODUCTS + PRODUCTS[:1])
+    frame.to_parquet(tmp_path / 'catalog.parquet')
+    catalog = ingest.load_catalog(str(tmp_path / 'catalog.parquet'))
+    assert sorted(catalog['product_id']) == sorted(PRODUCTS)
+
+
+def test_outputs_from_tree_and_manifest(tmp_path):
+    turb = write_output(str(tmp_path), 'turb', PRODUCTS[0])
+    ndci = write_output(str(tmp_path), 'ndci', PRODUCTS[0])
+    outputs = ingest.outputs_from_tree(str(tmp_path), ['turb', 'ndci'])
+    assert sorted(map(tuple, outputs.values)) == [(PRODUCTS[0], 'ndci', ndci), (PRODUCTS[0], 'turb', turb)]
+
+    conn = manifest.open_manifest(str(tmp_path / 'manifest.sqlite'))
+    manifest.mark(conn, PRODUCTS[0], 'turb', 'v1', 'done', 'sum', turb)
+    manifest.mark(conn, PRODUCTS[0], 'chla', 'v1', 'failed', 'sum')
+    manifest.mark(conn, PRODUCTS[0], 'ndci', 'v1', 'done', 'sum', ndci)
+    outputs = ingest.outputs_from_manifest(str(tmp_path / 'manifest.sqlite'), ['turb', 'chla'])
+    assert list(outputs['output_path']) == [turb]
+
+
+def test_ingestion_rows(tmp_path):
+    outputs = pd.DataFrame([
+        (PRODUCTS[0], 'turb', write_output(str(tmp_path), 'turb', PRODUCTS[0])),
+        (PRODUCTS[1], 'ndci', write_output(str(tmp_path), 'ndci', PRODUCTS[1], '2024/05/03')),
+        ('S2A_unknown.SAFE', 'turb', write_output(str(tmp_path), 'turb', 'S2A_unknown.SAFE')),
+    ], columns=['product_id', 'index_name', 'output_path'])
+    catalog = catalog_frame()
+    catalog['product_id'] = catalog['product_identifier'].str.rsplit('/', n=1).str[-1]
+
+    rows, missing = ingest.ingestion_rows(outputs, catalog, str(tmp_path), 'https://s3.example.com/')
+    assert missing == ['S2A_unknown.SAFE']
+    assert list(rows.columns) == ['index_name', 'product_id', 'date', 'cloud_cover', 'file_path', 'wkt']
+    assert [str(date) for date in rows['date']] == ['2024-05-01', '2024-05-03']
+    assert list(rows['cloud_cover']) == [10.0, 20.0]
+    assert list(rows['file_path']) == [
+        f'https://s3.example.com/SE2WAQ_TURB/2024/05/01/{PRODUCTS[0]}_v1-abcdef12_Se2WaQ.tif',
+        f'https://s3.example.com/NDCI/2024/05/03/{PRODUCTS[1]}_v1-abcdef12_NDCI.tif',
+    ]
+    # Stored in EPSG:3857: metres, not degrees
+    assert gpd.GeoSeries.from_wkt(rows['wkt']).total_bounds[0] == pytest.approx(2115070.3, abs=1)
+
+
+def test_ingestion_rows_keeps_local_paths_and_srid(tmp_path):
+    path = write_output(str(tmp_path), 'turb', PRODUCTS[0])
+    outputs = pd.DataFrame([(PRODUCTS[0], 'turb', path)], columns=['product_id', 'index_name', 'output_path'])
+    catalog = catalog_frame()
+    catalog['product_id'] = catalog['product_identifier'].str.rsplit('/', n=1).str[-1]
+
+    rows, _ = ingest.ingestion_rows(outputs, catalog, str(tmp_path), srid=4326)
+    assert list(rows['file_path']) == [path]
+    assert gpd.GeoSeries.from_wkt(rows['wkt']).total_bounds.tolist() == [19, 50, 20, 51]
+
+
+def test_load_skips_files_already_in_the_table(tmp_path):
+    # Needs a scratch PostGIS database, like benchmark.py --dsn
+    dsn = os.environ.get('SE2WAQ_TEST_DSN')
+    if not dsn:
+        pytest.skip("set SE2WAQ_TEST_DSN to a scratch PostGIS database")
+    import psycopg2
+
+    path = write_output(str(tmp_path), 'turb', PRODUCTS[0])
+    outputs = pd.DataFrame([(PRODUCTS[0], 'turb', path)], columns=['product_id', 'index_name', 'output_path'])
+    catalog = catalog_frame()
+    catalog['product_id'] = catalog['product_identifier'].str.rsplit('/', n=1).str[-1]
+    rows, _ = ingest.ingestion_rows(outputs, catalog, str(tmp_path))
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS se2waq_turb")
+        assert ingest.load(conn, rows) == {'se2waq_turb': 1}
+        assert ingest.load(conn, rows) == {'se2waq_turb': 0}
+    finally:
+        conn.close()
@@ -0,0 +1,47 @@
+import manifest
+
+PRODUCT = 'S2A_MSIL2A_20240501T100021_N0510_R122_T34UDA_20240501T141226.SAFE'
+
+
+def output(tmp_path, name):
+    path = tmp_path / f'{name}.tif'
+    path.write_bytes(b'')
+    return str(path)
+
+
+def test_done_indices_are_skipped(tmp_path):
+    conn = manifest.open_manifest(str(tmp_path / 'manifest.sqlite'))
+    manifest.mark(conn, PRODUCT, 'turb', 'v1', 'done', 'sum', output(tmp_path, 'turb'))
+    manifest.mark(conn, PRODUCT, 'chla', 'v1', 'done', 'sum', output(tmp_path, 'chla'))
+    assert manifest.done_outputs(conn, PRODUCT, {'turb': 'v1', 'chla': 'v1'}) == {
+        'turb': str(tmp_path / 'turb.tif'), 'chla': str(tmp_path / 'chla.tif')}
+
+
+def test_unfinished_work_is_redone(tmp_path):
+    conn = manifest.open_manifest(str(tmp_path / 'manifest.sqlite'))
+    # Left 'running' by a crash, failed, or never started
+    manifest.mark(conn, PRODUCT, 'turb', 'v1', 'running', 'sum')
+    manifest.mark(conn, PRODUCT, 'chla', 'v1', 'failed', 'sum', error='RasterioIOError')
+    assert manifest.done_outputs(conn, PRODUCT, {'turb': 'v1', 'chla': 'v1', 'cdom': 'v1'}) == {}
+
+    # The retry replaces the row
+    manifest.mark(conn, PRODUCT, 'turb', 'v1', 'done', 'sum', output(tmp_path, 'turb'))
+    assert list(manifest.done_outputs(conn, PRODUCT, {'turb': 'v1'})) == ['turb']
+    assert manifest.summary(conn) == [('chla', 'v1', 'failed', 1), ('turb', 'v1', 'done', 1)]
+
+
+def test_new_version_or_deleted_output_is_redone(tmp_path):
+    conn = manifest.open_manifest(str(tmp_path / 'manifest.sqlite'))
+    manifest.mark(conn, PRODUCT, 'turb', 'v1', 'done', 'sum', output(tmp_path, 'turb'))
+    manifest.mark(conn, PRODUCT, 'chla', 'v1', 'done', 'sum', output(tmp_path, 'chla'))
+    (tmp_path / 'chla.tif').unlink()
+    assert manifest.done_outputs(conn, PRODUCT, {'turb': 'v2', 'chla': 'v1'}) == {}
+    # The old version stays recorded next to the new one
+    manifest.mark(conn, PRODUCT, 'turb', 'v2', 'running', 'sum')
+    assert ('turb', 'v1', 'done', 1) in manifest.summary(conn)
+
+
+def test_manifest_survives_reopening(tmp_path):
+    path = str(tmp_path / 'runs' / 'manifest.sqlite')
+    manifest.mark(manifest.open_manifest(path), PRODUCT, 'turb', 'v1', 'done', 'sum', output(tmp_path, 'turb'))
+    assert list(manifest.done_outputs(manifest.open_manifest(path), PRODUCT, {'turb': 'v1'})) == ['turb']
@@ -0,0 +1,81 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metrics_file(tmp_path, monkeypatch):
+    path = tmp_path / 'metrics.jsonl'
+    monkeypatch.setenv(metrics.METRICS_ENV, str(path))
+    monkeypatch.setenv(metrics.RUN_ENV, 'test-run')
+    return path
+
+
+def test_disabled_records_nothing(tmp_path, monkeypatch):
+    monkeypatch.delenv(metrics.METRICS_ENV, raising=False)
+    recorder = metrics.Recorder(source='pipeline', scene='A.SAFE')
+    with recorder.stage('warp') as record:
+        record['pixels'] += 10
+    recorder.flush()
+    assert not metrics.enabled() and list(tmp_path.iterdir()) == []
+
+
+def test_repeated_stages_add_up(metrics_file):
+    recorder = metrics.Recorder(source='pipeline', scene='A.SAFE')
+    for _ in range(3):
+        with recorder.stage('warp') as record:
+            record['pixels'] += 100
+    with recorder.stage('cog_write'):
+        bytes(10 ** 6)
+    recorder.flush()
+
+    records = {record['stage']: record for record in metrics.read_records(metrics_file)}
+    assert sorted(records) == ['cog_write', 'warp']
+    warp = records['warp']
+    assert warp['calls'] == 3 and warp['pixels'] == 300
+    assert warp['scene'] == 'A.SAFE' and warp['run'] == 'test-run'
+    assert warp['wall_s'] >= 0 and warp['peak_rss_bytes'] > 0
+    # Flushed records start over
+    recorder.flush()
+    assert len(metrics.read_records(metrics_file)) == 2
+
+
+def test_failed_stage_is_recorded(metrics_file):
+    with pytest.raises(RuntimeError):
+        with metrics.stage('listing', source='pipeline', scene='*'):
+            raise RuntimeError
+    assert [record['stage'] for record in metrics.read_records(metrics_file)] == ['listing']
+
+
+def test_summarize():
+    records = [
+        {'source': 'pipeline', 'stage': 'warp', 'calls': 2, 'wall_s': 1.5, 'pixels': 100, 'peak_rss_bytes': 300},
+        {'source': 'pipeline', 'stage': 'warp', 'calls': 1, 'wall_s': 0.5, 'pixels': 50, 'peak_rss_bytes': 500},
+        {'source': 'app', 'stage': 'map_build', 'page': 'Sentinel-2', 'calls': 1, 'wall_s': 2.0, 'layers': 3},
+    ]
+    totals = metrics.summarize(records)
+    assert list(totals) == [('app', 'map_build'), ('pipeline', 'warp')]
+    warp = totals[('pipeline', 'warp')]
+    assert (warp['calls'], warp['wall_s'], warp['pixels'], warp['peak_rss_bytes']) == (3, 2.0, 150, 500)
+    assert totals[('app', 'map_build')]['layers'] == 3
+
+    by_page = metrics.summarize(records, ('page', 'stage'))
+    assert list(by_page) == [('', 'warp'), ('Sentinel-2', 'map_build')]
+
+
+def test_prometheus():
+    text = metrics.prometheus(metrics.summarize([{'source': 'pipeline', 'stage': 'warp', 'calls': 2, 'wall_s': 1.5}]))
+    assert '# TYPE se2waq_stage_seconds_total counter' in text
+    assert 'se2waq_stage_seconds_total{source="pipeline",stage="warp"} 1.5' in text
+    assert 'se2waq_stage_peak_rss_bytes{source="pipeline",stage="warp"} 0' in text
+
+
+def test_main_compares_with_a_baseline(tmp_path, capsys):
+    for name, wall in (('before', 4.0), ('after', 1.0)):
+        (tmp_path / f'{name}.jsonl').write_text(
+            f'{{"source": "pipeline", "stage": "warp", "calls": 1, "wall_s": {wall}, "run": "{name}"}}\n')
+    metrics.main([str(tmp_path / 'before.jsonl'), str(tmp_path / 'after.jsonl'),
+                  '--prometheus', str(tmp_path / 'after.prom')])
+    output = capsys.readouterr().out
+    assert 'pipeline/warp' in output and '0.25x' in output
+    assert (tmp_path / 'after.prom').read_text().startswith('# HELP')
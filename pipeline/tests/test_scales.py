@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pytest
+
+import scales
+
+
+@pytest.mark.parametrize('values', [
+    np.random.default_rng(0).lognormal(2, 1, 20000),
+    np.random.default_rng(1).uniform(-5, 5, 20000),
+    np.random.default_rng(2).normal(0.3, 0.05, 20000),
+])
+@pytest.mark.parametrize('q', [0.02, 0.5, 0.98])
+def test_quantile_matches_np_quantile(values, q):
+    counts = scales.histogram(values.astype('float32'))
+    # Within a bin: 0.35 % of the value above 1, 0.0035 around 0
+    assert scales.quantile(counts, q) == pytest.approx(np.quantile(values, q), rel=0.004, abs=0.004)
+
+
+def test_histograms_add_up():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(0, 2, 10000).astype('float32')
+    values[::7] = np.nan
+    tiles = scales.empty()
+    for part in np.array_split(values, 5):
+        tiles += scales.histogram(part)
+    np.testing.assert_array_equal(tiles, scales.histogram(values))
+    assert tiles.sum() == np.isfinite(values).sum()
+
+
+def test_bins_cover_the_value_range():
+    assert scales.bin_index(np.array([-1e9, 0.0, 1e9])).tolist() == [0, scales.BINS // 2, scales.BINS - 1]
+    assert scales.bin_value(scales.BINS / 2) == pytest.approx(0)
+    assert scales.quantile(scales.empty(), 0.5) is None
+
+
+def test_season_scales(tmp_path):
+    histogram_dir = str(tmp_path / 'histograms')
+    rng = np.random.default_rng(0)
+    seasons = {'2023': rng.uniform(0, 10, 5000), '2024': rng.uniform(100, 200, 5000)}
+    for i, (season, values) in enumerate(seasons.items()):
+        for j, part in enumerate(np.array_split(values, 2)):
+            scales.write_histograms({'turb': scales.histogram(part)}, histogram_dir, f'P{i}{j}.SAFE', f'{season}-05-0{j + 1}')
+
+    table = scales.season_scales(histogram_dir, ['turb', 'chla'], '2024')
+    assert list(table) == ['turb'] and table['turb']['count'] == 5000
+    assert table['turb']['vmin'] == pytest.approx(np.quantile(seasons['2024'], 0.02), rel=0.004)
+    assert table['turb']['vmax'] == pytest.approx(np.quantile(seasons['2024'], 0.98), rel=0.004)
+
+    path = str(tmp_path / 'scales.json')
+    scales.write_scales(table, path, '2024')
+    scales.write_scales(scales.season_scales(histogram_dir, ['turb'], '2023'), path, '2023')
+    with open(path) as f:
+        assert sorted(json.load(f)) == ['2023', '2024']
+    assert scales.scene_ranges(path, ['turb', 'chla'], '2024-07-01') == {
+        'turb': (table['turb']['vmin'], table['turb']['vmax'])}
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+import benchmark
+import se2waq
+
+
+@pytest.fixture(scope='module')
+def scene(tmp_path_factory):
+    return benchmark.make_scene(str(tmp_path_factory.mktemp('scene')), size=700, driver='GTiff')
+
+
+def write(scene, directory, tile_size):
+    os.makedirs(directory, exist_ok=True)
+    output_filenames = {name: os.path.join(directory, f'{name}.tif') for name in se2waq.INDICES}
+    se2waq.write_scene(scene, list(se2waq.INDICES), output_filenames, tile_size=tile_size)
+    return output_filenames
+
+
+@pytest.mark.parametrize('tile_size', [256, 512])
+def test_tiled_cogs_are_identical_to_the_whole_scene(scene, tmp_path, tile_size):
+    # Every tile is warped from the same blocks as the whole scene (see warp.WARP_BLOCK)
+    whole = write(scene, tmp_path / 'whole', None)
+    tiled = write(scene, tmp_path / 'tiled', tile_size)
+    for name in se2waq.INDICES:
+        with open(whole[name], 'rb') as a, open(tiled[name], 'rb') as b:
+            assert a.read() == b.read(), name
+
+
+def test_tile_size_must_be_a_multiple_of_256(scene, tmp_path):
+    with pytest.raises(ValueError, match='multiple of 256'):
+        write(scene, tmp_path, 300)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import se2waq
+import superres
+
+
+def write_sr(path, descriptions, size=300, seed=0):
+    """Multi-band uint16 SR GeoTIFF, band i holds (i + 1) * 1000 + noise"""
+    rng = np.random.default_rng(seed)
+    data = np.stack([(i + 1) * 1000 + rng.integers(0, 500, (size, size)) for i in range(len(descriptions))])
+    profile = {'driver': 'GTiff', 'width': size, 'height': size, 'count': len(descriptions), 'dtype': 'uint16',
+               'crs': 'EPSG:32634', 'transform': from_origin(400000, 5600000, 2.5, 2.5)}
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data.astype('uint16'))
+        for i, description in enumerate(descriptions, 1):
+            if description:
+                dst.set_band_description(i, description)
+    return str(path), data.astype('float32')
+
+
+@pytest.mark.parametrize('descriptions, band_order, expected', [
+    # upscale.py RGBN product, described
+    (['B04', 'B03', 'B02', 'B08'], None, {'B04': 1, 'B03': 2, 'B02': 3, 'B08': 4}),
+    # Other spellings of the band names
+    (['B4', 'b3', 'B8A'], None, {'B04': 1, 'B03': 2, 'B8A': 3}),
+    # No (or not band) descriptions: the notebook's band order
+    ([None, None, None], None, {'B01': 1, 'B02': 2, 'B03': 3}),
+    (['red', 'green', 'blue'], None, {'B01': 1, 'B02': 2, 'B03': 3}),
+    # An explicit order wins over descriptions
+    (['B04', 'B03', 'B02'], ['B01', 'B03', 'B05'], {'B01': 1, 'B03': 2, 'B05': 3}),
+])
+def test_band_indexes(tmp_path, descriptions, band_order, expected):
+    path, _ = write_sr(tmp_path / 'sr.tif', descriptions, size=8)
+    with rasterio.open(path) as src:
+        assert superres.band_indexes(src, band_order) == expected
+
+
+def test_supported_indices():
+    assert superres.supported_indices(['B04', 'B03', 'B02', 'B08']) == ['cdom', 'doc', 'cya', 'color']
+    assert superres.supported_indices(superres.BAND_ORDER) == list(se2waq.INDICES)
+
+
+def test_compute_indices_reads_the_bands_by_name(tmp_path):
+    # B03 and B01 in a different order than BAND_ORDER, tiles smaller than the raster
+    path, data = write_sr(tmp_path / 'sr.tif', ['B03', 'B05', 'B01', 'B04'])
+    dst = superres.compute_indices(path, str(tmp_path / 'indices.tif'), ['turb', 'ndci'], tile_size=256)
+
+    bands = {'B03': data[0], 'B05': data[1], 'B01': data[2], 'B04': data[3]}
+    with rasterio.open(dst) as src:
+        assert src.descriptions == ('turb', 'ndci')
+        for i, name in enumerate(['turb', 'ndci'], 1):
+            expected = se2waq.INDICES[name]['formula'](bands).astype('float32')
+            np.testing.assert_allclose(src.read(i), expected, rtol=1e-6)
+
+
+def test_compute_indices_missing_band(tmp_path):
+    path, _ = write_sr(tmp_path / 'sr.tif', ['B04', 'B03', 'B02', 'B08'], size=8)
+    with pytest.raises(ValueError, match='no band B01.*supports: cdom, doc, cya, color'):
+        superres.compute_indices(path, str(tmp_path / 'turb.tif'), ['turb'])
+    assert not (tmp_path / 'turb.tif').exists()
@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+
+import colorize
+
+# The tile server is part of the app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'K_WQ_app_1'))
+import tiles  # noqa: E402
+
+# A 2 x 2 km raster just north-east of (0, 0) in Web Mercator: inside tile z=0, and z=1 x=1 y=0
+ORIGIN = (0, 2000)
+
+
+@pytest.fixture
+def raster(tmp_path):
+    path = str(tmp_path / 'turb.tif')
+    values = np.tile(np.linspace(0, 30, 200, dtype='float32'), (200, 1))
+    profile = {'driver': 'GTiff', 'width': 200, 'height': 200, 'count': 1, 'dtype': 'float32',
+               'crs': 'EPSG:3857', 'transform': from_origin(*ORIGIN, 10, 10), 'nodata': np.nan,
+               'tiled': True, 'blockxsize': 128, 'blockysize': 128}
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(values, 1)
+        dst.build_overviews([2, 4], Resampling.average)
+    return path
+
+
+def png(data):
+    return np.asarray(Image.open(io.BytesIO(data)))
+
+
+def test_tile_bounds():
+    assert tiles.tile_bounds(0, 0, 0) == (-tiles.ORIGIN, -tiles.ORIGIN, tiles.ORIGIN, tiles.ORIGIN)
+    assert tiles.tile_bounds(1, 1, 0) == (0, 0, tiles.ORIGIN, tiles.ORIGIN)
+
+
+def test_overview_level(raster):
+    with rasterio.open(raster) as src:
+        assert tiles.overview_level(src, 10) is None
+        assert tiles.overview_level(src, 25) == 0
+        assert tiles.overview_level(src, 1000) == 1
+
+
+def test_rendered_tile(raster):
+    # Zoom 17: a 305 m tile inside the raster, from the full resolution
+    z = 17
+    size = 2 * tiles.ORIGIN / 2 ** z
+    x, y = int((tiles.ORIGIN + 500) // size), int((tiles.ORIGIN - 1500) // size)
+    rgba = png(tiles.render(raster, z, x, y, 'viridis', 0, 30))
+    assert rgba.shape == (256, 256, 4) and (rgba[..., 3] == 255).all()
+
+    left, bottom, right, top = tiles.tile_bounds(z, x, y)
+    column = int((left + right) / 2 - ORIGIN[0]) // 10
+    value = np.linspace(0, 30, 200, dtype='float32')[column]
+    np.testing.assert_array_equal(rgba[128, 128], colorize.colorize(np.array([value]), 'viridis', 0, 30)[0])
+
+
+def test_tile_outside_is_transparent(raster):
+    rgba = png(tiles.render(raster, 1, 0, 1, 'viridis', 0, 30))
+    assert (rgba[..., 3] == 0).all()
+
+
+def test_cached_tile_follows_the_file(raster):
+    first = tiles.cached_tile(raster, 1, 1, 0, 'viridis', 0, 30)
+    assert tiles.cached_tile(raster, 1, 1, 0, 'viridis', 0, 30) is first
+    # A rewritten file gets new tiles
+    os.utime(raster, (0, os.path.getmtime(raster) + 10))
+    assert tiles.cached_tile(raster, 1, 1, 0, 'viridis', 0, 30) is not first
+
+
+def test_server(raster):
+    url = tiles.tile_url(raster, 'viridis', 0, 30)
+    assert f'mtime={os.path.getmtime(raster)}' in url
+    with urllib.request.urlopen(url.format(z=1, x=1, y=0)) as response:
+        assert response.headers['Content-Type'] == 'image/png'
+        assert png(response.read()).shape == (256, 256, 4)
+
+    unknown = url.format(z=1, x=1, y=0).replace(tiles.register(raster), '0' * 16)
+    with pytest.raises(urllib.error.HTTPError, match='404'):
+        urllib.request.urlopen(unknown)
+
+
+def test_overlay_is_cached(raster):
+    url, bounds = tiles.overlay(raster, 'viridis', size=64)
+    assert url.startswith('data:image/png;base64,')
+    assert bounds[0] == pytest.approx(0) and bounds[1] == pytest.approx(0)
+    assert tiles.overlay(raster, 'viridis', size=64)[0] is url
+    # Approximate statistics, from the overviews
+    low, high = tiles.value_range(raster, os.path.getmtime(raster))
+    assert 0 <= low < 1 and 29 < high <= 30
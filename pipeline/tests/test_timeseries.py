@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from rasterio.windows import Window
+
+import timeseries
+
+REGION = 'sniardwy'
+
+
+def scene(grid, value, nan_rows=0):
+    # Values on the region grid itself, the top rows missing (e.g. cloud)
+    image = np.full((grid['height'], grid['width']), value, dtype='float32')
+    image[:nan_rows] = np.nan
+    return image
+
+
+def test_append_skips_stored_products(tmp_path):
+    grid = timeseries.region_grid(REGION)
+    values = {'chla': scene(grid, 1.0), 'turb': scene(grid, 2.0)}
+    assert timeseries.append_scene(str(tmp_path), REGION, values, '2024-05-01', 'A.SAFE') == ['chla', 'turb']
+    # A rerun of the same product appends nothing
+    assert timeseries.append_scene(str(tmp_path), REGION, values, '2024-05-01', 'A.SAFE') == []
+
+    cube = timeseries.open_index(str(tmp_path), REGION, 'chla')
+    assert cube.sizes == {'time': 1, 'y': grid['height'], 'x': grid['width']}
+    assert timeseries.stored_products(timeseries.store_path(str(tmp_path), REGION, 'chla')) == ['A.SAFE']
+
+
+def test_same_day_scenes_merge_into_one_slice(tmp_path):
+    grid = timeseries.region_grid(REGION)
+    timeseries.append_scene(str(tmp_path), REGION, {'chla': scene(grid, 1.0, nan_rows=10)}, '2024-05-01', 'A.SAFE')
+    timeseries.append_scene(str(tmp_path), REGION, {'chla': scene(grid, 3.0)}, '2024-05-03', 'C.SAFE')
+    # Same day as A (neighbouring tile): fills A's gaps only, B is appended out of order
+    timeseries.append_scene(str(tmp_path), REGION, {'chla': scene(grid, 5.0)}, '2024-05-01', 'A2.SAFE')
+    timeseries.append_scene(str(tmp_path), REGION, {'chla': scene(grid, 2.0)}, '2024-05-02', 'B.SAFE')
+
+    cube = timeseries.open_index(str(tmp_path), REGION, 'chla')
+    assert list(cube.indexes['time']) == list(pd.to_datetime(['2024-05-01', '2024-05-02', '2024-05-03']))
+    first = cube.isel(time=0).values
+    assert (first[:10] == 5.0).all() and (first[10:] == 1.0).all()
+    assert timeseries.stored_products(timeseries.store_path(str(tmp_path), REGION, 'chla')) == [
+        'A.SAFE', 'C.SAFE', 'A2.SAFE', 'B.SAFE']
+
+    lon, lat = 21.72, 53.75
+    np.testing.assert_array_equal(timeseries.point_series(cube, lon, lat).values, [1.0, 2.0, 3.0])
+
+
+def test_regrid_tiles_match_the_whole_scene():
+    grid = timeseries.region_grid(REGION)
+    rng = np.random.default_rng(0)
+    values = {'chla': rng.random((grid['height'], grid['width']), dtype='float32')}
+    whole = timeseries.regrid(values, grid['crs'], grid['transform'], None, grid)
+
+    tiled = None
+    for row in range(0, grid['height'], 256):
+        for col in range(0, grid['width'], 256):
+            window = Window(col, row, min(256, grid['width'] - col), min(256, grid['height'] - row))
+            tile = {'chla': values['chla'][window.toslices()]}
+            tiled = timeseries.regrid(tile, grid['crs'], grid['transform'], window, grid, tiled)
+    np.testing.assert_array_equal(tiled['chla'], whole['chla'])
+    np.testing.assert_array_equal(whole['chla'], values['chla'])
+
+
+def test_regrid_outside_the_region():
+    grid = timeseries.region_grid(REGION)
+    other = timeseries.region_grid('krakow')
+    values = {'chla': np.ones((other['height'], other['width']), dtype='float32')}
+    assert timeseries.regrid(values, other['crs'], other['transform'], None, grid) is None
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import upscale
+
+
+@pytest.mark.parametrize('length, tile, overlap', [(100, 128, 16), (128, 128, 16), (300, 128, 16), (1000, 64, 8)])
+def test_tile_offsets_cover_the_axis(length, tile, overlap):
+    offsets = upscale.tile_offsets(length, tile, overlap)
+    assert offsets[0] == 0 and offsets[-1] == max(0, length - tile)
+    # Neighbours overlap by at least overlap pixels
+    assert all(0 < b - a <= tile - overlap for a, b in zip(offsets, offsets[1:]))
+
+
+@pytest.mark.parametrize('length, tile, overlap', [(300, 128, 16), (200, 64, 20), (128, 128, 16)])
+def test_blend_weights_sum_to_one(length, tile, overlap):
+    weights = upscale.blend_weights(tile, overlap, upscale.SCALE)
+    assert weights.shape == (tile * upscale.SCALE,) * 2 and weights.min() > 0 and weights.max() == 1
+    offsets = [(row, col) for row in upscale.tile_offsets(length, tile, overlap)
+               for col in upscale.tile_offsets(length, tile, overlap)]
+
+    # Every output pixel is covered, and the normalized weights of its tiles add up to 1
+    total = np.zeros((length * upscale.SCALE,) * 2, dtype=np.float32)
+    for row, col in offsets:
+        total[row * upscale.SCALE:(row + tile) * upscale.SCALE, col * upscale.SCALE:(col + tile) * upscale.SCALE] += weights
+    normalized = np.zeros_like(total)
+    for row, col in offsets:
+        rows = slice(row * upscale.SCALE, (row + tile) * upscale.SCALE)
+        cols = slice(col * upscale.SCALE, (col + tile) * upscale.SCALE)
+        normalized[rows, cols] += weights / total[rows, cols]
+    np.testing.assert_allclose(normalized, 1, rtol=1e-6)
+
+
+def nearest_model(batch):
+    # Stands in for SEN2SR: x4 nearest upsampling, so blending must give the input back
+    import torch
+
+    return torch.nn.functional.interpolate(batch, scale_factor=upscale.SCALE, mode='nearest')
+
+
+def test_super_resolve(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 3000, (4, 150, 170)).astype('uint16')
+    profile = {'driver': 'GTiff', 'width': 170, 'height': 150, 'count': 4, 'dtype': 'uint16',
+               'crs': 'EPSG:32634', 'transform': from_origin(400000, 5600000, 10, 10)}
+    with rasterio.open(tmp_path / 's2.tif', 'w', **profile) as dst:
+        dst.write(data)
+    (tmp_path / 'model').mkdir()
+    (tmp_path / 'model' / 'mlm.json').write_text('{}')
+    options = dict(model=nearest_model, model_dir=str(tmp_path / 'model'), tile=64, overlap=8,
+                   batch_size=3, cache_dir=str(tmp_path / 'cache'))
+
+    computed = upscale.super_resolve(str(tmp_path / 's2.tif'), str(tmp_path / 'sr.tif'), **options)
+    assert computed == len(upscale.tile_offsets(150, 64, 8)) * len(upscale.tile_offsets(170, 64, 8))
+    with rasterio.open(tmp_path / 'sr.tif') as src:
+        assert src.descriptions == tuple(upscale.MODEL_BANDS)
+        assert src.res == (2.5, 2.5) and src.bounds == pytest.approx((400000, 5598500, 401700, 5600000))
+        np.testing.assert_array_equal(src.read(), data.repeat(4, axis=1).repeat(4, axis=2))
+
+    # Rerun: every tile comes from the cache
+    assert upscale.super_resolve(str(tmp_path / 's2.tif'), str(tmp_path / 'sr.tif'), **options) == 0
+
+
+def test_model_version_hashes_contents(tmp_path):
+    (tmp_path / 'mlm.json').write_text('{"a": 1}')
+    first = upscale.model_version(str(tmp_path))
+    assert upscale.model_version(str(tmp_path)) == first
+    (tmp_path / 'weights.pt').write_bytes(b'\0' * 10)
+    second = upscale.model_version(str(tmp_path))
+    # Same size, other contents: only the mtime tells the memo the file changed
+    (tmp_path / 'weights.pt').write_bytes(b'\1' * 10)
+    os.utime(tmp_path / 'weights.pt', ns=(0, os.stat(tmp_path / 'weights.pt').st_mtime_ns + 10 ** 9))
+    assert len({first, second, upscale.model_version(str(tmp_path))}) == 3
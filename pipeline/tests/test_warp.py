@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from rasterio.windows import Window
+
+import benchmark
+import se2waq
+import warp
+
+
+@pytest.fixture(scope='module')
+def scene(tmp_path_factory):
+    # Large enough for several WARP_BLOCK blocks and a downsampling bilinear warp
+    return benchmark.make_scene(str(tmp_path_factory.mktemp('scene')), size=700, driver='GTiff')
+
+
+@pytest.mark.parametrize('tile_size', [100, warp.WARP_BLOCK, 300, 512])
+def test_windows_stitch_to_the_full_read(scene, tile_size):
+    with warp.open_stack(scene) as stack:
+        full = warp.read(stack)
+        profile = stack['profile']
+        stitched = {band: np.zeros_like(data) for band, data in full.items()}
+        for window in se2waq.iter_windows(profile['width'], profile['height'], tile_size):
+            for band, data in warp.read(stack, window).items():
+                stitched[band][window.toslices()] = data
+
+    for band in full:
+        np.testing.assert_array_equal(stitched[band], full[band], err_msg=band)
+
+
+def test_read_blocks_matches_the_warped_vrt(scene):
+    # A window inside one block is warped exactly like a direct read of that block
+    with warp.open_stack(scene) as stack:
+        vrt = stack['vrts']['reflectance']
+        window = Window(0, 0, warp.WARP_BLOCK, warp.WARP_BLOCK)
+        np.testing.assert_array_equal(warp.read_blocks(vrt, window), vrt.read(window=window))
@@ -0,0 +1,91 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from shapely.geometry import box
+
+import scales
+import zonal
+
+CRS_3857 = CRS.from_epsg(3857)
+TRANSFORM = from_origin(0, 400, 10, 10)
+SIZE = 40
+
+
+@pytest.fixture
+def water_bodies(tmp_path):
+    # Two lakes in the left and right halves of a 40 x 40 px grid, a third one off the grid
+    path = str(tmp_path / 'lakes.parquet')
+    gpd.GeoDataFrame({'id': [7, 8, 9], 'name': ['west', 'east', 'far']},
+                     geometry=[box(0, 0, 200, 400), box(200, 0, 400, 400), box(1000, 1000, 1100, 1100)],
+                     crs='EPSG:3857').to_parquet(path)
+    return path
+
+
+def scene(seed=0):
+    rng = np.random.default_rng(seed)
+    values = {'chla': rng.lognormal(2, 1, (SIZE, SIZE)).astype('float32')}
+    values['chla'][:5, :5] = np.nan
+    scl = np.full((SIZE, SIZE), 6, dtype='uint8')
+    scl[:5, :5] = 9
+    return scl, values
+
+
+def test_group_quantiles_match_np_quantile():
+    rng = np.random.default_rng(1)
+    groups = [rng.lognormal(1, 1, 5000), rng.uniform(10, 50, 3000), rng.normal(-3, 0.5, 2000)]
+    keys = np.concatenate([label * scales.BINS + scales.bin_index(values) for label, values in enumerate(groups, 1)])
+    keys, counts = zonal.merge_histograms(keys, np.ones(len(keys), 'int64'))
+    for q in (0.1, 0.5, 0.9):
+        expected = [np.quantile(values, q) for values in groups]
+        # Exact to a histogram bin: 0.35 % of the value
+        np.testing.assert_allclose(zonal.group_quantiles(keys, counts, q), expected, rtol=0.004)
+
+
+def test_tiles_add_up_to_the_whole_scene(water_bodies):
+    scl, values = scene()
+    whole = zonal.sample(water_bodies, CRS_3857, TRANSFORM, None, scl, values)
+    total = None
+    for row in range(0, SIZE, 16):
+        for col in range(0, SIZE, 16):
+            window = Window(col, row, min(16, SIZE - col), min(16, SIZE - row))
+            rows, cols = window.toslices()
+            total = zonal.add(total, zonal.sample(water_bodies, CRS_3857, TRANSFORM, window, scl[rows, cols],
+                                                  {'chla': values['chla'][rows, cols]}))
+
+    for key in ('observed', 'cloud'):
+        np.testing.assert_array_equal(total[key], whole[key])
+    for key in ('count', 'keys', 'counts'):
+        np.testing.assert_array_equal(total['chla'][key], whole['chla'][key])
+    np.testing.assert_allclose(total['chla']['sum'], whole['chla']['sum'])
+
+
+def test_summarize(water_bodies):
+    scl, values = scene()
+    stats = zonal.sample(water_bodies, CRS_3857, TRANSFORM, None, scl, values)
+    table = zonal.summarize(stats, water_bodies, ['chla'], '2024-05-01', 'A.SAFE')
+
+    assert list(table.columns) == zonal.COLUMNS
+    # The lake off the grid is not seen by the scene
+    assert list(table['water_body_id']) == [7, 8]
+    west = values['chla'][:, :20]
+    row = table.iloc[0]
+    assert row['count'] == np.isfinite(west).sum() == SIZE * 20 - 25
+    assert row['mean'] == pytest.approx(np.nanmean(west), rel=1e-6)
+    assert row['median'] == pytest.approx(np.nanquantile(west, 0.5), rel=0.004)
+    assert row['cloud_fraction'] == pytest.approx(25 / (SIZE * 20))
+    assert table.iloc[1]['cloud_fraction'] == 0
+
+
+def test_write_stats_replaces_recomputed_indices(tmp_path, water_bodies):
+    scl, values = scene()
+    stats = zonal.sample(water_bodies, CRS_3857, TRANSFORM, None, scl, values)
+    table = zonal.summarize(stats, water_bodies, ['chla'], '2024-05-01', 'A.SAFE')
+    stats_dir = str(tmp_path / 'stats')
+    zonal.write_stats(table, stats_dir, 'A.SAFE')
+    zonal.write_stats(table.assign(mean=0.0), stats_dir, 'A.SAFE')
+
+    stored = zonal.read_stats(stats_dir)
+    assert len(stored) == 2 and (stored['mean'] == 0).all()
@@ -0,0 +1,185 @@
+"""Zarr time-series cubes of index values per index and region.
+
+se2waq.py appends every scene it processes (--cube-store, --regions) from the
+same float index values it stretches into the COGs, so no band is read twice:
+the values of each scene or tile are resampled (nearest) onto the fixed 20 m
+EPSG:3857 grid of every region and added to {store}/{region}/{index}.zarr as
+one (time, y, x) float32 slice (not the per-scene uint8 stretch of the COGs).
+Scenes of the same day are merged into one slice; products already in a cube
+are skipped, so appends are incremental. Chunks of 8 dates x 256 x 256 px keep
+both a single map and a multi-season pixel series to a few chunk reads.
+
+    python se2waq.py --path-list paths.txt --indices chla turb --cube-store ../cubes --regions sniardwy
+
+    import timeseries
+    chla = timeseries.open_index('../cubes', 'sniardwy', 'chla')
+    series = timeseries.point_series(chla, 21.74, 53.75)
+"""
+import contextlib
+import fcntl
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from rasterio.features import geometry_mask
+from rasterio.transform import array_bounds, from_origin
+from rasterio.warp import Resampling, reproject, transform, transform_bounds
+from rasterio.windows import transform as window_transform
+
+import warp
+
+# Regions as lon/lat bounds (west, south, east, north)
+REGIONS = {
+    'krakow': (19.77, 50.00, 20.16, 50.15),
+    'sniardwy': (21.55, 53.68, 21.90, 53.83),
+}
+
+RESOLUTION = 20
+
+TIME_CHUNK = 8
+SPACE_CHUNK = 256
+
+
+def region_grid(region):
+    """Fixed EPSG:3857 grid of a region, snapped to the resolution"""
+    west, south, east, north = transform_bounds('EPSG:4326', warp.DST_CRS, *REGIONS[region])
+    west, north = np.floor(west / RESOLUTION) * RESOLUTION, np.ceil(north / RESOLUTION) * RESOLUTION
+    width = int(np.ceil((east - west) / RESOLUTION))
+    height = int(np.ceil((north - south) / RESOLUTION))
+    return {'crs': warp.DST_CRS, 'transform': from_origin(west, north, RESOLUTION, RESOLUTION),
+            'width': width, 'height': height}
+
+
+def grid_coords(grid):
+    """Pixel centre coordinates (x, y) of a grid"""
+    t = grid['transform']
+    x = t.c + (np.arange(grid['width']) + 0.5) * t.a
+    y = t.f + (np.arange(grid['height']) + 0.5) * t.e
+    return x, y
+
+
+def store_path(store_dir, region, name):
+    return os.path.join(store_dir, region, f'{name}.zarr')
+
+
+def stored_products(path):
+    if not os.path.exists(path):
+        return []
+    return json.loads(xr.open_zarr(path).attrs.get('products', '[]'))
+
+
+def regrid(values, crs, transform, window, grid, current=None):
+    """Index values ({index: array}) of one scene (window None) or tile on a region grid
+
+    Merged into current, the arrays of earlier tiles. Returns current as-is
+    when the tile misses the grid.
+    """
+    tile_transform = transform if window is None else window_transform(window, transform)
+    height, width = next(iter(values.values())).shape
+    west, south, east, north = transform_bounds(crs, grid['crs'], *array_bounds(height, width, tile_transform))
+    t = grid['transform']
+    if east <= t.c or west >= t.c + grid['width'] * t.a or north <= t.f + grid['height'] * t.e or south >= t.f:
+        return current
+
+    if current is None:
+        current = {name: np.full((grid['height'], grid['width']), np.nan, dtype='float32') for name in values}
+    for name, image in values.items():
+        tile = np.full((grid['height'], grid['width']), np.nan, dtype='float32')
+        reproject(image, tile, src_transform=tile_transform, src_crs=crs, src_nodata=np.nan,
+                  dst_transform=grid['transform'], dst_crs=grid['crs'], dst_nodata=np.nan,
+                  resampling=Resampling.nearest)
+        current[name] = np.where(np.isnan(current[name]), tile, current[name])
+    return current
+
+
+@contextlib.contextmanager
+def locked(path):
+    # Batch workers append to the same cubes
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def append(path, name, values, date, product_id, grid):
+    """Add one scene to a cube, merging it into an existing slice of the same day"""
+    x, y = grid_coords(grid)
+    time = pd.DatetimeIndex([pd.Timestamp(date)])
+    layer = xr.Dataset({name: (('time', 'y', 'x'), values[np.newaxis])},
+                       coords={'time': time, 'y': y, 'x': x})
+    products = stored_products(path) + [product_id]
+
+    if not os.path.exists(path):
+        layer.attrs = {'crs': 'EPSG:3857', 'index': name, 'products': json.dumps(products)}
+        layer.to_zarr(path, mode='w', encoding={name: {'chunks': (TIME_CHUNK, SPACE_CHUNK, SPACE_CHUNK)}})
+        return
+
+    stored = xr.open_zarr(path)
+    times = stored.indexes['time']
+    if time[0] in times:
+        i = times.get_loc(time[0])
+        current = stored[name].isel(time=i).values
+        merged = np.where(np.isnan(current), values, current)
+        layer = layer.assign({name: (('time', 'y', 'x'), merged[np.newaxis])})
+        layer.drop_vars(['time', 'y', 'x']).to_zarr(path, region={'time': slice(i, i + 1)})
+    else:
+        # Appended in processing order, open_index sorts by time
+        layer.to_zarr(path, append_dim='time')
+
+    import zarr
+    zarr.open_group(path).attrs['products'] = json.dumps(products)
+
+
+def append_scene(store_dir, region, values, date, product_id):
+    """Append one product's values on a region grid (see regrid), returns the indices appended"""
+    grid = region_grid(region)
+    appended = []
+    for name, image in values.items():
+        path = store_path(store_dir, region, name)
+        with locked(path):
+            if product_id in stored_products(path):
+                continue
+            append(path, name, image, date, product_id, grid)
+        appended.append(name)
+    return appended
+
+
+def open_index(store_dir, region, name):
+    """Lazy (time, y, x) DataArray of one index cube, sorted by date"""
+    return xr.open_zarr(store_path(store_dir, region, name))[name].sortby('time')
+
+
+def point_series(cube, lon, lat):
+    """Values at one lon/lat point over time"""
+    (x,), (y,) = transform('EPSG:4326', 'EPSG:3857', [lon], [lat])
+    return cube.sel(x=x, y=y, method='nearest').to_series()
+
+
+def area_series(cube, geometry, crs='EPSG:4326'):
+    """Mean, median and valid-pixel count over a polygon (GeoJSON-like) per date"""
+    from shapely.geometry import mapping, shape
+    from shapely.ops import transform as transform_geometry
+
+    geometry = shape(geometry)
+    if crs != 'EPSG:3857':
+        geometry = transform_geometry(lambda xs, ys: transform(crs, 'EPSG:3857', xs, ys), geometry)
+    x, y = cube['x'].values, cube['y'].values
+    grid_transform = from_origin(x[0] - RESOLUTION / 2, y[0] + RESOLUTION / 2, RESOLUTION, RESOLUTION)
+    inside = ~geometry_mask([mapping(geometry)], (len(y), len(x)), grid_transform)
+    rows, cols = np.nonzero(inside)
+    if rows.size == 0:
+        return pd.DataFrame({'mean': [], 'median': [], 'count': []}, index=cube.indexes['time'][:0])
+
+    # Only the chunks under the polygon's bounding box are read
+    window = cube.isel(y=slice(rows.min(), rows.max() + 1), x=slice(cols.min(), cols.max() + 1)).values
+    pixels = window[:, rows - rows.min(), cols - cols.min()]
+    return pd.DataFrame({
+        'mean': np.nanmean(pixels, axis=1),
+        'median': np.nanmedian(pixels, axis=1),
+        'count': np.isfinite(pixels).sum(axis=1),
+    }, index=cube.indexes['time'])
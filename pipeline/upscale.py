@@ -0,0 +1,266 @@
+"""SEN2SR super-resolution of a Sentinel-2 AOI, tiled for CPU-only machines.
+
+Produces the 2.5 m super_res_output.tif that superres.py and the Super Image
+Resolution page use (see docs/superres.md). The AOI is cut from a 10 m
+Sentinel-2 stack and split into overlapping tiles. Tiles run through the
+SEN2SR model in batches on a configurable number of CPU threads, and the
+results are blended with weights that fade out over the overlap, so tile
+seams don't show. Every tile result is cached on disk by (scene, tile,
+model version), so an interrupted or repeated run recomputes only the tiles
+that are missing.
+
+    python upscale.py s2_10m_stack.tif super_res_output.tif --bbox 19.90 50.02 19.98 50.07 --threads 8
+
+    import upscale
+    upscale.super_resolve('s2_10m_stack.tif', 'super_res_output.tif', bounds=(19.90, 50.02, 19.98, 50.07))
+
+The input is a multi-band GeoTIFF of the bands the model expects, in its
+order (MODEL_BANDS: B04 B03 B02 B08 for the default RGBN model), as
+reflectance or L2A digital numbers (divided by 10000). The output bands are
+described with those names, so superres.py finds them. Of the Se2WaQ indices
+an RGBN product supports cdom, doc, cya and color; turb and chla need B01
+and ndci B05, which the model does not produce.
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import transform as window_transform
+from rio_cogeo.cogeo import cog_translate
+from rio_cogeo.profiles import cog_profiles
+
+import se2waq
+
+MODEL_URL = 'https://huggingface.co/tacofoundation/sen2sr/resolve/main/SEN2SRLite/NonReference_RGBN_x4/mlm.json'
+MODEL_DIR = os.environ.get('SEN2SR_MODEL', os.path.expanduser('~/.cache/se2waq/sen2sr/SEN2SRLite_RGBN'))
+CACHE_DIR = os.environ.get('SE2WAQ_SR_CACHE', os.path.expanduser('~/.cache/se2waq/sr_tiles'))
+
+# Bands of the default model, input and output in this order
+MODEL_BANDS = ['B04', 'B03', 'B02', 'B08']
+
+SCALE = 4
+
+# Input tile edge and overlap between neighbouring tiles, in 10 m pixels
+TILE_SIZE = 128
+OVERLAP = 16
+
+BATCH_SIZE = 8
+THREADS = os.cpu_count()
+
+# L2A digital numbers per unit of reflectance
+REFLECTANCE_SCALE = 10000
+
+
+def load_model(model_dir=MODEL_DIR, threads=THREADS):
+    """SEN2SR model for CPU inference, downloaded on first use"""
+    import mlstac
+    import torch
+
+    torch.set_num_threads(threads)
+    if not os.path.exists(os.path.join(model_dir, 'mlm.json')):
+        mlstac.download(file=MODEL_URL, output_dir=model_dir)
+    return mlstac.load(model_dir).compiled_model(device='cpu')
+
+
+def model_version(model_dir=MODEL_DIR):
+    """Hash of the contents of the model description and weights files, part of every tile key
+
+    The files are read once per process and version of the files (name, size, mtime).
+    """
+    files = []
+    for file in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, file)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files.append((file, stat.st_size, stat.st_mtime_ns))
+    return content_hash(model_dir, tuple(files))
+
+
+@functools.lru_cache(maxsize=8)
+def content_hash(model_dir, files):
+    digest = hashlib.sha1()
+    for file, _, _ in files:
+        digest.update(file.encode())
+        with open(os.path.join(model_dir, file), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def scene_id(src_path):
+    # The file name identifies the scene, size and mtime catch rewrites
+    stat = os.stat(src_path)
+    return f"{os.path.basename(src_path)}-{hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:8]}"
+
+
+def tile_offsets(length, tile=TILE_SIZE, overlap=OVERLAP):
+    """Start offsets of overlapping tiles along one axis, the last one flush with the end"""
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    offsets = list(range(0, length - tile, step))
+    return offsets + [length - tile]
+
+
+def blend_weights(tile=TILE_SIZE, overlap=OVERLAP, scale=SCALE):
+    """Output-resolution weights of a tile: 1 in the centre, linear fade over the overlap"""
+    size = tile * scale
+    ramp = np.ones(size, dtype=np.float32)
+    fade = overlap * scale
+    if fade:
+        edge = (np.arange(fade, dtype=np.float32) + 1) / (fade + 1)
+        ramp[:fade] = edge
+        ramp[-fade:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+
+def tile_path(cache_dir, scene, row, col, tile, version):
+    return os.path.join(cache_dir, version, scene, f"{row}_{col}_{tile}.npy")
+
+
+def read_aoi(src, bounds=None):
+    """Window of the AOI (lon/lat bounds) in a scene, the whole scene without bounds"""
+    if bounds is None:
+        return Window(0, 0, src.width, src.height)
+    window = from_bounds(*transform_bounds('EPSG:4326', src.crs, *bounds), src.transform)
+    window = window.round_offsets().round_lengths()
+    return window.intersection(Window(0, 0, src.width, src.height))
+
+
+def predict(model, batch):
+    """Model output (N, C, H * SCALE, W * SCALE) of a float32 batch"""
+    import torch
+
+    with torch.no_grad():
+        return model(torch.from_numpy(batch)).numpy().astype('float32')
+
+
+def super_resolve(src_path, dst_path, bounds=None, model=None, model_dir=MODEL_DIR, tile=TILE_SIZE,
+                  overlap=OVERLAP, batch_size=BATCH_SIZE, threads=THREADS, cache_dir=CACHE_DIR,
+                  bands=MODEL_BANDS):
+    """Write the SEN2SR output of an AOI as a COG, returns the number of tiles computed
+
+    bands are the Sentinel-2 bands of the input and of the output, in order.
+    """
+    if overlap * 2 >= tile:
+        raise ValueError("overlap must be less than half the tile size")
+    model = model or load_model(model_dir, threads)
+    version = model_version(model_dir)
+    scene = scene_id(src_path)
+
+    with rasterio.open(src_path) as src:
+        window = read_aoi(src, bounds)
+        data = src.read(window=window, masked=True).astype('float32').filled(0)
+        profile = src.profile.copy()
+        transform = window_transform(window, src.transform)
+        if src.count != len(bands):
+            raise ValueError(f"{src_path} has {src.count} bands, the model takes {len(bands)} ({' '.join(bands)})")
+        if np.issubdtype(np.dtype(src.dtypes[0]), np.integer):
+            data /= REFLECTANCE_SCALE
+    height, width = data.shape[1:]
+
+    # AOIs smaller than a tile are padded by reflection and cropped afterwards
+    padded = np.pad(data, ((0, 0), (0, max(0, tile - height)), (0, max(0, tile - width))), mode='reflect')
+    tiles = [(row, col) for row in tile_offsets(padded.shape[1], tile, overlap)
+             for col in tile_offsets(padded.shape[2], tile, overlap)]
+
+    # Tiles are keyed by their position in the scene; padded tiles also
+    # depend on the AOI size
+    if padded.shape[1:] != data.shape[1:]:
+        scene += f"-{height}x{width}"
+
+    def key(row, col):
+        return tile_path(cache_dir, scene, int(window.row_off) + row, int(window.col_off) + col, tile, version)
+
+    missing = [(row, col) for row, col in tiles if not os.path.exists(key(row, col))]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        inputs = np.stack([padded[:, row:row + tile, col:col + tile] for row, col in batch])
+        for (row, col), output in zip(batch, predict(model, inputs)):
+            path = key(row, col)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.part', 'wb') as f:
+                np.save(f, output)
+            os.replace(path + '.part', path)
+        print(f"Computed {min(start + batch_size, len(missing))}/{len(missing)} tiles ({len(tiles)} in the AOI)")
+
+    weights = blend_weights(tile, overlap, SCALE)
+    result = None
+    total = np.zeros((padded.shape[1] * SCALE, padded.shape[2] * SCALE), dtype=np.float32)
+    for row, col in tiles:
+        output = np.load(key(row, col))
+        if result is None:
+            result = np.zeros((output.shape[0],) + total.shape, dtype=np.float32)
+        rows = slice(row * SCALE, (row + tile) * SCALE)
+        cols = slice(col * SCALE, (col + tile) * SCALE)
+        result[:, rows, cols] += output * weights
+        total[rows, cols] += weights
+    result /= total
+    result = result[:, :height * SCALE, :width * SCALE]
+
+    profile.update({
+        'driver': 'GTiff',
+        'count': result.shape[0],
+        'width': width * SCALE,
+        'height': height * SCALE,
+        'transform': transform * Affine.scale(1 / SCALE),
+        'tiled': True,
+        'blockxsize': 256,
+        'blockysize': 256,
+        'compress': 'zstd',
+    })
+    if np.issubdtype(np.dtype(profile['dtype']), np.integer):
+        result = np.clip(np.round(result * REFLECTANCE_SCALE), 0, np.iinfo(profile['dtype']).max)
+    result = result.astype(profile['dtype'])
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(dst_path))) as tmpdir:
+        image_path = os.path.join(tmpdir, 'sr.tif')
+        with rasterio.open(image_path, 'w', **profile) as dst:
+            dst.write(result)
+            for band, name in enumerate(bands, 1):
+                dst.set_band_description(band, name)
+            dst.update_tags(sen2sr_model=version, sen2sr_tiles=json.dumps({'tile': tile, 'overlap': overlap}))
+        cog_translate(
+            image_path,
+            dst_path + '.part',
+            cog_profiles.get("deflate"),
+            config=se2waq.COG_CONFIG,
+            in_memory=False,
+            quiet=True
+        )
+    os.replace(dst_path + '.part', dst_path)
+    return len(missing)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SEN2SR super-resolution of a Sentinel-2 AOI on CPU")
+    parser.add_argument('src', help="10 m Sentinel-2 GeoTIFF with the model's bands")
+    parser.add_argument('dst', help="2.5 m output COG (e.g. super_res_output.tif)")
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+                        help="AOI in lon/lat (default: the whole input)")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--bands', nargs='+', default=MODEL_BANDS,
+                        help="Sentinel-2 bands of the input and output, in order (default: %(default)s)")
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE, help="input tile edge in 10 m pixels")
+    parser.add_argument('--overlap', type=int, default=OVERLAP)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--threads', type=int, default=THREADS)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    computed = super_resolve(args.src, args.dst, args.bbox, model_dir=args.model_dir, tile=args.tile_size,
+                             overlap=args.overlap, batch_size=args.batch_size, threads=args.threads,
+                             cache_dir=args.cache_dir, bands=args.bands)
+    print(f"Saved {args.dst} ({computed} tiles computed)")
+
+
+if __name__ == '__main__':
+    main()
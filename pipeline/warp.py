@@ -0,0 +1,143 @@
+"""Reprojection stage for Sentinel-2 band sets.
+
+The target grid is computed once per product. All reflectance bands are
+stacked into one multi-band VRT and warped together by a single
+multithreaded WarpedVRT (bilinear). SCL gets its own nearest-neighbour
+WarpedVRT on the same grid. Reflectance is warped in fixed WARP_BLOCK
+blocks, so a window reads the same pixels as the whole grid.
+
+Used by se2waq.py and usable directly from the notebooks:
+
+    import warp
+    with warp.open_stack({'B03': b03_href, 'B04': b04_href, 'SCL': scl_href}) as stack:
+        bands = warp.read(stack)
+"""
+import contextlib
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.io import MemoryFile
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, Resampling
+from rasterio.windows import Window
+
+DST_CRS = CRS.from_epsg(3857)
+
+# Exact warp transformer, so tiled and whole-scene reads give identical pixels
+WARP_TOLERANCE = 1e-9
+
+# Bilinear downsampling widens its kernel by a scale GDAL derives from each
+# warped chunk, so a pixel depends on the chunk it was warped in. Reflectance
+# is always warped in the blocks of this grid; se2waq's tile sizes are
+# multiples of it, so no block is warped twice.
+WARP_BLOCK = 256
+
+GDAL_TYPES = {
+    'uint8': 'Byte',
+    'uint16': 'UInt16',
+    'int16': 'Int16',
+    'float32': 'Float32',
+}
+
+
+def gdal_path(href):
+    # GDAL itself only understands /vsis3/, rasterio translates s3:// on open
+    if href.startswith('s3://'):
+        return '/vsis3/' + href[len('s3://'):]
+    return href
+
+
+def target_grid(src, dst_crs=DST_CRS):
+    """Grid (crs, transform, width, height) of a dataset reprojected to dst_crs"""
+    transform, width, height = calculate_default_transform(
+        src.crs, dst_crs, src.width, src.height, *src.bounds)
+    return {'crs': dst_crs, 'transform': transform, 'width': width, 'height': height}
+
+
+def stack_vrt(hrefs, ref):
+    """VRT XML stacking single-band rasters that share the grid of ref"""
+    bands = []
+    for i, href in enumerate(hrefs, 1):
+        bands.append(
+            f'<VRTRasterBand dataType="{GDAL_TYPES[ref.dtypes[0]]}" band="{i}">'
+            f'<SimpleSource>'
+            f'<SourceFilename relativeToVRT="0">{escape(gdal_path(href))}</SourceFilename>'
+            f'<SourceBand>1</SourceBand>'
+            f'</SimpleSource>'
+            f'</VRTRasterBand>'
+        )
+    geotransform = ', '.join(repr(v) for v in ref.transform.to_gdal())
+    return (
+        f'<VRTDataset rasterXSize="{ref.width}" rasterYSize="{ref.height}">'
+        f'<SRS>{escape(ref.crs.to_wkt())}</SRS>'
+        f'<GeoTransform>{geotransform}</GeoTransform>'
+        + ''.join(bands) +
+        '</VRTDataset>'
+    )
+
+
+@contextlib.contextmanager
+def open_stack(band_paths, dst_crs=DST_CRS, num_threads='ALL_CPUS', grid=None):
+    """Open a band set ({band: href}, SCL included) warped to a common grid
+
+    All bands must share one source grid, as the bands of a SAFE R20m folder do.
+    The grid defaults to the whole product in dst_crs, a fixed grid (see
+    target_grid) can be given instead. Yields a dict with the WarpedVRTs, the
+    band order and the output profile.
+    """
+    reflectance = [band for band in band_paths if band != 'SCL']
+
+    with contextlib.ExitStack() as stack:
+        scl = stack.enter_context(rasterio.open(band_paths['SCL']))
+        grid = grid or target_grid(scl, dst_crs)
+        warp_options = {
+            'crs': grid['crs'],
+            'transform': grid['transform'],
+            'width': grid['width'],
+            'height': grid['height'],
+            'tolerance': WARP_TOLERANCE,
+            'warp_extras': {'NUM_THREADS': num_threads},
+        }
+
+        ref = stack.enter_context(rasterio.open(band_paths[reflectance[0]]))
+        memfile = stack.enter_context(MemoryFile(stack_vrt([band_paths[b] for b in reflectance], ref).encode(), ext='.vrt'))
+        src = stack.enter_context(memfile.open())
+
+        vrts = {
+            'reflectance': stack.enter_context(WarpedVRT(
+                src, resampling=Resampling.bilinear, dtype='float32', **warp_options)),
+            'scl': stack.enter_context(WarpedVRT(
+                scl, resampling=Resampling.nearest, **warp_options)),
+        }
+
+        profile = scl.meta.copy()
+        profile.update(grid)
+        yield {'vrts': vrts, 'bands': reflectance, 'profile': profile}
+
+
+def read_blocks(vrt, window=None):
+    """Read a window (default: the whole grid) of vrt warped block by block"""
+    window = window or Window(0, 0, vrt.width, vrt.height)
+    col_off, row_off = int(window.col_off), int(window.row_off)
+    col_end, row_end = col_off + int(window.width), row_off + int(window.height)
+    data = np.empty((vrt.count, row_end - row_off, col_end - col_off), dtype=vrt.dtypes[0])
+    for row in range(row_off - row_off % WARP_BLOCK, row_end, WARP_BLOCK):
+        for col in range(col_off - col_off % WARP_BLOCK, col_end, WARP_BLOCK):
+            block = vrt.read(window=Window(
+                col, row, min(WARP_BLOCK, vrt.width - col), min(WARP_BLOCK, vrt.height - row)))
+            top, bottom = max(row, row_off), min(row + WARP_BLOCK, row_end)
+            left, right = max(col, col_off), min(col + WARP_BLOCK, col_end)
+            data[:, top - row_off:bottom - row_off, left - col_off:right - col_off] = \
+                block[:, top - row:bottom - row, left - col:right - col]
+    return data
+
+
+def read(stack, window=None):
+    """Warped band arrays ({band: array}) of the whole grid or of one window"""
+    data = read_blocks(stack['vrts']['reflectance'], window)
+    bands = dict(zip(stack['bands'], data))
+    # Nearest neighbour has no kernel to scale, SCL windows are read directly
+    bands['SCL'] = stack['vrts']['scl'].read(1, window=window)
+    return bands
@@ -0,0 +1,215 @@
+"""Per-water-body zonal statistics of the Se2WaQ/NDCI index values.
+
+Computed by se2waq.py while a scene is processed, from the same float values
+that are stretched into the COGs: every lake/river polygon is rasterized onto
+the scene (or tile) grid once, and every tile is reduced in one vectorized
+pass to mergeable per-polygon counts, sums and value histograms (scales.py
+bins), so memory does not grow with the pixels of a scene. Mean, median,
+p10/p90, valid-pixel count and cloud fraction come out of the merged
+statistics; the quantiles are exact to a histogram bin (about 0.35 %).
+One small Parquet file per product is written to the stats directory, keyed by
+water body, date and index; read_stats() loads the whole table.
+
+    python se2waq.py --path-list paths.txt --water-bodies jeziora.gpkg --output ../
+    python zonal.py ../zonal_stats  # merge the per-product files into one
+
+    import zonal
+    stats = zonal.read_stats('../zonal_stats')
+"""
+import functools
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from rasterio.features import rasterize
+from rasterio.transform import array_bounds
+from rasterio.windows import transform as window_transform
+from shapely.geometry import box
+
+import scales
+
+# SCL classes counted as cloud: cloud shadow, medium/high probability, cirrus
+SCL_CLOUD = [3, 8, 9, 10]
+
+QUANTILES = {'p10': 0.1, 'median': 0.5, 'p90': 0.9}
+
+COLUMNS = ['water_body_id', 'name', 'date', 'product_id', 'index_name',
+           'mean', 'median', 'p10', 'p90', 'count', 'cloud_fraction']
+
+MERGED_FILE = 'zonal_stats.parquet'
+
+
+@functools.lru_cache(maxsize=4)
+def load_water_bodies(path):
+    """Water body polygons with water_body_id (the file's id column) and name"""
+    water_bodies = gpd.read_parquet(path) if path.endswith('.parquet') else gpd.read_file(path)
+    water_bodies = water_bodies.reset_index(drop=True)
+    water_bodies['water_body_id'] = water_bodies['id'] if 'id' in water_bodies else water_bodies.index
+    if 'name' not in water_bodies:
+        water_bodies['name'] = None
+    return water_bodies[['water_body_id', 'name', 'geometry']]
+
+
+@functools.lru_cache(maxsize=16)
+def projected_water_bodies(path, crs_wkt):
+    return load_water_bodies(path).to_crs(crs_wkt)
+
+
+def sample(water_bodies_path, crs, transform, window, scl, values):
+    """Statistics of the pixels of one scene (window None) or tile per water body
+
+    Arrays are indexed by the row of the water bodies + 1 (0: no water body):
+    'observed' and 'cloud' pixel counts, and per index the 'count' and 'sum'
+    of the finite values and a sparse histogram, the occupied (row + 1, bin)
+    'keys' (row * BINS + bin) with their 'counts'. Tiles merge with add().
+    """
+    projected = projected_water_bodies(water_bodies_path, crs.to_wkt())
+    n = len(projected) + 1
+    tile_transform = transform if window is None else window_transform(window, transform)
+    rows = projected.sindex.query(box(*array_bounds(*scl.shape, tile_transform)), predicate='intersects')
+
+    if len(rows) == 0:
+        labels = np.zeros(scl.shape, 'int32')
+    else:
+        labels = rasterize(
+            ((projected.geometry.iloc[row], row + 1) for row in rows),
+            out_shape=scl.shape, transform=tile_transform, fill=0, dtype='int32'
+        )
+    inside = labels > 0
+    label = labels[inside]
+    scl_inside = scl[inside]
+    valid = scl_inside != 0
+    stats = {
+        'observed': np.bincount(label[valid], minlength=n),
+        'cloud': np.bincount(label[valid & np.isin(scl_inside, SCL_CLOUD)], minlength=n),
+    }
+    for name, image in values.items():
+        image = image[inside]
+        finite = np.isfinite(image)
+        keys, counts = np.unique(label[finite].astype('int64') * scales.BINS + scales.bin_index(image[finite]),
+                                 return_counts=True)
+        stats[name] = {
+            'count': np.bincount(label[finite], minlength=n),
+            'sum': np.bincount(label[finite], weights=image[finite].astype('float64'), minlength=n),
+            'keys': keys,
+            'counts': counts.astype('int64'),
+        }
+    return stats
+
+
+def merge_histograms(keys, counts):
+    """Sparse histogram with the counts of repeated keys added up, sorted by key"""
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=counts, minlength=len(keys)).astype('int64')
+
+
+def add(total, stats):
+    """Merge the statistics of a tile into those of the tiles before it (None at first)"""
+    if total is None:
+        return stats
+    merged = {'observed': total['observed'] + stats['observed'], 'cloud': total['cloud'] + stats['cloud']}
+    for name, index_stats in stats.items():
+        if name in merged:
+            continue
+        keys, counts = merge_histograms(np.concatenate([total[name]['keys'], index_stats['keys']]),
+                                        np.concatenate([total[name]['counts'], index_stats['counts']]))
+        merged[name] = {
+            'count': total[name]['count'] + index_stats['count'],
+            'sum': total[name]['sum'] + index_stats['sum'],
+            'keys': keys,
+            'counts': counts,
+        }
+    return merged
+
+
+def group_quantiles(keys, counts, q):
+    """q-quantile per label of a sparse (label, bin) histogram, labels in ascending order
+
+    Linear within the bin, like scales.quantile.
+    """
+    if len(keys) == 0:
+        return np.zeros(0)
+    labels = keys // scales.BINS
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    totals = np.add.reduceat(counts, starts)
+    cumulative = np.cumsum(counts)
+    target = cumulative[starts] - counts[starts] + q * totals
+    i = np.maximum(np.searchsorted(cumulative, target), starts)
+    before = cumulative[i] - counts[i]
+    return scales.bin_value(keys[i] % scales.BINS + (target - before) / counts[i])
+
+
+def summarize(stats, water_bodies_path, indices, date, product_id):
+    """One row per water body and index seen by the scene"""
+    bodies = load_water_bodies(water_bodies_path)
+    observed = stats['observed']
+    cloud_fraction = stats['cloud'] / np.maximum(observed, 1)
+
+    frames = []
+    for name in indices:
+        index_stats = stats[name]
+        counts = index_stats['count']
+        present = np.nonzero(counts)[0]
+        values = {
+            'mean': index_stats['sum'][present] / counts[present],
+            'count': counts[present],
+        }
+        for column, q in QUANTILES.items():
+            values[column] = group_quantiles(index_stats['keys'], index_stats['counts'], q)
+
+        # Bodies seen without valid water pixels (e.g. under cloud) get count 0
+        seen = np.union1d(present, np.nonzero(observed)[0])
+        seen = seen[seen > 0]
+        frame = pd.DataFrame(values, index=present).reindex(seen)
+        frame['count'] = frame['count'].fillna(0).astype('int64')
+        frame['cloud_fraction'] = cloud_fraction[seen]
+        frame['water_body_id'] = bodies['water_body_id'].values[seen - 1]
+        frame['name'] = bodies['name'].values[seen - 1]
+        frame['index_name'] = name
+        frames.append(frame)
+
+    table = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    table['date'] = pd.Timestamp(date).date()
+    table['product_id'] = product_id
+    return table[COLUMNS]
+
+
+def write_stats(table, stats_dir, product_id):
+    """Store the rows of one product, replacing earlier rows of the same indices"""
+    os.makedirs(stats_dir, exist_ok=True)
+    path = os.path.join(stats_dir, f'{product_id}.parquet')
+    if os.path.exists(path):
+        previous = pd.read_parquet(path)
+        table = pd.concat([previous[~previous['index_name'].isin(table['index_name'])], table], ignore_index=True)
+    table.to_parquet(path + '.part', index=False)
+    os.replace(path + '.part', path)
+    return path
+
+
+def read_stats(stats_dir):
+    """Whole statistics table (merged file and per-product files)"""
+    # Merged file first, so products recomputed after a merge replace its rows
+    files = sorted(file for file in os.listdir(stats_dir) if file.endswith('.parquet'))
+    files = [os.path.join(stats_dir, file) for file in sorted(files, key=lambda file: file != MERGED_FILE)]
+    if not files:
+        return pd.DataFrame(columns=COLUMNS)
+    table = pd.concat([pd.read_parquet(file) for file in files], ignore_index=True)
+    return table.drop_duplicates(['water_body_id', 'product_id', 'index_name'], keep='last')
+
+
+def merge(stats_dir):
+    """Rewrite the per-product files as one compact Parquet file"""
+    table = read_stats(stats_dir)
+    merged = os.path.join(stats_dir, MERGED_FILE)
+    table.sort_values(['water_body_id', 'index_name', 'date']).to_parquet(merged + '.part', index=False)
+    os.replace(merged + '.part', merged)
+    for file in os.listdir(stats_dir):
+        if file.endswith('.parquet') and file != MERGED_FILE:
+            os.remove(os.path.join(stats_dir, file))
+    return merged
+
+
+if __name__ == '__main__':
+    print(f"Merged statistics into {merge(sys.argv[1])}")